@@ -0,0 +1,415 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Fake Kubernetes API server.
+
+Serve the part of the Kubernetes API the scheduler uses (listing nodes,
+listing and watching pods, creating pods, deleting single pods and pods by
+label and field selector) from memory. Pods go through a simplified
+lifecycle: they are bound to the first node they fit on after a start-up
+delay, run for a random time and then succeed. Every call is delayed to simulate the latency
+of a real API server and counted per verb and resource.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import BaseHTTPServer
+import collections
+import copy
+import json
+import random
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+
+# Simulated API server latency in seconds, per call
+LATENCY = 0.01
+# Seconds a pod stays Pending before it can be bound to a node
+STARTUP = 0.5
+# Mean seconds a pod runs before it succeeds, runtimes are exponential
+RUNTIME = 60.
+# Watch events kept around, older resourceVersions get a 410 Gone
+EVENTS_KEPT = 10000
+
+_SELECTOR = re.compile(r'\s*([\w./-]+)\s+in\s+\(([^)]*)\)\s*|\s*([\w./-]+)\s*=\s*([^,]*)\s*')
+
+
+def parse_cpu(cpu):
+    """Return Kubernetes CPU amounts like 500m or 2 as float."""
+    if cpu.endswith('m'):
+        return int(cpu[:-1]) / 1000.
+    return float(cpu)
+
+
+def parse_memory(memory):
+    """Return Kubernetes memory amounts like 512Mi as bytes."""
+    for suffix, multiplier in (('Ki', 1024), ('Mi', 1024 ** 2), ('Gi', 1024 ** 3)):
+        if memory.endswith(suffix):
+            return int(memory[:-2]) * multiplier
+    return int(memory)
+
+
+def parse_selector(selector):
+    """Return a label selector as a list of (label, allowed values).
+
+    Only equality (app=worker) and set-based (job_id in (1,2)) requirements
+    are supported, which is all the scheduler uses.
+    """
+    requirements, position = [], 0
+    while position < len(selector):
+        match = _SELECTOR.match(selector, position)
+        if match is None:
+            raise ValueError("Cannot parse label selector {!r}".format(selector))
+        if match.group(1):
+            values = set(v.strip() for v in match.group(2).split(',') if v.strip())
+            requirements.append((match.group(1), values))
+        else:
+            requirements.append((match.group(3), set([match.group(4).strip()])))
+        position = match.end()
+        if selector[position:position + 1] == ',':
+            position += 1
+    return requirements
+
+
+def parse_field_selector(selector):
+    """Return a field selector as a list of (path, equal, value).
+
+    Only (in)equality requirements like status.phase!=Running are supported.
+    """
+    requirements = []
+    for requirement in filter(None, (r.strip() for r in selector.split(','))):
+        if '!=' in requirement:
+            field, value = requirement.split('!=', 1)
+            requirements.append((field.strip().split('.'), False, value.strip()))
+        else:
+            field, value = requirement.split('=', 1)
+            requirements.append((field.strip().split('.'), True, value.strip().lstrip('=')))
+    return requirements
+
+
+def _field(obj, path):
+    for key in path:
+        obj = obj.get(key) if isinstance(obj, dict) else None
+    return obj
+
+
+def _requests(obj):
+    resources = obj['spec']['containers'][0].get('resources', {})
+    requests = resources.get('requests', resources.get('limits', {}))
+    return {'cpu': parse_cpu(requests.get('cpu', '0')),
+            'memory': parse_memory(requests.get('memory', '0Ki')),
+            'pods': 1}
+
+
+class Cluster(object):
+    """Nodes and pods of the fake cluster."""
+
+    def __init__(self, nodes=4, cpu=16, memory=64 * 1024, pods=110,
+                 startup=STARTUP, runtime=RUNTIME, seed=None):
+        """Create a cluster of identical nodes.
+
+        :keyword memory: Memory per node in MiB.
+        """
+        self.nodes = collections.OrderedDict()
+        for i in range(nodes):
+            self.nodes['node-{}'.format(i)] = {'cpu': float(cpu),
+                                               'memory': memory * 1024 ** 2,
+                                               'pods': pods}
+        self.startup = startup
+        self.runtime = runtime
+        self.pods = collections.OrderedDict()
+        self.calls = collections.Counter()
+        self.created = 0
+        self.deleted = 0
+        self.evicted = 0
+        self.completed = 0
+        self._random = random.Random(seed)
+        self._resource_version = 0
+        self._events = collections.deque(maxlen=EVENTS_KEPT)
+        self._changed = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _event(self, kind, obj):
+        # Called with self._changed held
+        self._resource_version += 1
+        obj['metadata']['resourceVersion'] = str(self._resource_version)
+        self._events.append((self._resource_version, {'type': kind, 'object': copy.deepcopy(obj)}))
+        self._changed.notify_all()
+
+    def node_list(self):
+        items = []
+        for name, capacity in self.nodes.items():
+            status = {'capacity': {'cpu': str(capacity['cpu']),
+                                   'memory': '{}Mi'.format(capacity['memory'] // 1024 ** 2),
+                                   'pods': str(capacity['pods'])}}
+            items.append({'metadata': {'name': name}, 'status': status})
+        return {'kind': 'NodeList', 'apiVersion': 'v1', 'metadata': {}, 'items': items}
+
+    def pod_list(self):
+        with self._changed:
+            return {'kind': 'PodList', 'apiVersion': 'v1',
+                    'metadata': {'resourceVersion': str(self._resource_version)},
+                    'items': [copy.deepcopy(p['obj']) for p in self.pods.values()]}
+
+    def create(self, obj):
+        """Create a pod, return (status code, pod or status)."""
+        name = obj['metadata']['name']
+        with self._changed:
+            if name in self.pods:
+                return 409, _status(409, 'AlreadyExists', 'pods "{}" already exists'.format(name))
+            obj['metadata']['namespace'] = 'default'
+            obj['metadata']['creationTimestamp'] = _timestamp(time.time())
+            obj['status'] = {'phase': 'Pending'}
+            self.pods[name] = {'obj': obj, 'requests': _requests(obj),
+                               'created_at': time.time(), 'finishes_at': None}
+            self.created += 1
+            self._event('ADDED', obj)
+            return 201, copy.deepcopy(obj)
+
+    def delete(self, name):
+        """Delete a pod, return (status code, pod or status)."""
+        with self._changed:
+            pod = self.pods.pop(name, None)
+            if pod is None:
+                return 404, _status(404, 'NotFound', 'pods "{}" not found'.format(name))
+            self.deleted += 1
+            if pod['obj']['status']['phase'] in ('Pending', 'Running'):
+                # Deleting unfinished pods throws their work away
+                self.evicted += 1
+            self._event('DELETED', pod['obj'])
+            return 200, copy.deepcopy(pod['obj'])
+
+    def delete_collection(self, selector, field_selector=''):
+        """Delete all pods matching the selectors, return (status code, pod list)."""
+        requirements = parse_selector(selector)
+        fields = parse_field_selector(field_selector)
+        with self._changed:
+            names = [name for name, pod in self.pods.items()
+                     if all(pod['obj']['metadata'].get('labels', {}).get(label) in values
+                            for label, values in requirements) and
+                     all((_field(pod['obj'], path) == value) == equal
+                         for path, equal, value in fields)]
+            items = [self.delete(name)[1] for name in names]
+        return 200, {'kind': 'PodList', 'apiVersion': 'v1', 'metadata': {}, 'items': items}
+
+    def events(self, resource_version, timeout):
+        """Yield watch events after resource_version for up to timeout seconds."""
+        deadline = time.time() + timeout
+        last = int(resource_version or 0)
+        while not self._stopped.is_set():
+            with self._changed:
+                gone = self._events and last < self._events[0][0] - 1
+                pending = [e for v, e in self._events if v > last]
+                if not pending and not gone:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self._changed.wait(min(remaining, 1.))
+                    continue
+                last = self._resource_version
+            if gone:
+                yield {'type': 'ERROR', 'object': _status(410, 'Gone', 'too old resource version')}
+                return
+            for event in pending:
+                yield event
+
+    def _used(self, node):
+        used = {'cpu': 0., 'memory': 0, 'pods': 0}
+        for pod in self.pods.values():
+            # Succeeded pods stay bound to their node but free their resources
+            if pod['obj']['spec'].get('nodeName') == node and \
+                    pod['obj']['status']['phase'] == 'Running':
+                for resource in used:
+                    used[resource] += pod['requests'][resource]
+        return used
+
+    def tick(self):
+        """Bind pending pods that have started up and finish pods that are done."""
+        now = time.time()
+        with self._changed:
+            used = dict((node, self._used(node)) for node in self.nodes)
+            for pod in self.pods.values():
+                obj, phase = pod['obj'], pod['obj']['status']['phase']
+                if phase == 'Pending' and now - pod['created_at'] >= self.startup:
+                    for node, capacity in self.nodes.items():
+                        if all(used[node][r] + pod['requests'][r] <= capacity[r]
+                               for r in capacity):
+                            for r in capacity:
+                                used[node][r] += pod['requests'][r]
+                            obj['spec']['nodeName'] = node
+                            obj['status'] = {'phase': 'Running', 'startTime': _timestamp(now)}
+                            pod['finishes_at'] = now + self._random.expovariate(1. / self.runtime)
+                            self._event('MODIFIED', obj)
+                            break
+                elif phase == 'Running' and now >= pod['finishes_at']:
+                    obj['status']['phase'] = 'Succeeded'
+                    self.completed += 1
+                    self._event('MODIFIED', obj)
+
+    def utilization(self):
+        """Return the share of cpu, memory and pods requested by running pods."""
+        with self._changed:
+            total = {'cpu': 0., 'memory': 0, 'pods': 0}
+            used = {'cpu': 0., 'memory': 0, 'pods': 0}
+            for node, capacity in self.nodes.items():
+                for resource in total:
+                    total[resource] += capacity[resource]
+                    used[resource] += self._used(node)[resource]
+        return dict((r, used[r] / total[r] if total[r] else 0.) for r in total)
+
+    def counters(self):
+        """Return a copy of the API calls and pod counters."""
+        with self._changed:
+            return {'calls': collections.Counter(self.calls),
+                    'created': self.created,
+                    'deleted': self.deleted,
+                    'evicted': self.evicted,
+                    'completed': self.completed}
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            self.tick()
+
+    def start(self, interval=0.1):
+        """Advance the pod lifecycle in the background."""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='fake-cluster')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._changed:
+            self._changed.notify_all()
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def _status(code, reason, message):
+    return {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure',
+            'code': code, 'reason': reason, 'message': message}
+
+
+_POD = re.compile(r'^/api/v1/namespaces/[^/]+/pods/([^/]+)$')
+_PODS = re.compile(r'^/api/v1(?:/namespaces/[^/]+)?/pods$')
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def cluster(self):
+        return self.server.cluster
+
+    def _parse(self):
+        url = urlparse.urlparse(self.path)
+        query = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).items())
+        return url.path, query
+
+    def _count(self, verb, path, query):
+        if path == '/api/v1/nodes':
+            resource = 'nodes'
+        elif query.get('watch') == 'true':
+            resource = 'watch'
+        elif _POD.match(path):
+            resource = 'pod'
+        else:
+            resource = 'pods'
+        with self.server.lock:
+            self.cluster.calls[(verb, resource)] += 1
+        time.sleep(self.server.latency)
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _watch(self, query):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        timeout = float(query.get('timeoutSeconds', 300))
+        for event in self.cluster.events(query.get('resourceVersion'), timeout):
+            self._chunk(json.dumps(event).encode('utf-8') + b'\n')
+        self._chunk(b'')
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path, query = self._parse()
+        self._count('get', path, query)
+        if path == '/api/v1/nodes':
+            self._send(200, self.cluster.node_list())
+        elif _PODS.match(path) and query.get('watch') == 'true':
+            self._watch(query)
+        elif _PODS.match(path):
+            self._send(200, self.cluster.pod_list())
+        else:
+            self._send(404, _status(404, 'NotFound', path))
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        path, query = self._parse()
+        self._count('post', path, query)
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        if _PODS.match(path):
+            self._send(*self.cluster.create(json.loads(body)))
+        else:
+            self._send(404, _status(404, 'NotFound', path))
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        path, query = self._parse()
+        self._count('delete', path, query)
+        length = int(self.headers.getheader('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        match = _POD.match(path)
+        if match is not None:
+            self._send(*self.cluster.delete(match.group(1)))
+        elif _PODS.match(path):
+            self._send(*self.cluster.delete_collection(query.get('labelSelector', ''),
+                                                       query.get('fieldSelector', '')))
+        else:
+            self._send(404, _status(404, 'NotFound', path))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Fake API server for a cluster, one thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, cluster, address=('127.0.0.1', 0), latency=LATENCY):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+        self.cluster = cluster
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Start the cluster lifecycle and serve the API in the background."""
+        self.cluster.start()
+        thread = threading.Thread(target=self.serve_forever, name='fake-kubernetes')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.cluster.stop()
+        self.shutdown()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Benchmark the PriorityScheduler.
+
+Run the PriorityScheduler with the ElephantBrain and the creators of the
+meister against a farnsworth database (see seed.py) and a fake Kubernetes
+API server (see fake_kubernetes.py), and report cycles per second, API
+calls and database queries per cycle, cluster utilization and pod churn.
+
+    python2 benchmarks/scheduler.py --cycles 20 --nodes 8 --latency 0.02
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# leave this import before everything else!
+import meister.settings
+
+import farnsworth.config
+
+# pylint: disable=ungrouped-imports
+from meister.brains.elephant import ElephantBrain
+from meister.creators.afl import AFLCreator
+from meister.creators.backdoor_submitter import BackdoorSubmitterCreator
+from meister.creators.cache import CacheCreator
+from meister.creators.colorguard import ColorGuardCreator
+from meister.creators.driller import DrillerCreator
+from meister.creators.function_identifier import FunctionIdentifierCreator
+from meister.creators.patcherex import PatcherexCreator
+from meister.creators.network_poll_creator import NetworkPollCreatorCreator
+from meister.creators.povfuzzer1 import PovFuzzer1Creator
+from meister.creators.povfuzzer2 import PovFuzzer2Creator
+from meister.creators.pov_tester import PovTesterCreator
+from meister.creators.rex import RexCreator
+from meister.creators.rop_cache import RopCacheCreator
+from meister.creators.showmap_sync import ShowmapSyncCreator
+import meister.log
+import meister.metrics as metrics
+from meister.schedulers.priority import PriorityScheduler
+# pylint: enable=ungrouped-imports
+
+import fake_kubernetes
+
+
+def creators():
+    """Return the creators the meister runs with."""
+    return [DrillerCreator(),
+            RexCreator(),
+            PovFuzzer1Creator(),
+            PovFuzzer2Creator(),
+            ColorGuardCreator(),
+            AFLCreator(),
+            BackdoorSubmitterCreator(),
+            CacheCreator(),
+            RopCacheCreator(),
+            PatcherexCreator(),
+            FunctionIdentifierCreator(),
+            NetworkPollCreatorCreator(),
+            ShowmapSyncCreator(),
+            PovTesterCreator()]
+
+
+class QueryCounter(object):
+    """Count the queries run on a database.
+
+    Only queries of this process are counted, not those of creators running
+    in processes of their own (MEISTER_CREATOR_PROCESSES).
+    """
+
+    def __init__(self, database):
+        self.count = 0
+        self._lock = threading.Lock()
+        execute_sql = database.execute_sql
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.count += 1
+            return execute_sql(*args, **kwargs)
+        database.execute_sql = counted
+
+
+class Sample(object):
+    """Counters of the fake cluster and the database at one point in time."""
+
+    def __init__(self, cluster, queries):
+        counters = cluster.counters()
+        # The watch is one long-running call, not a call per cycle
+        self.calls = collections.Counter(dict((k, v) for k, v in counters['calls'].items()
+                                              if k[1] != 'watch'))
+        self.created = counters['created']
+        self.deleted = counters['deleted']
+        self.evicted = counters['evicted']
+        self.completed = counters['completed']
+        self.queries = queries.count
+        self.time = time.time()
+
+    def __sub__(self, other):
+        calls = self.calls.copy()
+        calls.subtract(other.calls)
+        return {'seconds': self.time - other.time,
+                'api_calls': dict(('{} {}'.format(*k), v) for k, v in calls.items() if v),
+                'api_calls_total': sum(calls.values()),
+                'queries': self.queries - other.queries,
+                'created': self.created - other.created,
+                'deleted': self.deleted - other.deleted,
+                'evicted': self.evicted - other.evicted,
+                'completed': self.completed - other.completed}
+
+
+def _last_line(path):
+    with open(path) as f:
+        lines = f.readlines()
+    return json.loads(lines[-1]) if lines else {}
+
+
+def run(scheduler, cluster, queries, cycles, metrics_file):
+    """Run the scheduler for a number of cycles, return one dict per cycle."""
+    results = []
+    for i in range(cycles):
+        before = Sample(cluster, queries)
+        scheduler.run()
+        result = Sample(cluster, queries) - before
+        result['cycle'] = i
+        result['utilization'] = cluster.utilization()
+        cycle = _last_line(metrics_file)
+        result['phases'] = cycle.get('phases', {})
+        result['jobs'] = cycle.get('jobs', {})
+        results.append(result)
+        print("cycle {cycle:3d}: {seconds:7.3f}s, {api_calls_total:4d} API calls, "
+              "{queries:5d} queries, {created:3d} created, {evicted:3d} evicted, "
+              "cpu {cpu:.0%}".format(cpu=result['utilization']['cpu'], **result))
+        scheduler.sleep()
+    return results
+
+
+def _mean(values):
+    values = list(values)
+    return sum(values) / len(values) if values else 0.
+
+
+def summarize(results):
+    """Return the averages over all cycles."""
+    seconds = sum(r['seconds'] for r in results)
+    phases = sorted(set(p for r in results for p in r['phases']))
+    kinds = sorted(set(k for r in results for k in r['api_calls']))
+    return collections.OrderedDict([
+        ('cycles', len(results)),
+        ('cycles_per_second', len(results) / seconds if seconds else 0.),
+        ('seconds_per_cycle', _mean(r['seconds'] for r in results)),
+        ('phase_seconds', dict((p, _mean(r['phases'].get(p, 0.) for r in results))
+                               for p in phases)),
+        ('api_calls_per_cycle', _mean(r['api_calls_total'] for r in results)),
+        ('api_calls_per_cycle_by_kind', dict((k, _mean(r['api_calls'].get(k, 0) for r in results))
+                                             for k in kinds)),
+        ('queries_per_cycle', _mean(r['queries'] for r in results)),
+        ('utilization', dict((resource, _mean(r['utilization'][resource] for r in results))
+                             for resource in ('cpu', 'memory', 'pods'))),
+        ('created_per_cycle', _mean(r['created'] for r in results)),
+        ('evicted_per_cycle', _mean(r['evicted'] for r in results)),
+        ('churn_per_cycle', _mean(r['created'] + r['deleted'] for r in results))])
+
+
+def main(args=None):
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="cycles left out of the summary")
+    parser.add_argument('--sleepytime', type=float, default=1.,
+                        help="seconds between cycles")
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--node-cpu', type=int, default=16)
+    parser.add_argument('--node-memory', type=int, default=64 * 1024, help="MiB")
+    parser.add_argument('--latency', type=float, default=fake_kubernetes.LATENCY,
+                        help="seconds per API call")
+    parser.add_argument('--startup', type=float, default=fake_kubernetes.STARTUP,
+                        help="seconds until a pod is running")
+    parser.add_argument('--runtime', type=float, default=fake_kubernetes.RUNTIME,
+                        help="mean seconds a pod runs")
+    parser.add_argument('--seed', type=int, default=None, help="random seed")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--log-level', default='WARNING')
+    options = parser.parse_args(args)
+
+    meister.log.LOG.setLevel(options.log_level)
+    logging.getLogger('peewee').setLevel(options.log_level)
+
+    cluster = fake_kubernetes.Cluster(nodes=options.nodes, cpu=options.node_cpu,
+                                      memory=options.node_memory, startup=options.startup,
+                                      runtime=options.runtime, seed=options.seed)
+    server = fake_kubernetes.Server(cluster, latency=options.latency).start()
+    os.environ['KUBERNETES_SERVICE_HOST'] = server.server_address[0]
+    os.environ['KUBERNETES_SERVICE_PORT'] = str(server.port)
+    os.environ.pop('KUBERNETES_SERVICE_USE_SSL', None)
+
+    # Settings the scheduler needs, unless they are in the environment or .env
+    for name, value in (('MEISTER_OVERPROVISIONING', '1.5'),
+                        ('MEISTER_PRIORITY_STAGGERING', '8'),
+                        ('MEISTER_PRIORITY_STAGGER_FACTOR', '1.1'),
+                        ('WORKER_IMAGE', 'worker'),
+                        ('WORKER_IMAGE_PULL_POLICY', 'Always')):
+        os.environ.setdefault(name, value)
+
+    metrics_file = tempfile.NamedTemporaryFile(prefix='meister-benchmark-', suffix='.jsonl',
+                                               delete=False).name
+    metrics.METRICS_FILE = metrics_file
+    queries = QueryCounter(farnsworth.config.master_db)
+
+    try:
+        scheduler = PriorityScheduler(ElephantBrain(), creators(), sleepytime=options.sleepytime)
+        results = run(scheduler, cluster, queries, options.cycles, metrics_file)
+    finally:
+        server.stop()
+        os.unlink(metrics_file)
+
+    summary = summarize(results[options.warmup:] or results)
+    print(json.dumps(summary, indent=2))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'options': vars(options), 'summary': summary, 'cycles': results},
+                      f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
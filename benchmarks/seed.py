@@ -0,0 +1,105 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Seed a farnsworth database with a synthetic game.
+
+Create one round, our team and a number of opponents, and challenge sets
+fielded by all teams, each with one binary, an AFL job and its tests and
+crashes. The database is expected to be empty with the farnsworth schema
+in place, it is configured through the usual POSTGRES_* variables.
+
+    python2 benchmarks/seed.py --challenge-sets 50 --crashes 200 --tests 500
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+# leave this import before everything else!
+import meister.settings
+
+import farnsworth.config
+from farnsworth.models import (AFLJob,
+                               ChallengeBinaryNode,
+                               ChallengeSet,
+                               ChallengeSetFielding,
+                               Crash,
+                               Round,
+                               Team,
+                               Test)
+
+# pylint: disable=ungrouped-imports
+from meister.creators.rex import PRIORITY_MAP
+import meister.upsert as upsert
+# pylint: enable=ungrouped-imports
+
+# Crash kinds are drawn uniformly, including the ones Rex does not exploit
+KINDS = sorted(PRIORITY_MAP) + ['unknown']
+
+
+def _blob(rnd, size):
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(rnd.randint(1, size))))
+
+
+def seed(challenge_sets, crashes, tests, opponents=6, blob_size=256, random_seed=None):
+    """Create a round with challenge_sets challenge sets, return the round.
+
+    :param crashes: Crashes per challenge set.
+    :param tests: Tests per challenge set.
+    """
+    rnd = random.Random(random_seed)
+    with farnsworth.config.master_db.atomic():
+        round_ = Round.create(num=0)
+        teams = [Team.get_or_create(name=Team.OUR_NAME)[0]]
+        teams += [Team.get_or_create(name='team{}'.format(i))[0] for i in range(opponents)]
+
+        for i in range(challenge_sets):
+            cs = ChallengeSet.create(name='CBBENCH_{:05d}'.format(i))
+            blob = _blob(rnd, 64 * 1024)
+            cbn = ChallengeBinaryNode.create(name='{}_01'.format(cs.name), cs=cs, blob=blob,
+                                             sha256=hashlib.sha256(blob).hexdigest())
+            for team in teams:
+                ChallengeSetFielding.create_or_update_available(team, cbn, round_)
+            job = AFLJob.create(cs=cs, request_cpu=1, request_memory=2048)
+
+            rows = [{'cs': cs, 'job': job, 'blob': _blob(rnd, blob_size)} for _ in range(tests)]
+            for chunk in upsert.chunks(rows):
+                Test.insert_many(chunk).execute()
+
+            # A few crash sites are hit many times, like in a real game
+            sites = [rnd.randint(0x8048000, 0x8060000) for _ in range(max(1, crashes // 10))]
+            rows = [{'cs': cs, 'job': job, 'blob': _blob(rnd, blob_size),
+                     'kind': rnd.choice(KINDS), 'crash_pc': rnd.choice(sites),
+                     'bb_count': rnd.randint(1, 100000)} for _ in range(crashes)]
+            for chunk in upsert.chunks(rows):
+                Crash.insert_many(chunk).execute()
+    return round_
+
+
+def main(args=None):
+    """Seed the database."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--challenge-sets', type=int, default=20)
+    parser.add_argument('--crashes', type=int, default=100, help="per challenge set")
+    parser.add_argument('--tests', type=int, default=200, help="per challenge set")
+    parser.add_argument('--opponents', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=None, help="random seed")
+    options = parser.parse_args(args)
+
+    start = time.time()
+    round_ = seed(options.challenge_sets, options.crashes, options.tests,
+                  opponents=options.opponents, random_seed=options.seed)
+    print("Seeded round #{} with {} challenge sets, {} crashes and {} tests in {:.1f}s "
+          "into {}".format(round_.num, options.challenge_sets,
+                           options.challenge_sets * options.crashes,
+                           options.challenge_sets * options.tests, time.time() - start,
+                           os.environ.get('POSTGRES_DATABASE_NAME')))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
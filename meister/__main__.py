@@ -5,6 +5,7 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import os
 import sys
 import time
 
@@ -33,18 +34,18 @@ from meister.creators.pov_tester import PovTesterCreator
 from meister.creators.rex import RexCreator
 from meister.creators.rop_cache import RopCacheCreator
 from meister.creators.showmap_sync import ShowmapSyncCreator
+from meister.leader import LeaderElection, POLL_INTERVAL
 import meister.log
+from meister.rounds import RoundWatcher
+from meister.schedulers import events
+import meister.shards as shards
 from meister.schedulers.priority import PriorityScheduler
 # pylint: enable=ungrouped-imports
 
 LOG = meister.log.LOG.getChild('main')
 
-
-def wait_for_ambassador():
-    poll_interval = 3
-    while not (Round.current_round() and Round.current_round().is_ready()):
-        LOG.info("Round data not available, waiting %d seconds", poll_interval)
-        time.sleep(poll_interval)
+# Seconds between warming up the state of a standby
+WARM_INTERVAL = float(os.environ.get('MEISTER_LEADER_WARM_INTERVAL', '30'))
 
 
 def main(args=None):
@@ -73,11 +74,49 @@ def main(args=None):
                 #CBTesterCreator(),
                 PovTesterCreator()]
     scheduler = PriorityScheduler(brain, creators)
+    # Warm up for a new round while the ambassador is getting it ready
+    watcher = RoundWatcher(prepare=lambda round_: scheduler.warm())
+
+    if shards.is_sharded():
+        # Every replica publishes the candidates of its shard, the elected
+        # placer selects from the candidates of all shards
+        placer = LeaderElection(key=shards.PLACER_LOCK)
+        while True:
+            round_ = watcher.wait()
+            LOG.info("Round #%d, shard %d of %d", round_.num,
+                     shards.SHARD_INDEX, shards.SHARD_COUNT)
+            scheduler.publish()
+            if placer.acquire():
+                scheduler.run()
+                if events.EVENT_DRIVEN:
+                    scheduler.react(proceed=placer.acquire)
+            else:
+                scheduler.sleep()
+
+    if os.environ.get('MEISTER_HA') is not None:
+        # Only the leader schedules, standbys keep their state warm to take over
+        leader = LeaderElection()
+        warmed_at = 0
+        while True:
+            if leader.acquire():
+                LOG.info("Round #%d", watcher.wait().num)
+                scheduler.run()
+                if events.EVENT_DRIVEN:
+                    scheduler.react(proceed=leader.acquire)
+                continue
+            round_ = Round.current_round()
+            if time.time() - warmed_at > WARM_INTERVAL and round_ and round_.is_ready():
+                LOG.debug("Standing by, warming up")
+                scheduler.warm()
+                warmed_at = time.time()
+            time.sleep(POLL_INTERVAL)
 
     while True:
-        wait_for_ambassador()
-        LOG.info("Round #%d", Round.current_round().num)
+        LOG.info("Round #%d", watcher.wait().num)
         scheduler.run()
+        if events.EVENT_DRIVEN:
+            # Start jobs as workers finish until the next full cycle
+            scheduler.react()
 
     return 0
 
@@ -4,6 +4,10 @@
 from __future__ import absolute_import, unicode_literals
 
 from collections import defaultdict
+import heapq
+import itertools
+import operator
+import os
 
 import farnsworth.config
 from farnsworth.models.job import (CBTesterJob,
@@ -12,20 +16,69 @@ from farnsworth.models.job import (CBTesterJob,
                                    PollCreatorJob,
                                    TesterJob)
 
+from meister.brains.runtime import BandOrder, RuntimeEstimator
+from meister.candidates import CandidateTable
 import meister.log
+import meister.upsert as upsert
 
 LOG = meister.log.LOG.getChild('brains')
 
+# Jobs of equal score buffered to order them by expected value per
+# CPU-second, larger bands delay pulling jobs from the creators.
+BAND_SIZE = int(os.environ.get('MEISTER_BAND_SIZE', '500'))
+
 
 class Brain(object):
 
     def __init__(self):
-        pass
-
-    def _sort(self, jobs):
-        raise NotImplementedError("_sort must be implemented by a brain")
+        # Individual jobs of merged TesterJobs, kept across runs
+        self.candidates = CandidateTable()
+        self.runtimes = RuntimeEstimator()
+        self.bands = BandOrder(self.runtimes)
+
+    def _score(self, job, priority):
+        """Return the score of a job, jobs with a higher score run first.
+
+        The score must not reorder the jobs of a creator with the same
+        priority, streams are merged lazily assuming that they are ordered.
+        """
+        raise NotImplementedError("_score must be implemented by a brain")
+
+    def _scored(self, index, jobs):
+        # Ties are broken by creator and by the order within a creator, jobs
+        # themselves are never compared.
+        for seq, (job, priority) in enumerate(jobs):
+            score = self._score(job, priority)
+            yield (-score, index, seq, job, score)
+
+    def _banded(self, jobs):
+        # Buffer runs of (job, score) with equal score and order them by
+        # expected value per CPU-second.
+        band = []
+        for job, score in jobs:
+            if band and (score != band[0][1] or len(band) >= BAND_SIZE):
+                for item in self.bands.order(band) if len(band) > 1 else band:
+                    yield item
+                band = []
+            band.append((job, score))
+        for item in self.bands.order(band) if len(band) > 1 else band:
+            yield item
+
+    def sort(self, streams):
+        """Merge the job streams of all creators by descending score.
+
+        Streams are iterables of (job, priority) by descending priority, see
+        meister.creators.CreatorStream. Jobs are yielded as (job, score) and
+        streams are only consumed as far as jobs are pulled, except for the
+        streams of creators whose jobs are merged into TesterJobs. Jobs of
+        equal score are ordered by expected value per CPU-second, see
+        meister.brains.runtime.
+        """
+        streams = list(streams)
+        self.runtimes.refresh()
+        self.bands.forget()
+        jobs = itertools.chain.from_iterable(s for s in streams if s.creator.merged)
 
-    def sort(self, jobs):
         # Merge jobs
         job_types_to_merge = [CBTesterJob,
                               NetworkPollSanitizerJob,
@@ -48,40 +101,47 @@ class Brain(object):
 
         # Merge jobs, to have enough resources, we assign the maximum
         # requested resources to the overall TesterJob.
-        # We want this as an atomic transaction because we are doing a
-        # lot of get_or_create()
-        with farnsworth.config.master_db.atomic():
-            for cs, job_type__jobs in jobs_to_merge.items():
-                # We are doing this manually instead of through
-                # max(key=) because it would iterate 3x over it instead.
-                for job_type, jobs in job_type__jobs.items():
-                    request_cpu = job_type.request_cpu.default
-                    request_memory = job_type.request_memory.default
-                    limit_time = job_type.limit_time.default
-                    priority = 0
-
-                    for job, job_priority in jobs:
-                        if request_cpu is not None:
-                            request_cpu = max(request_cpu, job.request_cpu)
-
-                        if request_memory is not None:
-                            request_memory = max(request_memory, job.request_memory)
-
-                        if limit_time is not None:
-                            limit_time = max(limit_time, job.limit_time)
-
-                        # Save object to DB so the worker can access it
-                        kwargs = {df.name: getattr(job, df.name) for df in job.dirty_fields}
-                        individual_job, _ = job_type.get_or_create(**kwargs)
-                        individual_job.priority = job_priority
-                        individual_job.save()
-
-                        # Update TesterJob priority accordingly
-                        priority = max(priority, job_priority)
-
-                    # Add meta job with proper payload to queue
-                    job = TesterJob(cs=cs, request_cpu=request_cpu, request_memory=request_memory,
-                                    payload={'type': job_type.worker.default})
-                    jobs_new.append((job, priority))
-
-        return self._sort(jobs_new)
+        individual_jobs = []
+        for cs, job_type__jobs in jobs_to_merge.items():
+            # We are doing this manually instead of through
+            # max(key=) because it would iterate 3x over it instead.
+            for job_type, jobs in job_type__jobs.items():
+                request_cpu = job_type.request_cpu.default
+                request_memory = job_type.request_memory.default
+                limit_time = job_type.limit_time.default
+                priority = 0
+
+                for job, job_priority in jobs:
+                    if request_cpu is not None:
+                        request_cpu = max(request_cpu, job.request_cpu)
+
+                    if request_memory is not None:
+                        request_memory = max(request_memory, job.request_memory)
+
+                    if limit_time is not None:
+                        limit_time = max(limit_time, job.limit_time)
+
+                    individual_jobs.append((job, job_priority))
+
+                    # Update TesterJob priority accordingly
+                    priority = max(priority, job_priority)
+
+                # Add meta job with proper payload to queue
+                job = TesterJob(cs=cs, request_cpu=request_cpu, request_memory=request_memory,
+                                payload={'type': job_type.worker.default})
+                jobs_new.append((job, priority))
+
+        # Save objects to DB so the worker can access them, in bulk and
+        # in short transactions to keep the time we lock the job table low.
+        self.candidates.next_cycle()
+        for chunk in upsert.chunks(individual_jobs):
+            with farnsworth.config.master_db.atomic():
+                resolved = self.candidates.resolve(chunk, refresh=False)
+                upsert.update_priorities([(job, priority) for job, priority, _ in resolved
+                                          if job.priority != priority])
+
+        jobs_new.sort(key=operator.itemgetter(1), reverse=True)
+        ordered = [s for s in streams if not s.creator.merged] + [jobs_new]
+        merged = heapq.merge(*[self._scored(i, s) for i, s in enumerate(ordered)])
+        for job, score in self._banded((job, score) for _, _, _, job, score in merged):
+            yield (job, score)
@@ -3,8 +3,6 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import operator
-
 import meister.brains
 
 LOG = meister.brains.LOG.getChild('elephant')
@@ -38,7 +36,5 @@ class ElephantBrain(meister.brains.Brain):  # pylint: disable=too-few-public-met
         #   - Do we have other unpatched/unexploited CS?
         return 1.
 
-    def _sort(self, jobs):
-        jobs = ((j, int(self._global(j) * self._local(j) * self._sanitize_component(j, p)))
-                for j, p in jobs)
-        return sorted(jobs, key=operator.itemgetter(1), reverse=True)
+    def _score(self, job, priority):
+        return int(self._global(job) * self._local(job) * self._sanitize_component(job, priority))
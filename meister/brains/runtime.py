@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Job runtime estimates.
+
+Estimate how long a job runs from the durations of completed jobs of the
+same worker type and payload features, and order jobs of equal score by
+expected value per CPU-second, shortest expected first. Jobs gain value the
+longer they wait, so that long jobs are not starved by a steady supply of
+short ones.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from collections import deque
+import os
+import time
+
+from farnsworth.models.job import Job
+
+import meister.log
+import meister.upsert as upsert
+
+LOG = meister.log.LOG.getChild('brains.runtime')
+
+# Durations kept per key, the estimate is their median
+HISTORY = 100
+# Completed jobs read at start-up, afterwards only the newly completed ones
+INITIAL_JOBS = 10000
+# Seconds we assume for jobs we know nothing about
+DEFAULT_RUNTIME = float(os.environ.get('MEISTER_RUNTIME_DEFAULT', '600'))
+# A job that waited that many seconds counts twice as much as a new one
+AGING = float(os.environ.get('MEISTER_RUNTIME_AGING', '600'))
+# Forget when we first saw a job after it was not seen for that many seconds
+FORGET_AFTER = 3600
+
+
+def features(worker, payload):
+    """Return the key of a job for runtime estimates.
+
+    Jobs of one worker type differ by the kind of payload they get (e.g.
+    the type of a TesterJob, a crash or a test for Rex and ColorGuard).
+    """
+    payload = payload or {}
+    return (worker, payload.get('type'), tuple(sorted(payload)))
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class RuntimeEstimator(object):
+    """Median durations of completed jobs per worker type and payload features."""
+
+    def __init__(self):
+        self._durations = {}
+        self._worker_durations = {}
+        self._completed_after = None
+
+    def _record(self, worker, payload, seconds):
+        for durations, key in ((self._durations, features(worker, payload)),
+                               (self._worker_durations, worker)):
+            if key not in durations:
+                durations[key] = deque(maxlen=HISTORY)
+            durations[key].append(seconds)
+
+    def refresh(self):
+        """Read the durations of jobs that completed since the last refresh."""
+        query = Job.select(Job.worker, Job.payload, Job.started_at, Job.completed_at) \
+                   .where(Job.started_at.is_null(False) & Job.completed_at.is_null(False))
+        if self._completed_after is None:
+            query = query.order_by(Job.completed_at.desc()).limit(INITIAL_JOBS)
+        else:
+            query = query.where(Job.completed_at > self._completed_after)
+
+        count = 0
+        for worker, payload, started_at, completed_at in query.tuples():
+            seconds = (completed_at - started_at).total_seconds()
+            if seconds >= 0:
+                self._record(worker, payload, seconds)
+                count += 1
+            if self._completed_after is None or completed_at > self._completed_after:
+                self._completed_after = completed_at
+        if count:
+            LOG.debug("Recorded the runtime of %d completed jobs", count)
+
+    def estimate(self, job):
+        """Return the expected runtime of job in seconds."""
+        durations = self._durations.get(features(job.worker, job.payload))
+        if durations is None:
+            durations = self._worker_durations.get(job.worker)
+        if durations:
+            return max(1., _median(durations))
+        if job.limit_time is not None:
+            return float(job.limit_time)
+        return DEFAULT_RUNTIME
+
+
+class BandOrder(object):
+    """Order jobs of equal score by expected value per CPU-second with aging."""
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+        self._first_seen = {}
+
+    def _waited(self, job, now):
+        fp = upsert.fingerprint(job)
+        first_seen, _ = self._first_seen.get(fp, (now, now))
+        self._first_seen[fp] = (first_seen, now)
+        return now - first_seen
+
+    def forget(self, now=None):
+        """Forget jobs that have not been seen for a while."""
+        now = now if now is not None else time.time()
+        for fp, (_, last_seen) in self._first_seen.items():
+            if now - last_seen > FORGET_AFTER:
+                del self._first_seen[fp]
+
+    def order(self, band, now=None):
+        """Return the (job, score) pairs of band, most value per CPU-second first.
+
+        The order is stable, so jobs that are equal keep the order of their
+        creators.
+        """
+        now = now if now is not None else time.time()
+
+        def _rate(item):
+            job, score = item
+            cpu = job.request_cpu if job.request_cpu is not None else Job.request_cpu.default
+            value = max(score, 1) * (1 + self._waited(job, now) / AGING)
+            return value / (self.estimator.estimate(job) * max(cpu, 0.1))
+
+        return sorted(band, key=_rate, reverse=True)
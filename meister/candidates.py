@@ -0,0 +1,135 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Candidate table.
+
+Remember the job row every candidate resolved to across scheduler runs, so
+that only new candidates and changed priorities touch the job table.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+from farnsworth.models.job import Job
+
+import meister.log
+import meister.upsert as upsert
+
+LOG = meister.log.LOG.getChild('candidates')
+
+# Forget candidates that no creator yielded for that many cycles
+CANDIDATE_TTL = int(os.environ.get('MEISTER_CANDIDATE_TTL', '10'))
+
+
+class CandidateTable(object):
+    """Map candidate fingerprints to their rows in the job table.
+
+    A fingerprint is the job class and the values of the dirty fields, see
+    meister.upsert.fingerprint(). The rows are kept in memory and updated in
+    place, their priority is the one last written to the job table.
+
+    While we are warming up as a standby, the leader changes priorities
+    behind our back. All rows known when warming up are read back again the
+    next time they are resolved.
+    """
+
+    def __init__(self, ttl=CANDIDATE_TTL):
+        self.ttl = ttl
+        self._cycle = 0
+        self._rows = {}
+        self._seen = {}
+        # Fingerprints of rows whose priority might be stale
+        self._stale = set()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def next_cycle(self):
+        """Start a new cycle, forgetting candidates that were not seen for a while."""
+        self._cycle += 1
+        stale = [fp for fp, seen in self._seen.items() if self._cycle - seen > self.ttl]
+        for fp in stale:
+            del self._rows[fp]
+            del self._seen[fp]
+            self._stale.discard(fp)
+        LOG.debug("%d known candidates, forgot %d", len(self._rows), len(stale))
+
+    def _refresh(self, rows):
+        # Workers complete jobs behind our back, read back their completion
+        # state and priority in one query. Rows that are gone are returned.
+        current = dict((id_, (completed_at, priority))
+                       for id_, completed_at, priority
+                       in Job.select(Job.id, Job.completed_at, Job.priority)
+                             .where(Job.id << [r.id for r in rows])
+                             .tuples())
+        gone = []
+        for row in rows:
+            if row.id in current:
+                row.completed_at, row.priority = current[row.id]
+            else:
+                gone.append(row)
+        return gone
+
+    def warm(self, candidates):
+        """Look up the rows of (job, priority) candidates without creating any.
+
+        A standby meister keeps the table warm this way, candidates that do
+        not have a row yet are left alone. The priorities of all known rows
+        are read back when they are resolved next.
+        """
+        groups = {}
+        for job, _ in candidates:
+            fp = upsert.fingerprint(job)
+            self._seen[fp] = self._cycle
+            if fp not in self._rows and job.dirty_fields:
+                groups.setdefault(type(job), []).append(job)
+
+        found = 0
+        for model, jobs in groups.items():
+            for fp, row in upsert.lookup(model, jobs).items():
+                self._rows[fp] = row
+                found += 1
+        self._stale.update(self._rows)
+        LOG.debug("Warmed up %d of %d candidates", found, len(candidates))
+
+    def resolve(self, candidates, refresh=True):
+        """Resolve (job, priority) candidates to rows in the job table.
+
+        Returns the same (job, priority, created) tuples as
+        meister.upsert.upsert(), but only unknown candidates are looked up or
+        inserted.
+
+        :keyword refresh: Read back the completion state of known rows. Rows
+                          that might be stale are read back regardless.
+        """
+        fingerprints = [upsert.fingerprint(job) for job, _ in candidates]
+        known = set(fp for fp in fingerprints if fp in self._rows)
+
+        outdated = known if refresh else known & self._stale
+        self._stale -= known
+        if outdated:
+            gone = set(id(row) for row in self._refresh([self._rows[fp] for fp in outdated]))
+            for fp in [fp for fp in outdated if id(self._rows[fp]) in gone]:
+                LOG.debug("Job id=%d disappeared from the job table", self._rows[fp].id)
+                known.discard(fp)
+                del self._rows[fp]
+
+        unknown = [c for c, fp in zip(candidates, fingerprints) if fp not in known]
+        created = {}
+        if unknown:
+            for (job, _), (row, _, is_created) in zip(unknown, upsert.upsert(unknown)):
+                created[id(job)] = (row, is_created)
+
+        resolved = []
+        for (job, priority), fp in zip(candidates, fingerprints):
+            self._seen[fp] = self._cycle
+            if id(job) in created:
+                row, is_created = created[id(job)]
+                self._rows[fp] = row
+                resolved.append((row, priority, is_created))
+            else:
+                resolved.append((self._rows[fp], priority, False))
+
+        LOG.debug("Resolved %d candidates, %d from the job table", len(candidates), len(unknown))
+        return resolved
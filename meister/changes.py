@@ -0,0 +1,202 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Change notifications for the farnsworth tables.
+
+Triggers on the tables creators depend on send a notification with the
+table and the challenge set of every changed row through Postgres
+LISTEN/NOTIFY. Creators subscribe to the tables they depend on and only
+regenerate jobs for the challenge sets that changed.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import select
+import threading
+
+import farnsworth.config
+from farnsworth.models import (ChallengeSetFielding,
+                               Crash,
+                               Exploit,
+                               RawRoundPoll,
+                               RawRoundTraffic,
+                               Round,
+                               Test)
+import psycopg2
+import psycopg2.extensions
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('changes')
+
+CHANNEL = 'meister_changes'
+
+# Tables we can subscribe to, with the name of the field pointing to the
+# challenge set, None if changes cannot be attributed to a challenge set.
+TABLES = {'crash': (Crash, 'cs'),
+          'exploit': (Exploit, 'cs'),
+          'fielding': (ChallengeSetFielding, None),
+          'raw_round_poll': (RawRoundPoll, 'cs'),
+          'raw_round_traffic': (RawRoundTraffic, None),
+          'round': (Round, None),
+          'test': (Test, 'cs')}
+
+# Changes to these tables affect every subscriber, new fieldings change the
+# set of challenge sets all creators work on.
+GLOBAL_TABLES = frozenset(['fielding'])
+
+# Even without notifications, regenerate everything after that many seconds
+# to pick up changes we do not get notified about (e.g. jobs completing).
+RESCAN_INTERVAL = int(os.environ.get('MEISTER_INCREMENTAL_RESCAN', '300'))
+
+# Transaction-level advisory lock, keeps replicas from installing the
+# triggers at the same time.
+INSTALL_LOCK = 4244
+
+# Only the challenge set column of the changed row is read, converting the
+# whole row would encode its blobs on every write.
+NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION meister_notify_change() RETURNS trigger AS $$
+DECLARE
+    cs_id TEXT;
+    query TEXT := 'SELECT ($1).' || quote_ident(TG_ARGV[1]) || '::text';
+BEGIN
+    IF TG_ARGV[1] = '' THEN
+        cs_id := NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE query INTO cs_id USING OLD;
+    ELSE
+        EXECUTE query INTO cs_id USING NEW;
+    END IF;
+    PERFORM pg_notify('{channel}', TG_ARGV[0] || ':' || COALESCE(cs_id, ''));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGER_EXISTS = """
+SELECT 1 FROM pg_trigger
+WHERE tgname = 'meister_notify_change' AND tgrelid = %s::regclass
+"""
+
+# Databases the triggers have been installed in by this process
+_installed = set()
+_install_lock = threading.Lock()
+
+
+class Subscription(object):
+    """Challenge sets that changed in the tables a creator depends on."""
+
+    def __init__(self, tables):
+        self.tables = frozenset(tables) | GLOBAL_TABLES
+        self._lock = threading.Lock()
+        # Nothing is known at the beginning, start with everything
+        self._everything = True
+        self._cs_ids = set()
+
+    def add(self, cs_id):
+        """Record a change for cs_id, None means everything changed."""
+        with self._lock:
+            if cs_id is None:
+                self._everything = True
+            else:
+                self._cs_ids.add(cs_id)
+
+    def consume(self):
+        """Return and reset the changes as (everything, cs_ids)."""
+        with self._lock:
+            changes = (self._everything, self._cs_ids)
+            self._everything, self._cs_ids = False, set()
+        return changes
+
+
+class ChangeFeed(object):
+    """Dispatch change notifications to subscriptions."""
+
+    def __init__(self, database=None):
+        self.database = database if database is not None else farnsworth.config.master_db
+        self._connection = None
+        self._subscriptions = []
+
+    def install(self):
+        """Install the notification triggers on all tables.
+
+        Triggers are only created where they do not exist yet, and only once
+        per process and database.
+        """
+        with _install_lock:
+            if self.database.database in _installed:
+                return
+            created = []
+            with self.database.atomic():
+                self.database.execute_sql('SELECT pg_advisory_xact_lock(%s)', (INSTALL_LOCK,))
+                self.database.execute_sql(NOTIFY_FUNCTION.format(channel=CHANNEL))
+                for name, (model, cs_field) in sorted(TABLES.items()):
+                    table = model._meta.db_table
+                    cursor = self.database.execute_sql(TRIGGER_EXISTS, ('"{}"'.format(table),))
+                    if cursor.fetchone() is not None:
+                        continue
+                    cs_column = model._meta.fields[cs_field].db_column if cs_field else ''
+                    self.database.execute_sql(
+                        "CREATE TRIGGER meister_notify_change "
+                        "AFTER INSERT OR UPDATE OR DELETE ON \"{}\" FOR EACH ROW "
+                        "EXECUTE PROCEDURE meister_notify_change('{}', '{}')".format(
+                            table, name, cs_column))
+                    created.append(name)
+            _installed.add(self.database.database)
+        if created:
+            LOG.info("Installed change notification triggers on %s", ", ".join(created))
+
+    def listen(self):
+        """Open a dedicated connection and listen for notifications."""
+        self._connection = psycopg2.connect(database=self.database.database,
+                                            **self.database.connect_kwargs)
+        self._connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self._connection.cursor().execute('LISTEN {}'.format(CHANNEL))
+        # We might have missed notifications while we were not listening
+        for subscription in self._subscriptions:
+            subscription.add(None)
+        return self
+
+    def subscribe(self, tables):
+        """Return a subscription for changes in tables."""
+        subscription = Subscription(tables)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def _dispatch(self, payload):
+        table, _, cs_id = payload.partition(':')
+        cs_id = int(cs_id) if cs_id else None
+        if table in GLOBAL_TABLES:
+            cs_id = None
+        for subscription in self._subscriptions:
+            if table in subscription.tables:
+                subscription.add(cs_id)
+
+    def poll(self, timeout=0):
+        """Dispatch all pending notifications, waiting up to timeout seconds for one.
+
+        Returns the number of notifications dispatched.
+        """
+        if self._connection is None:
+            self.listen()
+
+        try:
+            if timeout:
+                select.select([self._connection], [], [], timeout)
+            self._connection.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            LOG.error("Lost the notification connection (%s), listening again", e)
+            self._connection = None
+            self.listen()
+            return 0
+
+        count = 0
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self._dispatch(notify.payload)
+            count += 1
+        if count:
+            LOG.debug("Dispatched %d change notifications", count)
+        return count
@@ -3,16 +3,36 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import cPickle as pickle
+import heapq
+import operator
 import os
+import Queue
+import subprocess
+import sys
+import threading
+import time
 import traceback
 
 from farnsworth.models import ChallengeBinaryNode, ChallengeSet, ChallengeSetFielding, Round, Team
 import stopit
 
+import meister.changes
 import meister.log
+import meister.upsert as upsert
+from meister.snapshots import ChallengeSetSnapshot, FieldingSnapshot
 LOG = meister.log.LOG.getChild('creators')
 
-JOBS_TIME_LIMIT = 30
+# Seconds a creator gets per run, it continues where it stopped next run
+JOBS_TIME_LIMIT = int(os.environ.get('MEISTER_JOBS_TIME_LIMIT', '30'))
+# Jobs of an ordered creator buffered ahead of the scheduler
+STREAM_QUEUE_SIZE = int(os.environ.get('MEISTER_STREAM_QUEUE_SIZE', '100'))
+# Run every creator in a process of its own instead of a thread
+CREATOR_PROCESSES = os.environ.get('MEISTER_CREATOR_PROCESSES') is not None
+# Jobs sent from a creator process to the scheduler at once, or after
+# PROCESS_BATCH_INTERVAL seconds, whatever comes first
+PROCESS_BATCH_SIZE = 50
+PROCESS_BATCH_INTERVAL = 0.5
 
 """Job creator."""
 
@@ -20,41 +40,223 @@ JOBS_TIME_LIMIT = 30
 class BaseCreator(object):
     """Abstract creator class, should be inherited by actual job creators."""
 
+    # Tables (see meister.changes.TABLES) the jobs of this creator depend on.
+    # If set and the scheduler attached a change subscription, jobs are only
+    # regenerated for the challenge sets that changed since the last run.
+    dependencies = ()
+
+    # Set if the jobs are yielded by descending priority, the scheduler then
+    # only pulls as many of them as it can run.
+    ordered = False
+
+    # Set if the jobs are merged into TesterJobs by the brain, all of them are
+    # collected every run.
+    merged = False
+
+    # Set if the jobs are generated per fielded challenge set. When candidate
+    # generation is sharded, creators that are not per challenge set only run
+    # on the first shard, see meister.shards.
+    per_challenge_set = True
+
     def __init__(self):
         """Create base creator.
 
         Create the base creator, you should call this from your creator to
         make sure that all class variables are set up properly.
         """
-        pass
+        self.changes = None
+        self._snapshot = None
+        self._fieldings = None
+        self._only_cs_ids = None
+        self._failed = False
+        self._candidates = {}
+        self._cursor = None
+        self._rescanned_at = 0
 
     @property
     def _jobs(self):
         raise NotImplementedError("You have to implemented the jobs property")
 
-    @property
-    def jobs(self):
-        yielded = False
+    def _generate(self):
+        """Yield the jobs of this run until the creator is done or out of time.
+
+        Sets _failed if the creator did not get through all challenge sets,
+        _last_cs_id is the challenge set it was working on last.
+        """
+        self._failed = False
+        self._last_cs_id = None
         try:
             with stopit.ThreadingTimeout(JOBS_TIME_LIMIT, swallow_exc=False):
-                for job_priority in self._jobs:
+                for job, priority in self._jobs:
+                    if job.cs_id is not None:
+                        self._last_cs_id = job.cs_id
                     # Pass through the actual job priority tuple
-                    yield job_priority
-                    yielded = True
+                    yield (job, priority)
+        except stopit.TimeoutException:
+            self._failed = True
+            LOG.warning("%s ran out of time after %ds", self.__class__.__name__,
+                        JOBS_TIME_LIMIT)
         except Exception, e:
             # Pokemon Exception Handling to reduce impact of bad creators.
+            self._failed = True
             LOG.error("%s failed with %s: %s", self.__class__.__name__, e.__class__.__name__, e)
             LOG.debug(traceback.format_exc())
-            if not yielded:
-                raise StopIteration()
+
+    def _collect(self):
+        fresh = {}
+        for job, priority in self._generate():
+            fresh.setdefault(job.cs_id, []).append((job, priority))
+            yield (job, priority)
+
+        jobs = fresh
+        if self._failed:
+            jobs = dict((cs_id, list(candidates)) for cs_id, candidates in fresh.items())
+            for job, priority in self._resume(fresh, self._last_cs_id, self._only_cs_ids):
+                jobs.setdefault(job.cs_id, []).append((job, priority))
+                yield (job, priority)
+        self._remember(jobs, self._only_cs_ids, complete=not self._failed)
+
+    def _resume(self, fresh, last_cs_id, cs_ids=None):
+        """Continue at last_cs_id next run, yield the cached jobs we did not get to.
+
+        :param fresh: Dict of challenge set id to the jobs yielded this run.
+        :param last_cs_id: The challenge set the creator was working on.
+        :keyword cs_ids: The challenge sets that were regenerated (default: all).
+
+        Ordered creators only continue at last_cs_id, their cached jobs would
+        come after fresh jobs of lower priority.
+        """
+        order = [cs.id for cs in self.challenge_sets()]
+        cursor = last_cs_id
+        if cursor is not None and cursor == self._cursor and cursor in order:
+            # We did not get past the first challenge set, do not get stuck on it
+            cursor = order[(order.index(cursor) + 1) % len(order)]
+        self._cursor = cursor
+
+        reached = set(cs_id for cs_id in fresh if cs_id is not None)
+        LOG.info("%s covered %d of %d challenge sets, continuing at cs=%s next run",
+                 self.__class__.__name__, len(reached), len(order), self._cursor)
+        if self.ordered:
+            return
+
+        for cs_id, candidates in self._candidates.items():
+            if cs_ids is not None and cs_id not in cs_ids:
+                continue
+            if cs_id in fresh and cs_id != last_cs_id:
+                continue
+            # The challenge set we stopped at is only partially regenerated
+            seen = set(upsert.fingerprint(job) for job, _ in fresh.get(cs_id, ()))
+            for job, priority in candidates:
+                if upsert.fingerprint(job) not in seen:
+                    yield (job, priority)
+
+    def _remember(self, jobs, cs_ids=None, complete=True):
+        """Remember the jobs of a run per challenge set.
+
+        :param jobs: Dict of challenge set id to the jobs yielded this run.
+        :keyword cs_ids: The challenge sets that were regenerated (default: all).
+        :keyword complete: The creator got through all challenge sets.
+        """
+        if complete and cs_ids is None:
+            self._candidates = jobs
+            self._cursor = None
+            return
+        if complete:
+            for cs_id in cs_ids:
+                self._candidates.pop(cs_id, None)
+        self._candidates.update(jobs)
+
+    def _regenerate(self, cs_ids=None):
+        """Regenerate the jobs for cs_ids (default: all), return whether the creator failed."""
+        self._only_cs_ids = cs_ids
+        try:
+            for _ in self._collect():
+                pass
+        finally:
+            self._only_cs_ids = None
+        return self._failed
+
+    def _collect_incremental(self, regenerate=None):
+        regenerate = regenerate if regenerate is not None else self._regenerate
+        everything, cs_ids = self.changes.consume()
+        if time.time() - self._rescanned_at > meister.changes.RESCAN_INTERVAL:
+            everything = True
+
+        if everything:
+            LOG.debug("%s regenerating all jobs", self.__class__.__name__)
+            failed = regenerate()
+            if not failed:
+                self._rescanned_at = time.time()
+            else:
+                # Try everything again next time
+                self.changes.add(None)
+        elif cs_ids:
+            LOG.debug("%s regenerating jobs for cs=%s", self.__class__.__name__,
+                      sorted(cs_ids))
+            failed = regenerate(cs_ids)
+            if failed:
+                for cs_id in cs_ids:
+                    self.changes.add(cs_id)
+
+        # Creators not filtering by challenge set regenerate more than we
+        # asked for, those jobs are just as fresh and are remembered as well.
+        jobs = [job_priority for candidates in self._candidates.values()
+                for job_priority in candidates]
+        if self.ordered:
+            # Every challenge set is in order, all of them together are not
+            jobs.sort(key=operator.itemgetter(1), reverse=True)
+        for job_priority in jobs:
+            yield job_priority
+
+    @property
+    def jobs(self):
+        if self.dependencies and self.changes is not None:
+            return self._collect_incremental()
+        return self._collect()
+
+    @property
+    def snapshot(self):
+        """Return the challenge set snapshot of the current scheduling cycle."""
+        if self._snapshot is None:
+            self._snapshot = ChallengeSetSnapshot()
+        return self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        self._snapshot = snapshot
+
+    @property
+    def fieldings(self):
+        """Return the fielding snapshot of the current scheduling cycle."""
+        if self._fieldings is None:
+            self._fieldings = FieldingSnapshot(self.snapshot)
+        return self._fieldings
+
+    @fieldings.setter
+    def fieldings(self, snapshot):
+        self._fieldings = snapshot
 
     def challenge_sets(self, round_=None):
         """Return the list of challenge sets that are active in a round.
 
+        If jobs are regenerated for some challenge sets only, only those are
+        returned. If the creator ran out of time last run, the current round's
+        challenge sets start with the one it stopped at.
+
         :keyword round_: The round number for which the binaries should be
                          returned (default: current round).
         """
-        return ChallengeSet.fielded_in_round(round_)
+        if round_ is None:
+            challenge_sets = self.snapshot.challenge_sets
+            ids = [cs.id for cs in challenge_sets]
+            if self._cursor in ids:
+                i = ids.index(self._cursor)
+                challenge_sets = challenge_sets[i:] + challenge_sets[:i]
+        else:
+            challenge_sets = ChallengeSet.fielded_in_round(round_)
+        if self._only_cs_ids is not None:
+            return [cs for cs in challenge_sets if cs.id in self._only_cs_ids]
+        return challenge_sets
 
     def single_cb_challenge_sets(self, round_=None):
         """Return the list of single-cb challenge sets that are active in a round.
@@ -62,6 +264,9 @@ class BaseCreator(object):
         :keyword round_: The round number for which the binaries should be
                          returned (default: current round).
         """
+        if round_ is None:
+            return [cs for cs in self.challenge_sets() if len(self.status(cs).cbns) == 1]
+
         csids = [cbn.cs.id for cbn in self.cbns(round_) if not cbn.cs.is_multi_cbn]
         if csids:
             return ChallengeSet.select().where(ChallengeSet.id << csids)
@@ -74,7 +279,218 @@ class BaseCreator(object):
         :keyword round_: The round instance for which the binaries should be
                          returned (default: current round).
         """
-        for cs in ChallengeSet.fielded_in_round(round_):
-            for cbn in cs.cbns_original:
+        for cs in self.challenge_sets(round_):
+            cbns = self.status(cs).cbns if round_ is None else cs.cbns_original
+            for cbn in cbns:
                 LOG.debug("Found cbid: %s", cbn.name)
                 yield cbn
+
+    def status(self, cs):
+        """Return the status of a fielded challenge set in the current round.
+
+        Prefer the status over the lazy properties of the challenge set, it is
+        shared by all creators and only read once per scheduling cycle.
+        """
+        return self.snapshot.status(cs)
+
+
+_DONE = object()
+
+
+class CreatorStream(object):
+    """Jobs of a creator by descending priority, produced in a background thread.
+
+    Jobs of ordered creators are passed through a bounded queue, the creator
+    blocks once the scheduler stops pulling. Jobs of other creators are
+    collected completely and only the limit highest priority ones are kept.
+    """
+
+    def __init__(self, creator, limit=None, queue_size=STREAM_QUEUE_SIZE):
+        self.creator = creator
+        self.limit = limit if not creator.merged else None
+        self._queue = Queue.Queue(maxsize=queue_size if creator.ordered else 0)
+        self._closed = threading.Event()
+        self._thread = None
+        self.count = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def name(self):
+        return self.creator.__class__.__name__
+
+    @property
+    def elapsed(self):
+        """Return the seconds the creator has been producing jobs so far."""
+        if self.started_at is None:
+            return 0.
+        return (self.finished_at or time.time()) - self.started_at
+
+    def start(self):
+        """Start producing jobs."""
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._produce, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop producing jobs, the creator is stopped at its next job."""
+        self._closed.set()
+
+    def _put(self, item):
+        # Block while the queue is full, but give up once we are closed
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _ordered(self, jobs):
+        last = None
+        for job, priority in jobs:
+            if last is not None and priority > last:
+                LOG.warning("%s is ordered but yielded priority %d after %d",
+                            self.name, priority, last)
+            last = priority
+            yield (job, priority)
+
+    def _jobs(self):
+        return self.creator.jobs
+
+    def _produce(self):
+        jobs = self._jobs()
+        try:
+            if self.creator.ordered:
+                ordered = self._ordered(jobs)
+            elif self.limit is None:
+                ordered = sorted(jobs, key=operator.itemgetter(1), reverse=True)
+            else:
+                ordered = heapq.nlargest(self.limit, jobs, key=operator.itemgetter(1))
+
+            for job_priority in ordered:
+                if not self._put(job_priority):
+                    LOG.debug("%s stopped, the scheduler is done", self.name)
+                    break
+                self.count += 1
+        except stopit.TimeoutException:
+            # The time limit hit while we were waiting for the scheduler
+            LOG.warning("%s timed out while waiting for the scheduler", self.name)
+        except Exception, e:
+            LOG.error("%s stream failed with %s: %s", self.name, e.__class__.__name__, e)
+            LOG.debug(traceback.format_exc())
+        finally:
+            jobs.close()
+            self.finished_at = time.time()
+            self._put(_DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+
+def _read_batches(stream, queue):
+    # Batches are pickled one after the other, EOF means the process is gone
+    try:
+        while True:
+            queue.put(pickle.load(stream))
+    except (EOFError, pickle.UnpicklingError, ValueError):
+        pass
+    finally:
+        queue.put(_DONE)
+
+
+class ProcessCreatorStream(CreatorStream):
+    """Like CreatorStream, but the creator runs in a process of its own.
+
+    The process is a fresh interpreter, see meister.creators.__main__, with
+    its own database connections. It gets the creator's class, cursor and
+    snapshots and sends back batches of jobs, everything pickled. It is
+    terminated once it exceeds the time limit, the jobs it produced until
+    then are kept. The jobs are remembered per challenge set in the
+    scheduler, see BaseCreator._remember().
+    """
+
+    def _start_process(self, cs_ids):
+        cls = type(self.creator)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'meister.creators',
+             '{}:{}'.format(cls.__module__, cls.__name__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        pickle.dump({'cursor': self.creator._cursor,
+                     'cs_ids': cs_ids,
+                     'snapshot': self.creator.snapshot,
+                     'fieldings': self.creator.fieldings},
+                    process.stdin, pickle.HIGHEST_PROTOCOL)
+        process.stdin.close()
+        return process
+
+    def _run(self, cs_ids=None):
+        process = self._start_process(cs_ids)
+        # The queue holds batches of jobs
+        queue = Queue.Queue(
+            maxsize=(self._queue.maxsize + PROCESS_BATCH_SIZE - 1) // PROCESS_BATCH_SIZE)
+        reader = threading.Thread(target=_read_batches, args=(process.stdout, queue),
+                                  name='{}-reader'.format(self.name))
+        reader.daemon = True
+        reader.start()
+
+        deadline = time.time() + JOBS_TIME_LIMIT
+        jobs, last_cs_id, done, batch = {}, None, None, None
+        self.failed = True
+        try:
+            while not self._closed.is_set():
+                if time.time() > deadline:
+                    LOG.error("%s exceeded %ds, terminating it", self.name, JOBS_TIME_LIMIT)
+                    break
+                try:
+                    batch = queue.get(timeout=0.1)
+                except Queue.Empty:
+                    continue
+
+                if batch is _DONE:
+                    LOG.error("%s died with exit code %s", self.name, process.wait())
+                    break
+                if isinstance(batch, tuple):
+                    done = batch
+                    break
+                for cls, fields, priority in batch:
+                    job = cls(**fields)
+                    jobs.setdefault(job.cs_id, []).append((job, priority))
+                    if job.cs_id is not None:
+                        last_cs_id = job.cs_id
+                    yield (job, priority)
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+            # The reader might be blocked on a full queue
+            while batch is not _DONE:
+                batch = queue.get()
+
+        if self._closed.is_set():
+            return
+
+        if done is not None:
+            self.failed, last_cs_id = done
+        if self.failed:
+            fresh = dict((cs_id, list(candidates)) for cs_id, candidates in jobs.items())
+            for job, priority in self.creator._resume(fresh, last_cs_id, cs_ids):
+                jobs.setdefault(job.cs_id, []).append((job, priority))
+                yield (job, priority)
+        self.creator._remember(jobs, cs_ids, complete=not self.failed)
+
+    def _regenerate(self, cs_ids=None):
+        for _ in self._run(cs_ids):
+            pass
+        return self.failed
+
+    def _jobs(self):
+        if self.creator.dependencies and self.creator.changes is not None:
+            return self.creator._collect_incremental(regenerate=self._regenerate)
+        return self._run()
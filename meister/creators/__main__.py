@@ -0,0 +1,59 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Run a creator in a process of its own, see ProcessCreatorStream.
+
+Usage: python -m meister.creators <module>:<class>
+
+The cursor, the challenge sets to regenerate and the snapshots are read
+pickled from stdin, batches of jobs are written pickled to stdout, followed
+by whether the creator failed and the challenge set it stopped at.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import cPickle as pickle
+import importlib
+import os
+import sys
+import time
+
+import meister.creators
+import meister.upsert as upsert
+
+
+def main(args):
+    """Run the creator args[0] and send its jobs to stdout."""
+    # Jobs go to the original stdout, log messages and everything else that
+    # is printed to stderr.
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    module_name, _, class_name = args[0].partition(':')
+    creator = getattr(importlib.import_module(module_name), class_name)()
+    request = pickle.load(sys.stdin)
+    creator._cursor = request['cursor']
+    creator._only_cs_ids = request['cs_ids']
+    creator.snapshot = request['snapshot']
+    creator.fieldings = request['fieldings']
+
+    def _send(item):
+        pickle.dump(item, output, pickle.HIGHEST_PROTOCOL)
+        output.flush()
+
+    batch, sent_at = [], 0
+    for job, priority in creator._generate():
+        # Only the dirty fields matter, see meister.upsert
+        fields = dict((n, job._data.get(n)) for n in upsert.dirty_names(job))
+        batch.append((type(job), fields, priority))
+        if len(batch) >= meister.creators.PROCESS_BATCH_SIZE or \
+           time.time() - sent_at > meister.creators.PROCESS_BATCH_INTERVAL:
+            _send(batch)
+            batch, sent_at = [], time.time()
+    if batch:
+        _send(batch)
+    _send((creator._failed, creator._last_cs_id))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -11,6 +11,12 @@ LOG = meister.creators.LOG.getChild('AFL')
 
 class AFLCreator(meister.creators.BaseCreator):
 
+    # One job per fielded challenge set
+    dependencies = ('fielding',)
+
+    # Every job has priority 105
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
@@ -10,6 +10,12 @@ LOG = meister.creators.LOG.getChild('backdoor_submitter')
 
 
 class BackdoorSubmitterCreator(meister.creators.BaseCreator):
+    # One job per fielded challenge set
+    dependencies = ('fielding',)
+
+    # Every job has priority 100
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
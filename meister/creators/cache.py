@@ -10,6 +10,9 @@ LOG = meister.creators.LOG.getChild('cache')
 
 
 class CacheCreator(meister.creators.BaseCreator):
+    # Both jobs of every challenge set have priority 100
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
@@ -18,7 +21,7 @@ class CacheCreator(meister.creators.BaseCreator):
         LOG.debug("Collecting jobs...")
         for cs in self.single_cb_challenge_sets():
             # if we have identification results run another one
-            if cs.completed_function_identification:
+            if self.status(cs).completed_function_identification:
                 job = CacheJob(cs=cs, request_cpu=1, request_memory=512, limit_memory=8192,
                                payload={'with_atoi': True})
                 yield (job, 100)
@@ -3,18 +3,21 @@
 
 from __future__ import absolute_import, unicode_literals
 
-from farnsworth.models import CBTesterJob, CBPollPerformance, ChallengeSet
+from farnsworth.models import CBTesterJob, CBPollPerformance
 
 import meister.creators
 LOG = meister.creators.LOG.getChild('cb_tester')
 
 
 class CBTesterCreator(meister.creators.BaseCreator):
+    # Jobs are merged into TesterJobs
+    merged = True
+
     MIN_TESTED_POLLS = 10000    # Number of polls we want to be tested for each CB
 
     @property
     def _jobs(self):
-        for cs in ChallengeSet.fielded_in_round():
+        for cs in self.challenge_sets():
             # For each of patch types create Tester Jobs
             for patch_type in cs.cbns_by_patch_type():
                 # Get only polls for which scores have not been computed.
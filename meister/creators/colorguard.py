@@ -12,6 +12,10 @@ LOG = meister.creators.LOG.getChild('colorguard')
 
 
 class ColorGuardCreator(meister.creators.BaseCreator):
+    # Jobs wait for the tracer cache of a challenge set, which we are not
+    # notified about.
+    dependencies = ()
+
     @staticmethod
     def _normalize_sort(base, top, ordered_items):
         for p, c in enumerate(ordered_items):
@@ -20,13 +24,14 @@ class ColorGuardCreator(meister.creators.BaseCreator):
     @property
     def _jobs(self):
         for cs in self.challenge_sets():
-            found_crash_for_cs = cs.found_crash
-            if cs.is_multi_cbn:
+            status = self.status(cs)
+            found_crash_for_cs = status.found_crash
+            if status.is_multi_cbn:
                 LOG.warning("ColorGuard does not support MultiCBs refusing to schedule")
 
-            elif cs.completed_caching or cs.tracer_cache.exists():
+            elif status.completed_caching or status.has_tracer_cache:
                 LOG.debug("Caching complete for %s, scheduling ColorGuard", cs.name)
-                has_circumstantial_type2 = cs.has_circumstantial_type2
+                has_circumstantial_type2 = status.has_circumstantial_type2
 
                 if has_circumstantial_type2:
                     LOG.debug("Circumstantial Type2 for Challenge %s already exists "
@@ -11,20 +11,25 @@ import meister.creators
 LOG = meister.creators.LOG.getChild('driller')
 
 class DrillerCreator(meister.creators.BaseCreator):
+    # Drilling waits for AFL stats and function identification, neither of
+    # which we are notified about.
+    dependencies = ()
+
     @property
     def _jobs(self):
         for cs in self.single_cb_challenge_sets():
-            if cs.fuzzer_stat is None or cs.fuzzer_stat.last_path is None:
+            status = self.status(cs)
+            if status.fuzzer_stat is None or status.fuzzer_stat.last_path is None:
                 continue
 
-            id_started = cs.function_identification_started_at
+            id_started = status.function_identification_started_at
 
             # if we are assuming AFL will start up, we can also assume identification will start up
             if id_started is None:
                 continue
 
-            has_pending_favs = cs.fuzzer_stat.pending_favs
-            completed_id = cs.completed_function_identification
+            has_pending_favs = status.fuzzer_stat.pending_favs
+            completed_id = status.completed_function_identification
 
             # we drill if...
             #  - AFL no longer has any pending favs
@@ -37,7 +42,7 @@ class DrillerCreator(meister.creators.BaseCreator):
                 LOG.info("AFL has no pending favs, scheduling Driller")
                 LOG.debug("Found {} undrilled tests".format(cs.undrilled_tests.count()))
 
-                have_exploit = cs.has_type1 or cs.has_type2
+                have_exploit = status.has_type1 or status.has_type2
 
                 for test in cs.tests.select(Test.id):
                     job = DrillerJob(cs=cs, request_cpu=1, request_memory=2048,
@@ -11,6 +11,12 @@ LOG = meister.creators.LOG.getChild('function_identifier')
 
 class FunctionIdentifierCreator(meister.creators.BaseCreator):
 
+    # One job per fielded single binary challenge set
+    dependencies = ('fielding',)
+
+    # Every job has priority 100
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
@@ -11,6 +11,14 @@ LOG = meister.creators.LOG.getChild('network_poll_creator')
 
 
 class NetworkPollCreatorCreator(meister.creators.BaseCreator):
+    dependencies = ('raw_round_traffic',)
+
+    # Every job has priority 100
+    ordered = True
+
+    # Jobs are per round traffic, not per challenge set
+    per_challenge_set = False
+
     @property
     def _jobs(self):
         # get only unprocessed traffic files and schedule them.
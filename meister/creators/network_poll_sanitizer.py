@@ -6,15 +6,25 @@ from __future__ import absolute_import
 from farnsworth.models import NetworkPollSanitizerJob, RawRoundPoll, ValidPoll
 
 import meister.creators
+import meister.shards as shards
 from .poll_creator import PollCreatorCreator
 LOG = meister.creators.LOG.getChild('network_poll_sanitizer')
 
 
 class NetworkPollSanitizerCreator(meister.creators.BaseCreator):
+    dependencies = ('raw_round_poll',)
+
+    # Jobs are merged into TesterJobs
+    merged = True
 
     @property
     def _jobs(self):
-        for curr_unsan_poll in RawRoundPoll.select().where(RawRoundPoll.sanitized == False):
+        unsanitized = RawRoundPoll.select().where(RawRoundPoll.sanitized == False)
+        if self._only_cs_ids is not None:
+            unsanitized = unsanitized.where(RawRoundPoll.cs << list(self._only_cs_ids))
+        for curr_unsan_poll in unsanitized:
+            if shards.is_sharded() and not shards.owns(curr_unsan_poll.cs_id):
+                continue
             # Get the number of polls available for current CS
             job = NetworkPollSanitizerJob(cs=curr_unsan_poll.cs,
                                           payload={'rrp_id': curr_unsan_poll.id},
@@ -10,6 +10,9 @@ LOG = meister.creators.LOG.getChild('patch_performance')
 
 
 class PatchPerformanceCreator(meister.creators.BaseCreator):
+    # Every job has priority 100
+    ordered = True
+
     @property
     def _jobs(self):
         # get all current valid ChallengeSets and schedule them.
@@ -10,6 +10,12 @@ LOG = meister.creators.LOG.getChild('patcherex')
 
 
 class PatcherexCreator(meister.creators.BaseCreator):
+    # One job per patch type for every binary of the fielded challenge sets
+    dependencies = ('fielding',)
+
+    # Every job has priority 200
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
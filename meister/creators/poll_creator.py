@@ -3,7 +3,7 @@
 
 from __future__ import absolute_import
 
-from farnsworth.models import PollCreatorJob, Test, ValidPoll, ChallengeSet
+from farnsworth.models import PollCreatorJob, Test, ValidPoll
 
 import meister.creators
 LOG = meister.creators.LOG.getChild('poll_creator')
@@ -15,10 +15,15 @@ class PollCreatorCreator(meister.creators.BaseCreator):
     # reasonable number of polls
     RESONABLE_NUM_POLLS = 1000
 
+    dependencies = ('test',)
+
+    # Jobs are merged into TesterJobs
+    merged = True
+
     @property
     def _jobs(self):
         # iterate only for currently active ChallengeSets
-        for curr_cs in ChallengeSet.fielded_in_round():
+        for curr_cs in self.challenge_sets():
             for curr_test in Test.select().where((Test.poll_created == False) & (Test.cs == curr_cs)):
                 job = PollCreatorJob(cs=curr_test.cs, payload={'test_id': curr_test.id}, request_cpu=10,
                                      request_memory=4096*2)
@@ -3,7 +3,7 @@
 
 from __future__ import absolute_import
 
-from farnsworth.models import ChallengeSetFielding, Crash, Exploit, IDSRuleFielding, PovFuzzer2Job, PovTestResult, Team
+from farnsworth.models import Crash, Exploit, PovFuzzer2Job
 from itertools import islice
 from peewee import fn
 
@@ -13,6 +13,9 @@ LOG = meister.creators.LOG.getChild('povfuzzer2')
 
 
 class PovFuzzer2Creator(meister.creators.BaseCreator):
+    # Crashes are filtered on their PoV test results, which we are not
+    # notified about.
+    dependencies = ()
 
     @staticmethod
     def _normalize_sort(base, ordered_crashes):
@@ -22,7 +25,7 @@ class PovFuzzer2Creator(meister.creators.BaseCreator):
     @property
     def _jobs(self):
         for cs in self.challenge_sets():
-            if not cs.has_type2:
+            if not self.status(cs).has_type2:
                 ordered_crashes = cs.crashes.select(Crash.id) \
                                             .where(Crash.kind == Vulnerability.ARBITRARY_READ) \
                                             .order_by(fn.octet_length(Crash.blob).asc())
@@ -48,16 +51,17 @@ class PovFuzzer2Creator(meister.creators.BaseCreator):
                                           .order_by(fn.octet_length(Crash.blob).desc())
                                           .limit(3))
 
-                for team in Team.opponents():
-                    target_cs_fld = ChallengeSetFielding.latest(cs, team)
+                for team in self.fieldings.opponents:
+                    target_cs_fld = self.fieldings.latest_cs_fielding(team, cs)
 
                     if target_cs_fld is not None:   # Are there any CS fielded?
-                        target_ids_fld = IDSRuleFielding.latest(cs, team)
+                        target_ids_fld = self.fieldings.latest_ids_fielding(team, cs)
 
                         # See if there are successful PoVs for this
                         # fielded CS and IDS. If yes, no need to
                         # schedule Pov Testing Jobs
-                        pov_test_results = PovTestResult.best(target_cs_fld, target_ids_fld)
+                        pov_test_results = self.fieldings.best_result(target_cs_fld,
+                                                                      target_ids_fld)
 
                         if pov_test_results is None or pov_test_results.num_success < 3:
                             # We do not have any strong PoVs for the
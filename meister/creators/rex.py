@@ -3,10 +3,7 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import itertools
-
 from farnsworth.models import RexJob, Crash
-from peewee import fn
 
 import meister.creators
 LOG = meister.creators.LOG.getChild('rex')
@@ -46,69 +43,89 @@ BASE_PRIORITY = 10
 # the limit of crashes to schedule at a time
 FEED_LIMIT = 200
 
-class RexCreator(meister.creators.BaseCreator):
+# ignore crashes of kind null_dereference, uncontrolled_ip_overwrite,
+# uncontrolled_write and unknown
+NON_EXPLOITABLE = [Vulnerability.NULL_DEREFERENCE,
+                   Vulnerability.UNCONTROLLED_IP_OVERWRITE,
+                   Vulnerability.UNCONTROLLED_WRITE,
+                   Vulnerability.UNKNOWN]
+
+# Rank the crashes of every kind per challenge set, crashes at a crashing pc
+# that has not been explored or exploited yet first, then by their number of
+# basic blocks, and keep the first FEED_LIMIT of every kind. Triaged crashes
+# are ignored. The kind is an enum, it is compared as text.
+CRASHES_QUERY = """
+SELECT cs, id, kind, rank FROM (
+    SELECT cs, id, kind, ROW_NUMBER() OVER (PARTITION BY cs, kind
+                                            ORDER BY encountered, bb_count, id) AS rank
+    FROM (
+        SELECT {cs} AS cs, {id} AS id, {kind}::text AS kind, {bb_count} AS bb_count,
+               {crash_pc} AS crash_pc,
+               COALESCE(bool_or({explored} OR {exploited})
+                        OVER (PARTITION BY {cs}, {crash_pc}), FALSE) AS encountered
+        FROM {table}
+        WHERE {cs} = ANY(%s) AND NOT ({kind}::text = ANY(%s)) AND {triaged} != TRUE
+    ) AS crashes
+    WHERE kind = ANY(%s) AND crash_pc IS NOT NULL
+) AS ranked
+WHERE rank <= %s
+ORDER BY cs, kind, rank
+"""
 
-    @staticmethod
-    def _filter_non_exploitable(crashes):
-        # ignore crashes of kind null_dereference, uncontrolled_ip_overwrite,
-        # uncontrolled_write and unknown
-        non_exploitable = [Vulnerability.NULL_DEREFERENCE,
-                          Vulnerability.UNCONTROLLED_IP_OVERWRITE,
-                          Vulnerability.UNCONTROLLED_WRITE,
-                          Vulnerability.UNKNOWN]
-
-        # ignore any crashes which are the same crashing pc of an explored, exploited, or leaked input
-        # TODO we may just want to lower the priority of these crashes
-        return crashes.where(~(Crash.kind << non_exploitable) \
-                             & (Crash.triaged != True))
+class RexCreator(meister.creators.BaseCreator):
+    dependencies = ('crash', 'exploit')
 
     @staticmethod
-    def _normalize_sort(base, ordered_crashes):
-        for p, c in enumerate(ordered_crashes):
-            yield max(base, 100 - p), c
+    def _crashes(cs_ids):
+        """Return the (crash id, kind, rank) of the crashes to exploit per challenge set.
+
+        All challenge sets are ranked with a single query, see CRASHES_QUERY.
+        """
+        columns = dict((name, '"{}"'.format(Crash._meta.fields[name].db_column))
+                       for name in ('id', 'cs', 'kind', 'bb_count', 'crash_pc',
+                                    'explored', 'exploited', 'triaged'))
+        sql = CRASHES_QUERY.format(table='"{}"'.format(Crash._meta.db_table), **columns)
+        cursor = Crash._meta.database.execute_sql(sql, (list(cs_ids), NON_EXPLOITABLE,
+                                                        list(PRIORITY_MAP), FEED_LIMIT))
+        crashes = {}
+        for cs_id, crash_id, kind, rank in cursor.fetchall():
+            crashes.setdefault(cs_id, []).append((crash_id, kind, rank))
+        return crashes
 
     @property
     def _jobs(self):
-        for cs in self.single_cb_challenge_sets():
-            # does this fetch blobs? can we do the filter with the query?
-            crashes = self._filter_non_exploitable(cs.crashes)
-
-            encountered_subquery = crashes.select(fn.Distinct(Crash.crash_pc)) \
-                                          .where((Crash.explored) | (Crash.exploited))
-
-            categories = dict()
-            for vulnerability in PRIORITY_MAP.keys():
-                high_priority = crashes.select(Crash.id).where((Crash.kind == vulnerability) \
-                    & ~(Crash.crash_pc << encountered_subquery)).order_by(Crash.bb_count.asc())
-                low_priority = crashes.select(Crash.id).where((Crash.kind == vulnerability) \
-                    & (Crash.crash_pc << encountered_subquery)).order_by(Crash.bb_count.asc())
+        challenge_sets = list(self.single_cb_challenge_sets())
+        if not challenge_sets:
+            return
+        crashes = self._crashes(cs.id for cs in challenge_sets)
 
-                if high_priority or low_priority:
-                    sliced = itertools.islice(itertools.chain(high_priority, low_priority), FEED_LIMIT)
-                    categories[vulnerability] = sliced
+        for cs in challenge_sets:
+            if cs.id not in crashes:
+                continue
 
-            type1_exists = cs.has_type1
-            type2_exists = cs.has_type2
+            status = self.status(cs)
+            type1_exists = status.has_type1
+            type2_exists = status.has_type2
 
-            # normalize by ids
-            for kind in categories:
-                for priority, crash in self._normalize_sort(BASE_PRIORITY, categories[kind]):
-                    job = RexJob(cs=cs, payload={'crash_id': crash.id},
-                                 request_cpu=1, request_memory=4096,
-                                 limit_memory=25600, limit_time=30 * 60)
+            # normalize by rank within the kind
+            for crash_id, kind, rank in crashes[cs.id]:
+                priority = max(BASE_PRIORITY, 100 - (rank - 1))
+                job = RexJob(cs=cs, payload={'crash_id': crash_id},
+                             request_cpu=1, request_memory=4096,
+                             limit_memory=25600, limit_time=30 * 60)
 
-                    if type1_exists and type2_exists:
-                        priority = BASE_PRIORITY
+                if type1_exists and type2_exists:
+                    priority = BASE_PRIORITY
 
-                    # we have type1s? lower the priority of ip_overwrites
-                    if type1_exists and crash.kind == 'ip_overwrite':
-                        priority = BASE_PRIORITY
+                # we have type1s? lower the priority of ip_overwrites
+                if type1_exists and kind == 'ip_overwrite':
+                    priority = BASE_PRIORITY
 
-                    # we have types2? lower the priority
-                    if type2_exists and crash.kind == 'arbitrary_read':
-                        priority = BASE_PRIORITY
+                # we have types2? lower the priority
+                if type2_exists and kind == 'arbitrary_read':
+                    priority = BASE_PRIORITY
 
-                    LOG.debug("Yielding RexJob for %s with crash %s priority %d",
-                              cs.name, crash.id, priority)
+                LOG.debug("Yielding RexJob for %s with crash %s priority %d",
+                          cs.name, crash_id, priority)
 
-                    yield (job, priority)
+                yield (job, priority)
@@ -10,6 +10,12 @@ LOG = meister.creators.LOG.getChild('rop_cache')
 
 
 class RopCacheCreator(meister.creators.BaseCreator):
+    # One job per fielded single binary challenge set
+    dependencies = ('fielding',)
+
+    # Every job has priority 90
+    ordered = True
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
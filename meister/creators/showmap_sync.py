@@ -10,6 +10,11 @@ LOG = meister.creators.LOG.getChild('showmap_sync')
 
 
 class ShowmapSyncCreator(meister.creators.BaseCreator):
+    # Jobs need processed traffic and the polls created from it
+    dependencies = ('raw_round_poll', 'raw_round_traffic')
+
+    # Every job has priority 100
+    ordered = True
 
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Leader election.
+
+Several meisters can run at the same time, only the one holding a Postgres
+advisory lock schedules. The lock is tied to a dedicated connection, so it
+is released as soon as the leader dies or loses its connection to the
+database, and a standby takes over with its next attempt.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+import farnsworth.config
+import psycopg2
+import psycopg2.extensions
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('leader')
+
+# Advisory lock all meisters of one database compete for
+LOCK_KEY = int(os.environ.get('MEISTER_LEADER_LOCK', '4242'))
+# Seconds between attempts of a standby to become the leader
+POLL_INTERVAL = float(os.environ.get('MEISTER_LEADER_POLL', '2'))
+
+
+class LeaderElection(object):
+    """Compete for leadership through a session-level advisory lock."""
+
+    def __init__(self, database=None, key=LOCK_KEY):
+        self.database = database if database is not None else farnsworth.config.master_db
+        self.key = key
+        self.is_leader = False
+        self._connection = None
+
+    def _connect(self):
+        self._connection = psycopg2.connect(database=self.database.database,
+                                            **self.database.connect_kwargs)
+        self._connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+    def _query(self, sql):
+        if self._connection is None:
+            self._connect()
+        cursor = self._connection.cursor()
+        cursor.execute(sql, (self.key,))
+        return cursor.fetchone()[0]
+
+    def acquire(self):
+        """Try to become or stay the leader, return whether we are the leader.
+
+        The leader checks that its connection, and with it the lock, is
+        still alive.
+        """
+        try:
+            if self.is_leader:
+                self._query('SELECT %s IS NOT NULL')
+            else:
+                self.is_leader = self._query('SELECT pg_try_advisory_lock(%s)')
+                if self.is_leader:
+                    LOG.info("Became the leader")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if self.is_leader:
+                LOG.error("Lost the leader connection (%s), stepping down", e)
+            else:
+                LOG.error("Cannot reach the database for leader election: %s", e)
+            self.is_leader = False
+            self._close()
+        return self.is_leader
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                pass
+        self._connection = None
+
+    def release(self):
+        """Give up leadership."""
+        if self.is_leader and self._connection is not None:
+            self._query('SELECT pg_advisory_unlock(%s)')
+            LOG.info("Stepped down as the leader")
+        self.is_leader = False
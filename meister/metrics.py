@@ -0,0 +1,210 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Scheduling cycle metrics.
+
+Time every phase of a scheduling cycle and expose the timings as histograms
+in the Prometheus text format on MEISTER_METRICS_PORT. If MEISTER_METRICS_FILE
+is set, every cycle is additionally appended to it as one line of JSON.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import BaseHTTPServer
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('metrics')
+
+METRICS_PORT = os.environ.get('MEISTER_METRICS_PORT')
+METRICS_FILE = os.environ.get('MEISTER_METRICS_FILE')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HISTOGRAMS = {'meister_cycle_seconds': "Duration of a scheduling cycle.",
+              'meister_phase_seconds': "Time spent per phase of a scheduling cycle.",
+              'meister_creator_seconds': "Time a creator took to produce its jobs.",
+              'meister_kube_call_seconds': "Latency of Kubernetes API calls."}
+GAUGES = {'meister_creator_jobs': "Jobs a creator produced in the last cycle.",
+          'meister_cycle_jobs': "Jobs per outcome in the last cycle.",
+          'meister_stagger_budget': "Pods to launch and kill per cycle."}
+
+
+def _labels(labels, extra=()):
+    pairs = sorted(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}'
+
+
+class Histogram(object):
+    """Cumulative histogram per set of labels."""
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, value, labels):
+        counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description),
+                 "# TYPE {} histogram".format(self.name)]
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _labels(labels, [('le', bound)]), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _labels(labels), total))
+            lines.append("{}_count{} {}".format(self.name, _labels(labels), cumulative))
+        return lines
+
+
+class Gauge(object):
+    """Last value per set of labels."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def set(self, value, labels):
+        self._values[labels] = value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description),
+                 "# TYPE {} gauge".format(self.name)]
+        for labels, value in sorted(self._values.items()):
+            lines.append("{}{} {}".format(self.name, _labels(labels), value))
+        return lines
+
+
+_lock = threading.Lock()
+_metrics = dict([(n, Histogram(n, d)) for n, d in HISTOGRAMS.items()] +
+                [(n, Gauge(n, d)) for n, d in GAUGES.items()])
+_cycle = None
+
+
+def observe(name, value, **labels):
+    """Add value to histogram name."""
+    with _lock:
+        _metrics[name].observe(value, tuple(sorted(labels.items())))
+
+
+def gauge(name, value, **labels):
+    """Set gauge name to value."""
+    with _lock:
+        _metrics[name].set(value, tuple(sorted(labels.items())))
+
+
+def render():
+    """Return all metrics in the Prometheus text format."""
+    with _lock:
+        lines = []
+        for name in sorted(_metrics):
+            lines.extend(_metrics[name].render())
+    return '\n'.join(lines) + '\n'
+
+
+def record(key, value):
+    """Record value under key in the current cycle's JSON line."""
+    with _lock:
+        if _cycle is not None:
+            _cycle[key] = value
+
+
+def _add_phase(name, seconds):
+    with _lock:
+        if _cycle is not None:
+            _cycle['phases'][name] = _cycle['phases'].get(name, 0.) + seconds
+
+
+@contextlib.contextmanager
+def cycle():
+    """Time a scheduling cycle, phases are summed up per cycle."""
+    global _cycle  # pylint: disable=global-statement
+    started_at = time.time()
+    with _lock:
+        _cycle = {'started_at': started_at, 'phases': {}}
+    try:
+        yield
+    finally:
+        with _lock:
+            current, _cycle = _cycle, None
+        current['seconds'] = time.time() - started_at
+        observe('meister_cycle_seconds', current['seconds'])
+        for name, seconds in current['phases'].items():
+            observe('meister_phase_seconds', seconds, phase=name)
+        LOG.debug("Cycle took %.3fs: %s", current['seconds'],
+                  ", ".join("{} {:.3f}s".format(n, s)
+                            for n, s in sorted(current['phases'].items())))
+        if METRICS_FILE:
+            with open(METRICS_FILE, 'a') as f:
+                f.write(json.dumps(current, sort_keys=True) + '\n')
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Add the time spent in the context to phase name of the current cycle."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        _add_phase(name, time.time() - start)
+
+
+def timed(iterable, name):
+    """Add the time spent waiting for items of iterable to phase name."""
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _add_phase(name, time.time() - start)
+        yield item
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOG.debug("%s - %s", self.address_string(), format % args)
+
+
+_server = None
+
+
+def serve(port=METRICS_PORT):
+    """Serve the metrics on port in the background, unless port is not set."""
+    global _server  # pylint: disable=global-statement
+    if port is None or _server is not None:
+        return
+    _server = BaseHTTPServer.HTTPServer(('', int(port)), _Handler)
+    thread = threading.Thread(target=_server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    LOG.info("Serving metrics on port %s", port)
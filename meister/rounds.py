@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Round watcher.
+
+Wait for the current round to be ready before every scheduling cycle. With
+MEISTER_ROUND_NOTIFY set, a trigger on the round table notifies us of new
+rounds, see meister.changes, and we only read the current round after a
+notification. Otherwise the current round is read once per cycle.
+
+As soon as a new round shows up, we prepare for it in the background while
+the ambassador is still getting it ready, so that the first cycle of the
+round does not start cold.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import threading
+import time
+
+from farnsworth.models import Round
+
+from meister.changes import ChangeFeed
+import meister.log
+
+LOG = meister.log.LOG.getChild('rounds')
+
+NOTIFY = os.environ.get('MEISTER_ROUND_NOTIFY') is not None
+# Seconds between checks while we wait for a round to be ready
+POLL_INTERVAL = float(os.environ.get('MEISTER_ROUND_POLL', '3'))
+
+
+class RoundWatcher(object):
+    """Wait for the current round to be ready.
+
+    :keyword prepare: Called with a new round that is not ready yet, in a
+                      background thread. wait() does not return before it
+                      is done.
+    """
+
+    def __init__(self, prepare=None, notify=NOTIFY, poll_interval=POLL_INTERVAL):
+        self.prepare = prepare
+        self.poll_interval = poll_interval
+        self.round = None
+        self.changes = None
+        self._subscription = None
+        self._prepared = None
+        self._preparing = None
+        if notify:
+            self.changes = ChangeFeed()
+            self.changes.install()
+            self._subscription = self.changes.subscribe(('round',))
+
+    def _changed(self, timeout=0):
+        # Without notifications, anything might have changed
+        if self.changes is None:
+            if timeout:
+                time.sleep(timeout)
+            return True
+        self.changes.poll(timeout)
+        everything, cs_ids = self._subscription.consume()
+        return everything or bool(cs_ids)
+
+    def _prepare(self, round_):
+        try:
+            self.prepare(round_)
+        except Exception, e:    # pylint: disable=broad-except
+            LOG.exception("Preparing round #%d failed: %s", round_.num, e)
+
+    def _start_preparing(self, round_):
+        if self.prepare is None or self._prepared == round_.id:
+            return
+        self._prepared = round_.id
+        LOG.info("Round #%d is not ready yet, preparing for it", round_.num)
+        self._preparing = threading.Thread(target=self._prepare, args=(round_,),
+                                           name='round-prepare')
+        self._preparing.daemon = True
+        self._preparing.start()
+
+    def _finish_preparing(self):
+        if self._preparing is not None:
+            started = time.time()
+            self._preparing.join()
+            self._preparing = None
+            LOG.debug("Waited %.3fs for the preparations to finish", time.time() - started)
+
+    def wait(self):
+        """Return the current round once it is ready."""
+        if self.round is not None and not self._changed():
+            return self.round
+
+        while True:
+            round_ = Round.current_round()
+            if round_ is not None and round_.is_ready():
+                self._finish_preparing()
+                if self.round is None or self.round.id != round_.id:
+                    LOG.info("Round #%d is ready", round_.num)
+                self.round = round_
+                return round_
+
+            if round_ is None:
+                LOG.info("Round data not available, waiting")
+            else:
+                self._start_preparing(round_)
+            # A notification about the round ends the wait early
+            self._changed(self.poll_interval)
@@ -5,27 +5,46 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import calendar
+import contextlib
 import copy
 import datetime
-import itertools
+import json
 import os
 import time
 
-import concurrent.futures
 import farnsworth.config
-from farnsworth.models.job import Job
-import pykube.exceptions
+from farnsworth.models.job import AFLJob, Job, TesterJob
 import pykube.http
 import pykube.objects
 import requests.exceptions
 
 from ..brains.toad import ToadBrain
+from meister.candidates import CandidateTable
+from meister.changes import ChangeFeed
+from meister.creators import CREATOR_PROCESSES, CreatorStream, ProcessCreatorStream
+from meister.snapshots import ChallengeSetSnapshot, FieldingSnapshot
 import meister.log
 import meister.kubernetes as kubernetes
+import meister.metrics as metrics
+import meister.shards as shards
+import meister.upsert as upsert
+from meister.schedulers.backend import KubernetesBackend
+from meister.schedulers.informer import PodInformer
+from meister.schedulers.reaper import PodReaper
+from meister.schedulers.rightsizing import RightSizer
 
 LOG = meister.log.LOG.getChild('schedulers')
 
 NUM_THREADS = int(os.environ.get('MEISTER_NUM_THREADS', '20'))
+# Keep the highest priority jobs of unordered creators for that many times
+# the pods the cluster can run.
+STREAM_HEADROOM = float(os.environ.get('MEISTER_STREAM_HEADROOM', '2'))
+# Workers terminated with one collection delete, keeps the label selector short
+TERMINATE_BATCH_SIZE = 50
+# Returned by schedule() for jobs whose old pod is still being deleted, the
+# job is created again in one of the next cycles.
+SKIPPED = 0
 
 
 def cpu2float(cpu):
@@ -46,8 +65,10 @@ def memory2int(memory):
         multiplier = 1024 ** 3
     return int(memory[:-2]) * multiplier
 
-def _list_getter(c):
-    return list(c.jobs)
+
+def kube_timestamp(timestamp):
+    """Internal helper function to convert Kubernetes timestamps to seconds since the epoch."""
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ'))
 
 class KubernetesScheduler(object):
     """Kubernetes scheduler class, should be inherited by actual schedulers."""
@@ -59,16 +80,38 @@ class KubernetesScheduler(object):
         make sure that all class variables are set up properly.
         """
         self._api = None
+        self._backend = None
+        self._informer = None
+        self._reaper = None
+        self._rightsizer = None
         self._node_capacities = None
         self._available_resources = None
         self._resources_cache_timeout = datetime.timedelta(seconds=1)
         self._resources_timestamp = datetime.datetime(1970, 1, 1, 0, 0, 0)
 
     def schedule(self, job):
-        """Schedule the job with the specific resources."""
+        """Schedule the job with the specific resources, return the HTTP status.
+
+        Returns SKIPPED if the job ran before and its old pod is not gone yet.
+        """
         LOG.debug("Scheduling job for job id %s", job.id)
-        self.terminate(self._worker_name(job.id))
-        self._schedule_kube_pod(job)
+        name = self._worker_name(job.id)
+        pod = self.informer.get(name)
+        # Most jobs have never run, do not bother the API server then
+        if pod is None:
+            return self._schedule_kube_pod(job)
+
+        # The new pod has the same name, it can only be created once the old
+        # one is gone for good. We do not wait for that, the informer tells us
+        # in one of the next cycles and the job is created then.
+        if 'deletionTimestamp' not in pod.obj['metadata']:
+            try:
+                self.terminate(name)
+            except requests.exceptions.RequestException as e:
+                LOG.error("Deleting old pod %s failed with %s: %s", name,
+                          e.__class__.__name__, e)
+        LOG.debug("Pod %s is still being deleted, skipping job %s", name, job.id)
+        return SKIPPED
 
     @property
     def api(self):
@@ -77,6 +120,36 @@ class KubernetesScheduler(object):
             self._api = pykube.http.HTTPClient(kubernetes.from_env())
         return self._api
 
+    @property
+    def backend(self):
+        """Return the backend running API calls concurrently."""
+        if self._backend is None:
+            self._backend = KubernetesBackend(self.api)
+        return self._backend
+
+    @property
+    def informer(self):
+        """Return the pod informer, started on first use."""
+        if self._informer is None:
+            self._informer = PodInformer(self.api).start()
+        return self._informer
+
+    @property
+    def reaper(self):
+        """Return the reaper of finished pods, started on first use."""
+        if self._reaper is None:
+            # Pods whose usage has not been recorded yet are kept
+            self._reaper = PodReaper(self.api, self.informer,
+                                     keep=self.rightsizer.watching).start()
+        return self._reaper
+
+    @property
+    def rightsizer(self):
+        """Return the right-sizer of job resource requests."""
+        if self._rightsizer is None:
+            self._rightsizer = RightSizer(self.api)
+        return self._rightsizer
+
     @classmethod
     def _worker_name(cls, job_id):
         """Return the worker name for a specific job_id."""
@@ -136,13 +209,18 @@ class KubernetesScheduler(object):
         else:
             postgres_use_slaves = None
 
+        labels = {
+            'app': 'worker',
+            'worker': job.worker,
+            'job_id': str(job.id),
+        }
+        if job.cs_id is not None:
+            # Resource usage is recorded per challenge set as well
+            labels['cs_id'] = str(job.cs_id)
+
         config = {
             'metadata': {
-                'labels': {
-                    'app': 'worker',
-                    'worker': job.worker,
-                    'job_id': str(job.id),
-                },
+                'labels': labels,
                 'name': name
             },
             'spec': {
@@ -185,12 +263,11 @@ class KubernetesScheduler(object):
         }
         return config
 
-    # Currently, we are using aggregate resources instead of per node resources for ease of
-    # scheduling. This is suboptimal because we might run into situation where we think we can
-    # schedule a job but actually cannot. The example below is a generalization of this in case node
-    # specific information is retained.
+    # The resources returned here are aggregated over the whole cluster, the PriorityScheduler
+    # places jobs per node through meister.schedulers.placement instead, because with aggregate
+    # resources we might think we can schedule a job but actually cannot.
     #
-    # There is a possibly problem that we might have to use almost the latest information because
+    # Even with per node placement, there is a possible problem that we might have to use almost the latest information because
     # the following might happen:
     #  - node a has availability 2 cores / 1GB
     #  - node b has availability 2 cores / 2GB
@@ -211,48 +288,14 @@ class KubernetesScheduler(object):
         # Reset available resources
         self._available_resources = copy.copy(self._kube_total_capacity)
 
-        # Collect fresh information from the Kubernetes API about all running pods
-        def cleanup(pod):
-            try:
-                if pod.pending or pod.running:
-                    try:
-                        LOG.debug("Pod %s is taking up resources", pod.name)
-                    except requests.exceptions.HTTPError, e:
-                        LOG.error("Somehow failed at HTTP %s", e)
-                    return pod
-                elif pod.failed:
-                    LOG.warning("Pod %s failed", pod.name)
-                    pod.delete()
-                elif pod.unknown:
-                    LOG.warning("Pod %s in unknown state", pod.name)
-                elif pod.succeeded:
-                    LOG.debug("Pod %s succeeded", pod.name)
-                    pod.delete()
-                else:
-                    LOG.debug("Pod %s is in a weird state", pod.name)
-            except KeyError, e:
-                LOG.error("Hit a KeyError %s", e)
-
-        pods = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            pods = executor.map(cleanup, pykube.objects.Pod.objects(self.api))
-
-        for pod in pods:
-            if pod is None:
-                continue
-
-            if pod.obj['spec']['containers'][0]['resources']:
-                try:
-                    resources = pod.obj['spec']['containers'][0]['resources']['requests']
-                except KeyError:
-                    resources = pod.obj['spec']['containers'][0]['resources']['limits']
-            else:
-                resources = {'cpu': '0', 'memory': '0Ki'}
-
-            self._available_resources['cpu'] -= cpu2float(resources['cpu'])
-            self._available_resources['memory'] -= memory2int(resources['memory'])
-            # We are assuming that each pod only has one container here.
-            self._available_resources['pods'] -= 1
+        # Collect fresh information about all running pods, finished pods
+        # are cleaned up by the reaper in the background
+        for pod in self.informer.pods(phases=('Pending', 'Running')):
+            LOG.debug("Pod %s is taking up resources", pod.name)
+            resources = self._kube_pod_requests(pod)
+            self._available_resources['cpu'] -= resources['cpu']
+            self._available_resources['memory'] -= resources['memory']
+            self._available_resources['pods'] -= resources['pods']
 
         self._resources_timestamp = datetime.datetime.now()
 
@@ -267,6 +310,39 @@ class KubernetesScheduler(object):
 
         return self._available_resources
 
+    @classmethod
+    def _kube_pod_requests(cls, pod):
+        """Internal helper method to return the resources requested by a pod."""
+        # We are assuming that each pod only has one container here.
+        resources = pod.obj['spec']['containers'][0].get('resources')
+        if resources:
+            try:
+                requests = resources['requests']
+            except KeyError:
+                requests = resources['limits']
+        else:
+            requests = {}
+        return {'cpu': cpu2float(requests.get('cpu', '0')),
+                'memory': memory2int(requests.get('memory', '0Ki')),
+                'pods': 1}
+
+    @classmethod
+    def _kube_pod_node(cls, pod):
+        """Internal helper method to return the node a pod is bound to, or None."""
+        return pod.obj['spec'].get('nodeName')
+
+    @classmethod
+    def _kube_pod_started_at(cls, pod):
+        """Internal helper method to return when a pod started, in seconds since the epoch.
+
+        Pods that have not started yet count from their creation.
+        """
+        timestamp = pod.obj.get('status', {}).get('startTime') or \
+            pod.obj['metadata'].get('creationTimestamp')
+        if timestamp is None:
+            return None
+        return kube_timestamp(timestamp)
+
     @property
     def _kube_total_capacity(self):
         """Internal helper method to return the total capacity on the Kubernetes cluster."""
@@ -300,34 +376,56 @@ class KubernetesScheduler(object):
         return self._node_capacities
 
     def _schedule_kube_pod(self, job):
-        """Internal method to schedule a job on Kubernetes."""
+        """Internal method to schedule a job on Kubernetes, return the HTTP status."""
         assert isinstance(self.api, pykube.http.HTTPClient)
         config = self._kube_pod_template(job)
 
-        try:
-            pykube.objects.Pod(self.api, config).create()
-        except requests.exceptions.HTTPError as error:
-            if error.response.status_code == 409:
-                LOG.warning("Job already scheduled %s", job.id)
-            else:
-                LOG.error("requests.HTTPError %s: %s",
-                          error.response.status_code,
-                          error.response.content)
-        except pykube.exceptions.HTTPError as error:
-            LOG.error("pykube.HTTPError %s", error)
-            # TODO: We need to properly inspect the error
-            # raise error
+        response = self.api.post(url='pods', namespace='default', data=json.dumps(config))
+        if response.status_code == 409:
+            # Creating the same pod twice is fine, it is running already
+            LOG.debug("Job already scheduled %s", job.id)
+        elif response.ok:
+            self.informer.observe(response.json())
+        else:
+            LOG.error("requests.HTTPError %s: %s", response.status_code, response.content)
+        return response.status_code
+
+    @classmethod
+    def _deleted(cls, response, what):
+        # Deleting something that is gone already or is being deleted is fine
+        if response.status_code in (404, 409):
+            LOG.debug("%s was deleted already (%s)", what, response.status_code)
+        else:
+            response.raise_for_status()
 
     def terminate(self, name):
         """Terminate worker 'name'."""
         assert isinstance(self.api, pykube.http.HTTPClient)
-        # TODO: job might have shutdown gracefully in-between being identified
-        # and being asked to get terminated; do we need to check if it exists?
-        config = {'metadata': {'name': name},
-                  'kind': 'Pod'}
-        if pykube.objects.Pod(self.api, config).exists():
-            LOG.debug("Terminating pod %s", config['metadata']['name'])
-            pykube.objects.Pod(self.api, config).delete()
+        # The informer might lag behind slightly, a pod that disappeared in
+        # the meantime results in a 404 on delete which we do not care about.
+        if self.informer.get(name) is not None:
+            LOG.debug("Terminating pod %s", name)
+            response = self.api.delete(url='pods/{}'.format(name), namespace='default')
+            self._deleted(response, "Pod {}".format(name))
+
+    def terminate_jobs(self, job_ids):
+        """Terminate the workers of job_ids, with one API call per batch of workers.
+
+        Returns the HTTP status per batch, None for batches that failed.
+        """
+        assert isinstance(self.api, pykube.http.HTTPClient)
+        job_ids = [job_id for job_id in job_ids if self.informer.pod_for_job(job_id) is not None]
+
+        def _delete(batch):
+            selector = 'app=worker,job_id in ({})'.format(','.join(str(j) for j in batch))
+            LOG.debug("Terminating pods with %s", selector)
+            response = self.api.delete(url='pods', namespace='default',
+                                       params={'labelSelector': selector})
+            self._deleted(response, "Pods with {}".format(selector))
+            return response.status_code
+
+        return self.backend.map('delete', _delete,
+                                list(upsert.chunks(job_ids, TERMINATE_BATCH_SIZE)))
 
 
 class BaseScheduler(KubernetesScheduler):
@@ -348,8 +446,26 @@ class BaseScheduler(KubernetesScheduler):
         self.brain = brain if brain is not None else ToadBrain()
         self.creators = creators if creators is not None else []
         self.sleepytime = sleepytime
+        self.candidates = CandidateTable()
+        self.changes = None
+        self.queue = None
         super(BaseScheduler, self).__init__()
 
+        if os.environ.get('MEISTER_INCREMENTAL') is not None:
+            # Creators with dependencies only regenerate jobs for changed challenge sets
+            self.changes = ChangeFeed()
+            self.changes.install()
+            for creator in self.creators:
+                if creator.dependencies:
+                    creator.changes = self.changes.subscribe(creator.dependencies)
+
+        if shards.is_sharded():
+            # Candidates are published to and placed from a shared queue
+            self.queue = shards.CandidateQueue()
+            self.queue.install()
+
+        metrics.serve()
+
         LOG.debug("Scheduler sleepytime: %d", self.sleepytime)
         LOG.debug("Job creators: %s", ", ".join(c.__class__.__name__
                                                 for c in self.creators))
@@ -359,29 +475,163 @@ class BaseScheduler(KubernetesScheduler):
         LOG.debug("Sleepytime...")
         time.sleep(self.sleepytime)
 
+    @contextlib.contextmanager
+    def streams(self, limit=None):
+        """Return the job streams of all creators, see meister.creators.CreatorStream.
+
+        Creators stop producing jobs when the context is left.
+
+        :keyword limit: The number of jobs to keep per unordered creator
+                        (default: all).
+        """
+        if self.changes is not None:
+            self.changes.poll()
+        # All creators share the same view of the challenge sets this cycle
+        snapshot = ChallengeSetSnapshot()
+        fieldings = FieldingSnapshot(snapshot)
+        creators = self.creators
+        if shards.is_sharded() and shards.SHARD_INDEX != 0:
+            # Only the first shard runs the creators that are not per challenge set
+            creators = [c for c in creators if c.per_challenge_set]
+        for creator in creators:
+            creator.snapshot = snapshot
+            creator.fieldings = fieldings
+
+        if CREATOR_PROCESSES:
+            # Load the snapshots once, they are sent to the creator processes
+            snapshot.load()
+            fieldings.load()
+            stream_class = ProcessCreatorStream
+        else:
+            stream_class = CreatorStream
+        streams = [stream_class(c, limit=limit).start() for c in creators]
+        try:
+            yield streams
+        finally:
+            creators = {}
+            for stream in streams:
+                stream.close()
+                # Lazy creators might still be running, this is what we waited for
+                metrics.observe('meister_creator_seconds', stream.elapsed, creator=stream.name)
+                metrics.gauge('meister_creator_jobs', stream.count, creator=stream.name)
+                creators[stream.name] = {'seconds': stream.elapsed, 'jobs': stream.count}
+            metrics.record('creators', creators)
+
     @property
-    def jobs(self):
-        """Return all jobs that all creators want to run."""
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            # Return 25 jobs at a time to speed up generator
-            jobs_unordered_iter = executor.map(_list_getter,
-                                               self.creators, chunksize=25)
-            for job in itertools.chain.from_iterable(jobs_unordered_iter):
-                yield job
+    def _stream_limit(self):
+        """Return the number of jobs worth keeping per creator."""
+        return int(self._kube_total_capacity['pods'] * STREAM_HEADROOM)
+
+    def _resolve(self, jobs, completed_resets):
+        """Resolve sorted (job, priority) pairs to rows in the job table.
+
+        Yields the (job, priority) pairs of the rows that still have to run.
+        Completed AFL and tester jobs run again, they are added to
+        completed_resets.
+        """
+        for chunk in upsert.chunks(jobs):
+            with metrics.phase('upsert'), farnsworth.config.master_db.atomic():
+                resolved = self.candidates.resolve(chunk)
+
+            for job, priority, created in resolved:
+                # We need to set completed_at to None if the TesterJob
+                # has finished because it will almost always exist for
+                # this CS already and we would otherwise not test
+                # anything for this CS and this worker type anymore.
+                # If it hasn't completed yet, it will pick up the
+                # individual jobs that we have already created at this
+                # point in the brain
+                if isinstance(job, (AFLJob, TesterJob)) and job.completed_at is not None:
+                    completed_resets.append(job)
+                    job.completed_at = None
+
+                if job.completed_at is not None:
+                    LOG.debug("Job has been completed at %s, skipping", job.completed_at)
+                    continue
+
+                if created:
+                    LOG.debug("Job did not exist yet, created it")
+                yield job, priority
+
+    @contextlib.contextmanager
+    def resolved_candidates(self, completed_resets):
+        """Return the (job, priority) candidates that still have to run, best first.
+
+        Candidates come from the creators, or in sharded mode from the queue
+        all shards publish to. Creators stop producing jobs when the context
+        is left.
+        """
+        if self.queue is not None:
+            yield self.queue.take()
+            return
+        # Creators only produce as many jobs as we pull, with some headroom for
+        # jobs that have completed or do not fit.
+        with self.streams(self._stream_limit) as streams:
+            jobs = metrics.timed(self.brain.sort(streams), 'sort')
+            yield self._resolve(jobs, completed_resets)
 
     def _run(self):
         raise NotImplementedError("Implement it!")
 
+    def publish(self):
+        """Publish the best candidates of our shard to the queue, see meister.shards."""
+        with metrics.cycle():
+            self.candidates.next_cycle()
+            limit = None if self._is_kubernetes_unavailable() else self._stream_limit
+            candidates, candidate_ids, completed_resets = [], set(), []
+            with self.streams(limit) as streams:
+                jobs = metrics.timed(self.brain.sort(streams), 'sort')
+                for job, priority in self._resolve(jobs, completed_resets):
+                    if job.id in candidate_ids:
+                        LOG.error("A creator yielded a job a second time: job id=%d", job.id)
+                        continue
+                    candidates.append((job, priority))
+                    candidate_ids.add(job.id)
+                    if len(candidates) >= self.queue.size:
+                        break
+
+            with metrics.phase('upsert'), farnsworth.config.master_db.atomic():
+                upsert.reset_completed(completed_resets)
+            with metrics.phase('publish'):
+                self.queue.publish(candidates)
+
+    def warm(self):
+        """Keep the state of a standby warm without scheduling anything.
+
+        The pod cache, the node capacities, the creators and the candidate
+        tables are filled like in a scheduling run, but no job is created or
+        changed, so that we can take over quickly.
+        """
+        self.candidates.next_cycle()
+        self.brain.candidates.next_cycle()
+        if not self._is_kubernetes_unavailable():
+            self.informer    # pylint: disable=pointless-statement
+            self._kube_node_capacities    # pylint: disable=pointless-statement
+            limit = self._stream_limit
+        else:
+            limit = None
+        with self.streams(limit) as streams:
+            for stream in streams:
+                # Jobs of merged creators are resolved by the brain
+                table = self.brain.candidates if stream.creator.merged else self.candidates
+                for chunk in upsert.chunks(stream):
+                    table.warm(chunk)
+        LOG.debug("Warmed up %d candidates", len(self.candidates) + len(self.brain.candidates))
+
     def run(self):
         """Run the scheduler."""
-        if self._is_kubernetes_unavailable():
-            # Run without actually scheduling
-            with farnsworth.config.master_db.atomic():
-                for job, priority in self.brain.sort(self.jobs):
-                    kwargs = {df.name: getattr(job, df.name) for df in job.dirty_fields}
-                    job, _ = type(job).get_or_create(**kwargs)
-                    job.priority = priority
-                    job.save()
-        else:
-            # Run internal scheduler method
-            self._run()
+        with metrics.cycle():
+            self.candidates.next_cycle()
+            if self._is_kubernetes_unavailable():
+                # Run without actually scheduling
+                with self.streams() as streams:
+                    jobs = metrics.timed(self.brain.sort(streams), 'sort')
+                    for chunk in upsert.chunks(jobs):
+                        with metrics.phase('upsert'), farnsworth.config.master_db.atomic():
+                            resolved = self.candidates.resolve(chunk, refresh=False)
+                            upsert.update_priorities([(job, priority)
+                                                      for job, priority, _ in resolved
+                                                      if job.priority != priority])
+            else:
+                # Run internal scheduler method
+                self._run()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Kubernetes API backend.
+
+Fan out API calls through one long-lived pool of worker threads sharing a
+pool of keep-alive connections to the API server, with a limit on the calls
+in flight per kind of call and latency statistics per kind.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import threading
+import time
+import traceback
+
+import concurrent.futures
+import requests.adapters
+
+import meister.log
+import meister.metrics as metrics
+
+LOG = meister.log.LOG.getChild('schedulers.backend')
+
+NUM_THREADS = int(os.environ.get('MEISTER_NUM_THREADS', '20'))
+# Keep-alive connections to the API server, the pod watch holds one of them
+POOL_SIZE = int(os.environ.get('MEISTER_KUBE_POOL_SIZE', str(NUM_THREADS + 2)))
+# Calls in flight per kind of call, at most NUM_THREADS in total
+IN_FLIGHT = {'create': int(os.environ.get('MEISTER_KUBE_IN_FLIGHT_CREATE', str(NUM_THREADS))),
+             'delete': int(os.environ.get('MEISTER_KUBE_IN_FLIGHT_DELETE', str(NUM_THREADS)))}
+
+
+class CallStats(object):
+    """Latency statistics of one kind of API call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.total += latency
+            self.max = max(self.max, latency)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def __repr__(self):
+        return "{} calls, {} errors, {:.3f}s mean, {:.3f}s max".format(
+            self.count, self.errors, self.mean, self.max)
+
+
+class KubernetesBackend(object):
+    """Run Kubernetes API calls concurrently on a shared connection pool.
+
+    The threads and connections are kept across scheduling runs, so that we
+    do not pay for thread start-up and connection set-up with every call.
+    """
+
+    def __init__(self, api, max_workers=NUM_THREADS, pool_size=POOL_SIZE, in_flight=None):
+        self.api = api
+        self.in_flight = dict(IN_FLIGHT)
+        self.in_flight.update(in_flight or {})
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._resize_pool(pool_size)
+
+    def _resize_pool(self, pool_size):
+        # requests keeps 10 connections per host by default, the others are
+        # opened and closed again for every call beyond that.
+        session = self.api.session
+        for prefix, adapter in list(session.adapters.items()):
+            if isinstance(adapter, requests.adapters.HTTPAdapter):
+                session.mount(prefix, requests.adapters.HTTPAdapter(
+                    pool_connections=pool_size, pool_maxsize=pool_size,
+                    max_retries=adapter.max_retries))
+                adapter.close()
+        LOG.debug("Keeping up to %d connections to the API server", pool_size)
+
+    def _for(self, kind):
+        with self._lock:
+            if kind not in self._semaphores:
+                self._semaphores[kind] = threading.BoundedSemaphore(
+                    self.in_flight.get(kind, NUM_THREADS))
+                self.stats[kind] = CallStats()
+            return self._semaphores[kind], self.stats[kind]
+
+    def _call(self, kind, fn, *args):
+        semaphore, stats = self._for(kind)
+        with semaphore:
+            start, error = time.time(), True
+            try:
+                result = fn(*args)
+                error = False
+                return result
+            finally:
+                latency = time.time() - start
+                stats.record(latency, error=error)
+                metrics.observe('meister_kube_call_seconds', latency, kind=kind)
+
+    def submit(self, kind, fn, *args):
+        """Call fn(*args) in the background, return a future."""
+        return self._executor.submit(self._call, kind, fn, *args)
+
+    def map(self, kind, fn, items):
+        """Call fn(item) for all items concurrently and wait for all of them.
+
+        Returns the results in the order of items, None for calls that
+        raised an exception, which is logged.
+        """
+        futures = [self.submit(kind, fn, item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception, e:
+                LOG.error("Kubernetes %s call failed with %s: %s", kind,
+                          e.__class__.__name__, e)
+                LOG.debug(traceback.format_exc())
+                results.append(None)
+        if futures:
+            LOG.debug("Kubernetes %s calls: %s", kind, self.stats[kind])
+        return results
+
+    def shutdown(self):
+        """Stop the worker threads once all calls are done."""
+        self._executor.shutdown(wait=True)
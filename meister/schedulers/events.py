@@ -0,0 +1,116 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Scheduling events.
+
+In event-driven mode (MEISTER_EVENT_DRIVEN) the scheduler does not only run
+full cycles back to back. Between full cycles it waits for events: when
+worker pods finish, the jobs that were selected in the last cycle but did not
+fit are placed on the freed resources right away, and when new crashes,
+exploits or tests arrive, the next full cycle starts early. A full cycle
+still runs every MEISTER_RECONCILE_INTERVAL seconds to pick up everything
+we are not notified about.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import threading
+import time
+
+import psycopg2
+
+from meister.changes import ChangeFeed
+import meister.log
+
+LOG = meister.log.LOG.getChild('schedulers.events')
+
+EVENT_DRIVEN = os.environ.get('MEISTER_EVENT_DRIVEN') is not None
+# Seconds between full scheduling cycles at most
+RECONCILE_INTERVAL = float(os.environ.get('MEISTER_RECONCILE_INTERVAL', '60'))
+# Seconds we collect events before we react to them, so that a burst of
+# pods finishing is handled in one pass.
+DEBOUNCE = float(os.environ.get('MEISTER_EVENTS_DEBOUNCE', '0.5'))
+# Tables with new work, see meister.changes.TABLES
+WORK_TABLES = ('crash', 'exploit', 'test')
+# Back off that many seconds after the change feed failed
+CHANGES_BACKOFF = 1
+
+
+def _phase(obj):
+    return obj.get('status', {}).get('phase') if obj is not None else None
+
+
+class EventSource(object):
+    """Collect pods that finished and new work from the database."""
+
+    def __init__(self, informer, changes=None):
+        self.informer = informer
+        self.changes = changes if changes is not None else ChangeFeed()
+        self._condition = threading.Condition()
+        self._freed = 0
+        self._work = False
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Subscribe to pod events and listen for new work in the background."""
+        if self._thread is None:
+            self.informer.subscribe(self._pod_event)
+            self.changes.install()
+            self._thread = threading.Thread(target=self._watch_changes, name='work-events')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop listening for new work."""
+        self._stopped.set()
+
+    def _signal(self, freed=0, work=False):
+        with self._condition:
+            self._freed += freed
+            self._work = self._work or work
+            self._condition.notify_all()
+
+    def _pod_event(self, kind, old, new):
+        # A worker stopped taking up resources
+        if new['metadata'].get('labels', {}).get('app') != 'worker':
+            return
+        if _phase(old) in ('Pending', 'Running') and \
+                (kind == 'DELETED' or _phase(new) in ('Succeeded', 'Failed')):
+            self._signal(freed=1)
+
+    def _watch_changes(self):
+        subscription = self.changes.subscribe(WORK_TABLES)
+        listening = False
+        while not self._stopped.is_set():
+            try:
+                self.changes.poll(timeout=1)
+            except psycopg2.Error as e:
+                LOG.error("Listening for new work failed with %s: %s", e.__class__.__name__, e)
+                time.sleep(CHANGES_BACKOFF)
+                continue
+            everything, cs_ids = subscription.consume()
+            if not listening:
+                # Everything counts as changed when we start listening, but
+                # we start right after a full cycle.
+                listening = True
+                continue
+            if cs_ids or everything:
+                LOG.debug("New work for %s challenge sets",
+                          "all" if everything else len(cs_ids))
+                self._signal(work=True)
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for events, return (pods freed, new work)."""
+        deadline = time.time() + timeout
+        with self._condition:
+            while not self._freed and not self._work and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+        if self._freed or self._work:
+            time.sleep(max(0., min(DEBOUNCE, deadline - time.time())))
+        with self._condition:
+            events = (self._freed, self._work)
+            self._freed, self._work = 0, False
+        return events
@@ -0,0 +1,202 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Pod informer.
+
+Keep an in-memory table of all pods in the cluster, filled by one full
+listing and kept up to date with a Kubernetes watch stream.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+import os
+import threading
+import time
+
+import pykube.objects
+import requests.exceptions
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('schedulers.informer')
+
+# The API server closes a watch after this many seconds, we then resume
+# from the last resourceVersion we have seen.
+WATCH_TIMEOUT = int(os.environ.get('MEISTER_INFORMER_WATCH_TIMEOUT', '300'))
+# Back off that many seconds after the watch failed before trying again.
+WATCH_BACKOFF = 1
+
+
+class WatchError(Exception):
+    """The watch stream ended with an ERROR event."""
+
+
+class PodInformer(object):
+    """In-memory table of pods kept in sync through a watch.
+
+    Pods are indexed by (namespace, name), worker pods additionally by
+    their job_id label.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.resource_version = None
+        self._lock = threading.RLock()
+        self._pods = {}
+        self._job_ids = {}
+        self._listeners = []
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """List all pods and start watching for changes in the background."""
+        if self._thread is None:
+            self._list()
+            self._thread = threading.Thread(target=self._watch_forever, name='pod-informer')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching, the watch stream is left at its next event or timeout."""
+        self._stopped.set()
+
+    @classmethod
+    def _key(cls, obj):
+        metadata = obj['metadata']
+        return (metadata.get('namespace', 'default'), metadata['name'])
+
+    def _store(self, obj):
+        key = self._key(obj)
+        self._pods[key] = pykube.objects.Pod(self.api, obj)
+        job_id = obj['metadata'].get('labels', {}).get('job_id')
+        if job_id is not None:
+            self._job_ids[int(job_id)] = key
+
+    def _remove(self, obj):
+        key = self._key(obj)
+        self._pods.pop(key, None)
+        job_id = obj['metadata'].get('labels', {}).get('job_id')
+        if job_id is not None and self._job_ids.get(int(job_id)) == key:
+            del self._job_ids[int(job_id)]
+
+    def _list(self):
+        response = self.api.get(url='pods')
+        response.raise_for_status()
+        pod_list = response.json()
+
+        with self._lock:
+            old_pods = self._pods
+            self._pods, self._job_ids = {}, {}
+            for obj in pod_list.get('items') or []:
+                self._store(obj)
+            self.resource_version = pod_list['metadata']['resourceVersion']
+            pods = self._pods
+        LOG.debug("Listed %d pods at resourceVersion %s", len(pods), self.resource_version)
+
+        # Tell listeners about everything that changed while we were not
+        # watching, as if we had seen the watch events.
+        for key, pod in pods.items():
+            old = old_pods.get(key)
+            if old is None:
+                self._notify('ADDED', None, pod.obj)
+            elif old.obj['metadata'].get('resourceVersion') != \
+                    pod.obj['metadata'].get('resourceVersion'):
+                self._notify('MODIFIED', old.obj, pod.obj)
+        for key, old in old_pods.items():
+            if key not in pods:
+                self._notify('DELETED', old.obj, old.obj)
+
+    def _notify(self, kind, old, new):
+        for listener in self._listeners:
+            try:
+                listener(kind, old, new)
+            except Exception as e:    # pylint: disable=broad-except
+                LOG.exception("Pod listener %r failed: %s", listener, e)
+
+    def _watch(self):
+        params = {'watch': 'true',
+                  'resourceVersion': self.resource_version,
+                  'timeoutSeconds': WATCH_TIMEOUT}
+        response = self.api.get(url='pods', params=params, stream=True,
+                                timeout=WATCH_TIMEOUT + 10)
+        response.raise_for_status()
+
+        for line in response.iter_lines():
+            if self._stopped.is_set():
+                break
+            if not line:
+                continue
+
+            event = json.loads(line)
+            obj = event['object']
+            if event['type'] == 'ERROR':
+                # Mostly 410 Gone, our resourceVersion is too old. Watching
+                # again from it would fail right away, we need to list again.
+                raise WatchError("{} {}".format(obj.get('code'), obj.get('message')))
+
+            with self._lock:
+                old = self._pods.get(self._key(obj))
+                if event['type'] == 'DELETED':
+                    self._remove(obj)
+                else:
+                    self._store(obj)
+                self.resource_version = obj['metadata']['resourceVersion']
+
+            self._notify(event['type'], old.obj if old is not None else None, obj)
+
+    def _watch_forever(self):
+        while not self._stopped.is_set():
+            try:
+                self._watch()
+            except WatchError as e:
+                LOG.warning("Pod watch error %s", e)
+            except requests.exceptions.RequestException as e:
+                LOG.error("Pod watch failed with %s: %s", e.__class__.__name__, e)
+            except Exception as e:    # pylint: disable=broad-except
+                LOG.exception("Pod watch failed with %s: %s", e.__class__.__name__, e)
+            else:
+                continue
+            # Events might have been lost, start over from a fresh listing
+            time.sleep(WATCH_BACKOFF)
+            try:
+                self._list()
+            except requests.exceptions.RequestException as e:
+                LOG.error("Pod listing failed with %s: %s", e.__class__.__name__, e)
+            except Exception as e:    # pylint: disable=broad-except
+                LOG.exception("Pod listing failed with %s: %s", e.__class__.__name__, e)
+
+    def subscribe(self, listener):
+        """Call listener(type, old, new) with the pod objects of every watch event.
+
+        old is None for pods we did not know yet. After the pods were listed
+        again, listeners are called for every pod that was added, modified
+        or deleted in the meantime. Listeners are called from the watch
+        thread and should return quickly, exceptions they raise are logged.
+        """
+        self._listeners.append(listener)
+
+    def observe(self, obj):
+        """Record a pod we have just created ourselves before its watch event arrives."""
+        with self._lock:
+            self._store(obj)
+
+    def pods(self, phases=None):
+        """Return all pods, or only those in one of phases."""
+        with self._lock:
+            pods = list(self._pods.values())
+        if phases is None:
+            return pods
+        return [p for p in pods if p.obj.get('status', {}).get('phase') in phases]
+
+    def get(self, name, namespace='default'):
+        """Return the pod called name, or None if it does not exist."""
+        with self._lock:
+            return self._pods.get((namespace, name))
+
+    def pod_for_job(self, job_id):
+        """Return the worker pod for job_id, or None if there is none."""
+        with self._lock:
+            key = self._job_ids.get(job_id)
+            return self._pods.get(key) if key is not None else None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Per-node placement model.
+
+Track the free resources of every Kubernetes node and place jobs with
+best-fit, or a batch of jobs with first-fit-decreasing.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import copy
+
+from farnsworth.models.job import Job
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('schedulers.placement')
+
+RESOURCES = ('cpu', 'memory', 'pods')
+
+
+def job_requests(job):
+    """Return the resources requested by a job in Kubernetes units.
+
+    CPU is in cores, memory in bytes and every job takes up one pod.
+    """
+    request_cpu = job.request_cpu if job.request_cpu is not None else Job.request_cpu.default
+    request_memory = job.request_memory if job.request_memory is not None \
+        else Job.request_memory.default
+    return {'cpu': request_cpu, 'memory': request_memory * 1024 ** 2, 'pods': 1}
+
+
+def fits(free, requests):
+    """Check if requests fit into the free resources."""
+    return all(free[r] >= requests[r] for r in RESOURCES)
+
+
+def scale_requests(requests, factor):
+    """Return requests scaled by factor, a pod stays a single pod."""
+    return {'cpu': requests['cpu'] * factor,
+            'memory': requests['memory'] * factor,
+            'pods': requests['pods']}
+
+
+class Placement(object):
+    """Free resources per node.
+
+    Nodes use the same layout as KubernetesScheduler._kube_node_capacities,
+    a dict of node name to {'cpu': ..., 'memory': ..., 'pods': ...}.
+    """
+
+    def __init__(self, capacities):
+        self.capacities = capacities
+        self.free = copy.deepcopy(capacities)
+
+    def _slack(self, node, requests):
+        # Normalized resources left on the node after placing the requests,
+        # the smaller the slack the tighter the fit.
+        capacity, free = self.capacities[node], self.free[node]
+        return sum((free[r] - requests[r]) / capacity[r]
+                   for r in RESOURCES if capacity[r] > 0)
+
+    def fits(self, requests, node=None):
+        """Check if the requests fit on node, or on any node if node is None."""
+        if node is not None:
+            return node in self.free and fits(self.free[node], requests)
+        return self.best_fit(requests) is not None
+
+    def best_fit(self, requests):
+        """Return the node the requests fit on with the least slack, or None."""
+        best, best_slack = None, None
+        # Sorting makes placement deterministic between scheduling rounds
+        for node in sorted(self.free):
+            if not fits(self.free[node], requests):
+                continue
+            slack = self._slack(node, requests)
+            if best_slack is None or slack < best_slack:
+                best, best_slack = node, slack
+        return best
+
+    def reserve(self, node, requests):
+        """Take requests away from the free resources of node."""
+        for r in RESOURCES:
+            self.free[node][r] -= requests[r]
+
+    def release(self, node, requests):
+        """Give requests back to the free resources of node."""
+        for r in RESOURCES:
+            self.free[node][r] += requests[r]
+
+    def place(self, requests):
+        """Place requests on the best fitting node and return it, or None."""
+        node = self.best_fit(requests)
+        if node is not None:
+            self.reserve(node, requests)
+        return node
+
+    def pack(self, items):
+        """Place a batch of (key, requests) with first-fit-decreasing.
+
+        Returns a dict of key to node for placed items and a list of the
+        keys that did not fit anywhere, in their original order.
+        """
+        def _size(item):
+            # Dominant share of the largest node, so that a job which is big
+            # in any dimension is placed before the small ones.
+            requests = item[1]
+            return max(requests[r] / max(c[r] for c in self.capacities.values())
+                       for r in RESOURCES
+                       if any(c[r] > 0 for c in self.capacities.values()))
+
+        if not self.capacities:
+            return {}, [key for key, _ in items]
+
+        placed, unplaced = {}, []
+        for key, requests in sorted(items, key=_size, reverse=True):
+            node = self.place(requests)
+            if node is None:
+                unplaced.append(key)
+            else:
+                placed[key] = node
+        order = {key: i for i, (key, _) in enumerate(items)}
+        unplaced.sort(key=order.get)
+        return placed, unplaced
+
+    @property
+    def total(self):
+        """Return the aggregated free resources over all nodes."""
+        total = {'cpu': 0.0, 'memory': 0, 'pods': 0}
+        for free in self.free.values():
+            for r in RESOURCES:
+                total[r] += free[r]
+        return total
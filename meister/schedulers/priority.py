@@ -8,21 +8,32 @@ Schedule everything whenver it is available.
 
 from __future__ import unicode_literals, absolute_import
 
-import copy
-from datetime import datetime, timedelta
-import operator
 import os
+import time
 
-import concurrent.futures
 import farnsworth.config
-from farnsworth.models.job import AFLJob, TesterJob, Job
-import pykube.objects
+from farnsworth.models.job import Job
 
+import meister.metrics as metrics
 import meister.schedulers
+from meister.schedulers import events, placement, selection, stagger
+import meister.upsert as upsert
 
 LOG = meister.schedulers.LOG.getChild('priority')
 
-NUM_THREADS = int(os.environ.get('MEISTER_NUM_THREADS', '20'))
+# Workers are not preempted before they ran for that many seconds, this can
+# be set per worker type with MEISTER_MIN_RUNTIME_<WORKER>, e.g. for AFL with
+# MEISTER_MIN_RUNTIME_AFL.
+MIN_RUNTIME = int(os.environ.get('MEISTER_MIN_RUNTIME', '300'))
+# Jobs only preempt workers whose priority is lower by more than that.
+PREEMPTION_MARGIN = int(os.environ.get('MEISTER_PREEMPTION_MARGIN', '10'))
+
+
+def min_runtime(worker):
+    """Return the seconds a worker of type worker runs before it can be preempted."""
+    if worker is None:
+        return MIN_RUNTIME
+    return int(os.environ.get('MEISTER_MIN_RUNTIME_{}'.format(worker.upper()), MIN_RUNTIME))
 
 
 class PriorityScheduler(meister.schedulers.BaseScheduler):
@@ -33,79 +44,140 @@ class PriorityScheduler(meister.schedulers.BaseScheduler):
 
     def __init__(self, *args, **kwargs):
         """Create a priority strategy object."""
-        self.staggering = int(os.environ['MEISTER_PRIORITY_STAGGERING'])
+        self.stagger = stagger.StaggerController()
         self.stagger_factor = float(os.environ['MEISTER_PRIORITY_STAGGER_FACTOR'])
-        self.runtime = timedelta(seconds=45)
+        # Jobs selected in the last cycle that did not get a worker, and the
+        # number of them started since, see react()
+        self._pending = []
+        self._started_since = 0
+        self._event_source = None
         super(PriorityScheduler, self).__init__(*args, **kwargs)
         LOG.debug("PriorityScheduler time!")
 
+    @property
+    def event_source(self):
+        """Return the source of scheduling events, started on first use."""
+        if self._event_source is None:
+            self._event_source = events.EventSource(self.informer).start()
+        return self._event_source
+
+    def _reserve(self, free, pod):
+        """Reserve the resources of pod on its node, return the node and the requests."""
+        requests = self._kube_pod_requests(pod)
+        node = self._kube_pod_node(pod)
+        if node in free.free:
+            free.reserve(node, requests)
+        else:
+            # Pods that are not bound to a node yet will end up on one
+            node = free.place(requests)
+        return node, requests
+
+    def _find_victims(self, free, requests, priority, kill_candidates, priorities, started):
+        """Find the node with the cheapest set of workers to kill to fit requests.
+
+        Only workers with a priority lower than priority by more than
+        PREEMPTION_MARGIN are considered. Among equal priorities the workers
+        that started last are killed first, they lose the least work, and
+        then the ones with the highest job id, so that we kill the same
+        workers every round.
+
+        Returns the node and the job ids to kill on it, or (None, []) if
+        killing workers does not make room on any node.
+        """
+        # We want a bit more room than needed so that we do not have to kill
+        # again right away, just like we stagger with stagger_factor.
+        wanted = placement.scale_requests(requests, self.stagger_factor)
+
+        best = None
+        for node in sorted(free.free):
+            candidates = sorted((job_id for job_id, (n, _) in kill_candidates.items()
+                                 if n == node and
+                                 priorities.get(job_id, 0) + PREEMPTION_MARGIN < priority),
+                                key=lambda job_id: (priorities.get(job_id, 0),
+                                                    -(started.get(job_id) or 0), -job_id))
+            available = dict(free.free[node])
+            victims = []
+            for job_id in candidates:
+                if placement.fits(available, wanted):
+                    break
+                for r in placement.RESOURCES:
+                    available[r] += kill_candidates[job_id][1][r]
+                victims.append(job_id)
+
+            if not placement.fits(available, requests):
+                continue
+
+            cost = (sum(priorities.get(job_id, 0) for job_id in victims), len(victims))
+            if best is None or cost < best[0]:
+                best = (cost, node, victims)
+
+        if best is None:
+            return None, []
+        return best[1], best[2]
+
     def _run(self):
         """Run jobs based on priority."""
-        # Our Greedy Job Allocator (GJA) is not optimal.
-        # It does work well enough in our tests though. A problem is
-        # that we might still have some jobs that have the same priority
-        # but different requirements and which are sorted differently
-        # each time (as in, not necessarily in a total order).
-        # For now, we do not optimize for the highest number of jobs at
-        # the lowest priority because the unused resources each
-        # scheduling round will be very small in comparison to all
-        # resources.
-        # Note, however, that in the worst case, we will kill the lowest
-        # priority jobs in an oscillatory fashion at each scheduling
-        # round.
-        start_time = datetime.now()
-        total_capacities = copy.deepcopy(self._kube_total_capacity)
-
-        def _can_schedule(job):
-            cpu_available = total_capacities['cpu'] >= job.request_cpu
-            memory_available = total_capacities['memory'] >= (job.request_memory * 1024 ** 2)
-            pod_available = total_capacities['pods'] >= 1
-            return cpu_available and memory_available and pod_available
-
-        def _account_for_resources(job):
-            LOG.debug("Scheduling new %s job with priority %d", job.worker, job.priority)
-            total_capacities['cpu'] -= job.request_cpu
-            total_capacities['memory'] -= (job.request_memory * 1024 ** 2)
-            total_capacities['pods'] -= 1
-
-        jobs_to_run, job_ids_to_run = [], set()
-        with farnsworth.config.master_db.atomic():
-            for j, p in self.brain.sort(self.jobs):
-                if not _can_schedule(j):
+        # We select the jobs to run with the highest total priority that fit
+        # on the cluster, see meister.schedulers.selection. Jobs that do not
+        # fit are skipped, so that one large job does not keep all smaller
+        # jobs behind it from running.
+        # Every job is placed on a single node with best-fit, so that a job
+        # only counts as schedulable if some node can actually hold it.
+        # To not kill the lowest priority jobs in an oscillatory fashion at
+        # each scheduling round, workers are only preempted after they ran
+        # for their minimum runtime, by jobs with a priority that is higher
+        # by more than a margin, and always in the same order.
+        # Placing the candidates greedily tells us when the cluster is full
+        greedy = placement.Placement(self._kube_node_capacities)
+        smallest = None
+
+        # Candidates are resolved against the job table in batches, so that
+        # we only do a few queries per batch and stop early once resources
+        # are exhausted. In sharded mode they come from the shared queue.
+        candidates, candidate_ids, rows = [], set(), {}
+        completed_resets = []
+        with self.resolved_candidates(completed_resets) as resolved:
+            for job, p in resolved:
+                if job.id in candidate_ids:
+                    LOG.error("A creator yielded a job a second time: job id=%d", job.id)
+                    continue
+                candidate_ids.add(job.id)
+                # The rows are cached across cycles, only the job we schedule
+                # gets the right-sized requests.
+                rows[job.id] = job
+                job = self.rightsizer.adjust(job)
+                candidates.append((job, p))
+
+                requests = placement.job_requests(job)
+                if greedy.place(requests) is None:
+                    LOG.debug("Job id=%d does not fit on any node, skipping", job.id)
+                smallest = requests if smallest is None else \
+                    dict((r, min(smallest[r], requests[r])) for r in placement.RESOURCES)
+                if not greedy.fits(smallest):
                     LOG.debug("Resources exhausted, stopping scheduling")
                     break
 
-                # We need to set completed_at to None if the TesterJob
-                # has finished because it will almost always exist for
-                # this CS already and we would otherwise not test
-                # anything for this CS and this worker type anymore.
-                # If it hasn't completed yet, it will pick up the
-                # individual jobs that we have already created at this
-                # point in the brain
-                kwargs = {df.name: getattr(j, df.name) for df in j.dirty_fields}
-                job, created = type(j).get_or_create(**kwargs)
-
-                if isinstance(j, (AFLJob, TesterJob)):
-                    job.completed_at = None
-
-                if job.completed_at is not None:
-                    LOG.debug("Job has been completed at %s, skipping", job.completed_at)
-                    continue
-
-                if created:
-                    LOG.debug("Job did not exist yet, created it")
-
-                if job.id not in job_ids_to_run:
-                    LOG.debug("Scheduling job id=%d type=%s", job.id, job.worker)
-                    _account_for_resources(job)
-                    if job.priority != p:
-                        LOG.debug("Priority changed from %d to %d", job.priority, p)
-                        job.priority = p
-                        job.save()
-                    jobs_to_run.append(job)
-                    job_ids_to_run.add(job.id)
-                else:
-                    LOG.error("A creator yielded a job a second time: job id=%d", job.id)
+        with metrics.phase('select'):
+            selected = selection.select(self._kube_node_capacities,
+                                        [(job.id, placement.job_requests(job), p)
+                                         for job, p in candidates])
+
+        jobs_to_run, priority_changes = [], []
+        for job, p in candidates:
+            if job.id not in selected:
+                continue
+            LOG.debug("Scheduling new %s job id=%d with priority %d on %s",
+                      job.worker, job.id, p, selected[job.id])
+            if job.priority != p:
+                LOG.debug("Priority changed from %d to %d", job.priority, p)
+                priority_changes.append((rows[job.id], p))
+                # The right-sized copy is scheduled with the new priority as well
+                job.priority = p
+            jobs_to_run.append(job)
+
+        with metrics.phase('upsert'), farnsworth.config.master_db.atomic():
+            upsert.update_priorities(priority_changes)
+            upsert.reset_completed(completed_resets)
 
         job_ids_to_run = set(job.id for job in jobs_to_run)
         LOG.debug("Jobs to run: %s", job_ids_to_run)
@@ -113,103 +185,186 @@ class PriorityScheduler(meister.schedulers.BaseScheduler):
         if job_ids_to_run:
             assert isinstance(list(job_ids_to_run)[0], (int, long))
 
-        # Calculate free resources, so that we do not kill jobs unnecessarily
-        free_resources = copy.deepcopy(self._kube_total_capacity)
-
-        def _remove_from_free(pod):
-            if 'resources' in pod.obj['spec']['containers'][0] and \
-                    'requests' in pod.obj['spec']['containers'][0]['resources']:
-                r = pod.obj['spec']['containers'][0]['resources']['requests']
-                free_resources['cpu'] -= meister.schedulers.cpu2float(r['cpu'])
-                free_resources['memory'] -= meister.schedulers.memory2int(r['memory'])
-                free_resources['pods'] -= 1
-
-        # Collect all current jobs
-        job_ids_to_kill, pods_to_kill, job_ids_to_ignore = [], [], set()
-        pending_pods = pykube.objects.Pod.objects(self.api).filter(field_selector={"status.phase": "Pending"})
-        running_pods = pykube.objects.Pod.objects(self.api).filter(field_selector={"status.phase": "Running"})
-
-        # Delay in API calls may result in change of number of pending/running pods
-        pods = [p for p in pending_pods] + [p for p in running_pods]
-        for pod in pods:
-            if pod.running or pod.pending:
-                _remove_from_free(pod)
-
-            if 'job_id' in pod.obj['metadata']['labels']:
-                job_id = int(pod.obj['metadata']['labels']['job_id'])
-                if job_id in job_ids_to_run:
-                    LOG.debug("Found a worker already taking care of id=%s", job_id)
-                    job_ids_to_ignore.add(job_id)
-                else:
-                    # We do not kill jobs that have been completed to keep the logs around. We do
-                    # want to kill jobs that are still in the processing stage though.
-                    # See states docs http://kubernetes.io/docs/user-guide/pod-states/
-                    if pod.running or pod.pending:
-                        pods_to_kill.append(pod)
-                        job_ids_to_kill.append(job_id)
+        # Calculate free resources per node, so that we do not kill jobs unnecessarily
+        free = placement.Placement(self._kube_node_capacities)
+
+        # Collect all current jobs, kill_candidates maps job ids to the node
+        # and the resources they are taking up
+        kill_candidates, job_ids_to_ignore = {}, set()
+        started, now = {}, time.time()
+        with metrics.phase('pods'):
+            pods = self.informer.pods(phases=('Pending', 'Running'))
+            self.stagger.observe(pods, now)
+            for pod in pods:
+                node, requests = None, None
+                if pod.running or pod.pending:
+                    node, requests = self._reserve(free, pod)
+
+                if 'job_id' in pod.obj['metadata']['labels']:
+                    job_id = int(pod.obj['metadata']['labels']['job_id'])
+                    if job_id in job_ids_to_run:
+                        LOG.debug("Found a worker already taking care of id=%s", job_id)
+                        job_ids_to_ignore.add(job_id)
                     else:
-                        LOG.warning("Encountered a Pod that is not ready (running or completed): %s",
-                                    pod.obj['metadata']['name'])
-
-        # Take first N jobs
-        # Take from pods_to_kill and job_ids_to_kill the first M
-        # s.t. resources(M) == resources(N) * 1.1
-        jobs_to_stagger = self.staggering * max(2, self.runtime.seconds)
-        jobs_staggered = [j for j in jobs_to_run if j.id not in job_ids_to_ignore][:jobs_to_stagger]
-        LOG.debug("Staggered jobs: %s", jobs_staggered)
+                        # We do not kill jobs that have been completed to keep the logs around. We do
+                        # want to kill jobs that are still in the processing stage though.
+                        # See states docs http://kubernetes.io/docs/user-guide/pod-states/
+                        if pod.running or pod.pending:
+                            started_at = self._kube_pod_started_at(pod)
+                            worker = pod.obj['metadata']['labels'].get('worker')
+                            if started_at is not None and now - started_at < min_runtime(worker):
+                                LOG.debug("Pod %s started %ds ago, not sacrificing it yet",
+                                          pod.obj['metadata']['name'], now - started_at)
+                            elif node is not None:
+                                kill_candidates[job_id] = (node, requests)
+                                started[job_id] = started_at
+                            else:
+                                LOG.debug("Pod %s does not fit on any node, not sacrificing it",
+                                          pod.obj['metadata']['name'])
+                        else:
+                            LOG.warning("Encountered a Pod that is not ready (running or completed): %s",
+                                        pod.obj['metadata']['name'])
+
+        # Take first N jobs, place as many as possible on the free resources
+        # and make room for the others by sacrificing the lowest priority
+        # workers on the node where that is cheapest. N and the number of
+        # workers we kill are set by the stagger controller.
+        budget = self.stagger.budget
+        jobs_staggered = [j for j in jobs_to_run if j.id not in job_ids_to_ignore][:budget]
+
+        placed, unplaced = free.pack([(j.id, placement.job_requests(j)) for j in jobs_staggered])
 
-        resources_needed = {'cpu': sum(j.request_cpu for j in jobs_staggered) * self.stagger_factor,
-                            'memory': sum(j.request_memory for j in jobs_staggered) * self.stagger_factor,
-                            'pods': int(jobs_to_stagger * self.stagger_factor)}
+        jobs_staggered_to_kill = []
+        if unplaced and kill_candidates:
+            priorities = dict(Job.select(Job.id, Job.priority)
+                                 .where(Job.id.in_(kill_candidates.keys()))
+                                 .tuples())
+            jobs_by_id = {j.id: j for j in jobs_staggered}
+
+            for job_id in unplaced:
+                requests = placement.job_requests(jobs_by_id[job_id])
+                node, victims = self._find_victims(free, requests, jobs_by_id[job_id].priority,
+                                                   kill_candidates, priorities, started)
+                if node is None:
+                    LOG.debug("Cannot make room for job id=%s on any node", job_id)
+                    continue
+                if len(jobs_staggered_to_kill) + len(victims) > budget:
+                    LOG.debug("Killing %d more workers for job id=%s exceeds the budget of %d",
+                              len(victims), job_id, budget)
+                    continue
 
-        resources_needed['cpu'] -= free_resources['cpu']
-        resources_needed['memory'] -= free_resources['memory']
-        resources_needed['pods'] -= free_resources['pods']
+                for victim in victims:
+                    victim_node, victim_requests = kill_candidates.pop(victim)
+                    free.release(victim_node, victim_requests)
+                    jobs_staggered_to_kill.append(victim)
+                    LOG.debug("Sacrificing job id=%s on %s", victim, victim_node)
 
-        # pods_zipped are the pods zipped with job_ids sorted by id
-        # s.t. we can zip them again with the job objects, which are unknown
-        jobs_staggered_to_kill = []
-        if (resources_needed['cpu'] > 0 or
-                resources_needed['memory'] > 0 or
-                resources_needed['pods'] > 0) and job_ids_to_kill:
-            pods_zipped = sorted(zip(pods_to_kill, job_ids_to_kill), key=operator.itemgetter(1))
-            jobs = Job.select(Job.request_cpu, Job.request_memory, Job.priority) \
-                      .where(Job.id.in_(job_ids_to_kill)) \
-                      .order_by(Job.id.asc())
-
-            for (pod, job_id), job in sorted(zip(pods_zipped, jobs), key=lambda j: j[1].priority):
-                if resources_needed['cpu'] < 0 and \
-                        resources_needed['memory'] < 0 and \
-                        resources_needed['pods'] < 0:
-                    LOG.debug("Collected enough jobs to sacrifice for our staggered jobs")
-                    break
+                free.reserve(node, requests)
+                placed[job_id] = node
 
-                resources_needed['cpu'] -= job.request_cpu
-                resources_needed['memory'] -= job.request_memory
-                resources_needed['pods'] -= 1
-                jobs_staggered_to_kill.append(job_id)
+        jobs_not_placed = [j.id for j in jobs_staggered if j.id not in placed]
+        if jobs_not_placed:
+            LOG.debug("Jobs not fitting on any node this round: %s", jobs_not_placed)
+        jobs_staggered = [j for j in jobs_staggered if j.id in placed]
+        LOG.debug("Staggered jobs: %s", jobs_staggered)
 
-                LOG.debug("Sacrificing job id=%s", job_id)
+        # Started as soon as resources free up in event-driven mode
+        self._pending = [j for j in jobs_to_run
+                         if j.id not in job_ids_to_ignore and j.id not in placed]
+        self._started_since = 0
 
         LOG.debug("Terminating workers: %s", jobs_staggered_to_kill)
         LOG.debug("Workers running already: %s", job_ids_to_ignore)
 
         # Kill workers
-        def _terminate(job_id):
-            LOG.debug("Killing worker for job %s", job_id)
-            self.terminate(self._worker_name(job_id))
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            executor.map(_terminate, jobs_staggered_to_kill)
+        with metrics.phase('kill'):
+            deleted = self.terminate_jobs(jobs_staggered_to_kill)
 
         # Schedule jobs
         def _schedule(job):
             LOG.debug("Scheduling %s for cs=%s cbn=%s", job.__class__.__name__, job.cs_id,
                         job.cbn_id)
-            self.schedule(job)
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            executor.map(_schedule, jobs_staggered)
-
-        self._kube_resources    # pylint: disable=pointless-statement
-        self.runtime = datetime.now() - start_time
+            return self.schedule(job)
+
+        with metrics.phase('schedule'):
+            created = self.backend.map('create', _schedule, jobs_staggered)
+        # Jobs whose old pod is still being deleted are neither errors nor conflicts
+        created = [s for s in created if s != meister.schedulers.SKIPPED]
+
+        # Failed calls come back as None, failed creations with their HTTP status
+        self.stagger.update(len(created) + len(deleted),
+                            sum(1 for s in created if s is None or (s >= 400 and s != 409)) +
+                            sum(1 for s in deleted if s is None),
+                            sum(1 for s in created if s == 409),
+                            stagger.free_share(free.total, self._kube_total_capacity),
+                            free.total['pods'])
+
+        with metrics.phase('rightsizing'):
+            self.rightsizer.update(self.informer)
+
+        # Finished pods are cleaned up in the background, see meister.schedulers.reaper
+        self.reaper    # pylint: disable=pointless-statement
+
+        counts = {'selected': len(jobs_to_run),
+                  'scheduled': len(jobs_staggered),
+                  'killed': len(jobs_staggered_to_kill)}
+        for outcome, count in counts.items():
+            metrics.gauge('meister_cycle_jobs', count, outcome=outcome)
+        metrics.record('jobs', counts)
+
+    def _place(self):
+        """Start pending jobs on the resources that are free now, without killing anything.
+
+        Returns the number of jobs started. All jobs started between two full
+        cycles count against the stagger budget.
+        """
+        ids = [j.id for j in self._pending]
+        if not ids:
+            return 0
+        completed = set(job_id for job_id, in Job.select(Job.id)
+                                                 .where(Job.id.in_(ids) &
+                                                        Job.completed_at.is_null(False))
+                                                 .tuples())
+
+        free = placement.Placement(self._kube_node_capacities)
+        running = set()
+        for pod in self.informer.pods(phases=('Pending', 'Running')):
+            self._reserve(free, pod)
+            if 'job_id' in pod.obj['metadata'].get('labels', {}):
+                running.add(int(pod.obj['metadata']['labels']['job_id']))
+
+        pending = [j for j in self._pending if j.id not in completed and j.id not in running]
+        budget = max(0, self.stagger.budget - self._started_since)
+        placed, _ = free.pack([(j.id, placement.job_requests(j)) for j in pending[:budget]])
+        jobs = [j for j in pending if j.id in placed]
+        self._pending = [j for j in pending if j.id not in placed]
+
+        with metrics.phase('schedule'):
+            self.backend.map('create', self.schedule, jobs)
+        self._started_since += len(jobs)
+        LOG.debug("Started %d pending jobs on freed resources, %d still pending",
+                  len(jobs), len(self._pending))
+        metrics.record('jobs', {'scheduled': len(jobs)})
+        return len(jobs)
+
+    def react(self, interval=events.RECONCILE_INTERVAL, proceed=None):
+        """Start pending jobs as workers finish until the next full cycle is due.
+
+        Returns when new work arrived or after interval seconds.
+
+        :keyword proceed: Called before starting jobs, we return as soon as
+                          it returns False.
+        """
+        deadline = time.time() + interval
+        while time.time() < deadline:
+            freed, work = self.event_source.wait(deadline - time.time())
+            if work:
+                LOG.debug("New work arrived, running a full cycle")
+                return
+            if not freed or not self._pending:
+                continue
+            if proceed is not None and not proceed():
+                return
+            LOG.debug("%d workers finished, starting pending jobs", freed)
+            with metrics.cycle():
+                self._place()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Pod reaper.
+
+Delete finished worker pods in the background instead of in the scheduling
+loop. The most recently finished pods are kept for a while, so that their
+logs can still be looked at, all older ones are deleted in batches with one
+collection delete per batch. The reaper deletes at most a fixed number of
+pods per second, so that it never competes with the scheduler for the API
+server.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import threading
+import time
+
+import requests.exceptions
+
+import meister.log
+import meister.schedulers
+
+LOG = meister.log.LOG.getChild('schedulers.reaper')
+
+# Finished worker pods kept for log inspection, the most recent ones
+RETAIN = int(os.environ.get('MEISTER_REAPER_RETAIN', '50'))
+# Seconds between two passes over the finished pods
+INTERVAL = float(os.environ.get('MEISTER_REAPER_INTERVAL', '10'))
+# Pods deleted per second at most
+RATE = float(os.environ.get('MEISTER_REAPER_RATE', '20'))
+# Pods deleted with one collection delete, keeps the label selector short
+BATCH_SIZE = int(os.environ.get('MEISTER_REAPER_BATCH_SIZE', '50'))
+
+# Never delete pods that have been restarted and are running again
+FIELD_SELECTOR = 'status.phase!=Pending,status.phase!=Running'
+
+
+def finished_at(pod):
+    """Return when a pod finished, in seconds since the epoch.
+
+    Pods without a terminated container count from their start or creation.
+    """
+    status = pod.obj.get('status', {})
+    finished = [meister.schedulers.kube_timestamp(c['state']['terminated']['finishedAt'])
+                for c in status.get('containerStatuses') or []
+                if ((c.get('state') or {}).get('terminated') or {}).get('finishedAt')]
+    if finished:
+        return max(finished)
+    timestamp = status.get('startTime') or pod.obj['metadata'].get('creationTimestamp')
+    return meister.schedulers.kube_timestamp(timestamp) if timestamp is not None else 0
+
+
+class PodReaper(object):
+    """Delete finished worker pods in the background.
+
+    :param keep: Called with the name of a finished pod, the pod is not
+                 deleted while it returns True.
+    """
+
+    def __init__(self, api, informer, keep=None, retain=RETAIN, interval=INTERVAL,
+                 rate=RATE, batch_size=BATCH_SIZE):
+        self.api = api
+        self.informer = informer
+        self.keep = keep
+        self.retain = retain
+        self.interval = interval
+        self.rate = rate
+        self.batch_size = batch_size
+        self.reaped = 0
+        self._failed = set()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start reaping in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._reap_forever, name='pod-reaper')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop reaping after the current batch."""
+        self._stopped.set()
+
+    def finished(self):
+        """Return the finished worker pods that can be deleted, oldest first."""
+        pods, names = [], set()
+        for pod in self.informer.pods(phases=('Succeeded', 'Failed')):
+            names.add(pod.name)
+            labels = pod.obj['metadata'].get('labels', {})
+            if labels.get('app') != 'worker' or 'job_id' not in labels:
+                continue
+            if pod.obj.get('status', {}).get('phase') == 'Failed' and \
+                    pod.name not in self._failed:
+                # Only warn once per pod, it might be kept for a while
+                LOG.warning("Pod %s failed", pod.name)
+                self._failed.add(pod.name)
+            if self.keep is not None and self.keep(pod.name):
+                continue
+            pods.append(pod)
+        # Forget failed pods that are gone
+        self._failed &= names
+
+        pods.sort(key=finished_at)
+        if self.retain > 0:
+            pods = pods[:-self.retain]
+        return pods
+
+    def _delete(self, batch):
+        selector = 'app=worker,job_id in ({})'.format(
+            ','.join(p.obj['metadata']['labels']['job_id'] for p in batch))
+        LOG.debug("Reaping pods with %s", selector)
+        response = self.api.delete(url='pods', namespace='default',
+                                   params={'labelSelector': selector,
+                                           'fieldSelector': FIELD_SELECTOR})
+        if response.status_code not in (404, 409):
+            response.raise_for_status()
+
+    def reap(self):
+        """Delete the finished pods we do not keep, return how many we deleted.
+
+        Deletes at most rate pods per second and at most rate times interval
+        pods per call.
+        """
+        pods = self.finished()[:max(1, int(self.rate * self.interval))]
+        deleted = 0
+        for i in range(0, len(pods), self.batch_size):
+            if self._stopped.is_set():
+                break
+            batch = pods[i:i + self.batch_size]
+            start = time.time()
+            self._delete(batch)
+            deleted += len(batch)
+            for pod in batch:
+                self._failed.discard(pod.name)
+            # Spread the batches out so that we stay below the rate
+            time.sleep(max(0., len(batch) / self.rate - (time.time() - start)))
+
+        if deleted:
+            self.reaped += deleted
+            LOG.debug("Reaped %d finished pods, %d in total", deleted, self.reaped)
+        return deleted
+
+    def _reap_forever(self):
+        while not self._stopped.is_set():
+            try:
+                self.reap()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                LOG.error("Reaping pods failed with %s: %s", e.__class__.__name__, e)
+            except Exception as e:    # pylint: disable=broad-except
+                LOG.exception("Reaping pods failed with %s: %s", e.__class__.__name__, e)
+            self._stopped.wait(self.interval)
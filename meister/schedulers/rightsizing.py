@@ -0,0 +1,240 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Right-sizing of job resource requests.
+
+Creators request fixed resources per job type, which are usually far more
+than the workers actually use. We sample the usage of all running workers
+from the Kubernetes metrics API every cycle, keep the peak per pod and, once
+a pod has completed, record its peaks per worker type and per challenge set
+and worker type. Requests are then recommended at a percentile of the
+recorded peaks plus a safety margin, an override table takes precedence.
+
+MEISTER_RIGHTSIZING selects the mode: "off" (the default) does nothing,
+"recommend" only logs the recommendations and "apply" changes the requests
+of the jobs we schedule. The recorded peaks are kept in a JSON state file
+so that they survive restarts.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import copy
+import json
+import math
+import os
+
+import requests.exceptions
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('schedulers.rightsizing')
+
+MODES = ('off', 'recommend', 'apply')
+MODE = os.environ.get('MEISTER_RIGHTSIZING', 'off')
+STATE_FILE = os.environ.get('MEISTER_RIGHTSIZING_STATE', 'meister-rightsizing.json')
+# JSON file of worker type to fixed requests, e.g. {"afl": {"cpu": 8, "memory": 4096}}
+OVERRIDES_FILE = os.environ.get('MEISTER_RIGHTSIZING_OVERRIDES')
+PERCENTILE = float(os.environ.get('MEISTER_RIGHTSIZING_PERCENTILE', '95'))
+MARGIN = float(os.environ.get('MEISTER_RIGHTSIZING_MARGIN', '0.2'))
+# Completed pods needed before we recommend anything for a key
+MIN_SAMPLES = int(os.environ.get('MEISTER_RIGHTSIZING_MIN_SAMPLES', '20'))
+# Completed pods kept per key
+HISTORY = 500
+# Requests are never made smaller than that, cpu in cores, memory in MiB
+MIN_REQUESTS = {'cpu': 0.1, 'memory': 128}
+
+_CPU_UNITS = {'n': 1e-9, 'u': 1e-6, 'm': 1e-3}
+_MEMORY_UNITS = {'Ki': 1024, 'Mi': 1024 ** 2, 'Gi': 1024 ** 3,
+                 'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+
+def cpu_cores(quantity):
+    """Return a Kubernetes CPU quantity like 250m or 1234567n in cores."""
+    if quantity[-1:] in _CPU_UNITS:
+        return float(quantity[:-1]) * _CPU_UNITS[quantity[-1]]
+    return float(quantity)
+
+
+def memory_mib(quantity):
+    """Return a Kubernetes memory quantity like 512Ki or 1Gi in MiB."""
+    for suffix in sorted(_MEMORY_UNITS, key=len, reverse=True):
+        if quantity.endswith(suffix):
+            return float(quantity[:-len(suffix)]) * _MEMORY_UNITS[suffix] / 1024 ** 2
+    return float(quantity) / 1024 ** 2
+
+
+def percentile(values, p):
+    """Return the p-th percentile of values, nearest rank."""
+    values = sorted(values)
+    rank = int(math.ceil(p / 100. * len(values)))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def _key(worker, cs_id=None):
+    return worker if cs_id is None else '{}/{}'.format(worker, cs_id)
+
+
+class RightSizer(object):
+    """Record the peak usage of workers and recommend requests from it."""
+
+    def __init__(self, api, mode=MODE, state_file=STATE_FILE, overrides_file=OVERRIDES_FILE):
+        if mode not in MODES:
+            raise ValueError("MEISTER_RIGHTSIZING must be one of {}, not {}".format(
+                ", ".join(MODES), mode))
+        self.api = api
+        self.mode = mode
+        self.state_file = state_file
+        self.overrides = {}
+        if overrides_file is not None:
+            with open(overrides_file) as f:
+                self.overrides = json.load(f)
+        # Samples per key, a key is a worker type or a worker type and a CS
+        self.samples = {}
+        # Peaks of the pods we are watching, by pod name
+        self._peaks = {}
+        self._available = True
+        self._recommended = {}
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def _load(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                self.samples = json.load(f).get('samples', {})
+        except ValueError, e:
+            LOG.error("Ignoring the broken right-sizing state in %s: %s", self.state_file, e)
+        LOG.info("Loaded right-sizing samples for %d keys", len(self.samples))
+
+    def _save(self):
+        if self.state_file is None:
+            return
+        # Write a new file and move it over the old one, so that we never
+        # leave a half-written state behind.
+        temporary = '{}.tmp'.format(self.state_file)
+        with open(temporary, 'w') as f:
+            json.dump({'samples': self.samples}, f, sort_keys=True)
+        os.rename(temporary, self.state_file)
+
+    def _sample(self):
+        response = self.api.get(url='pods', namespace='default', version='metrics.k8s.io/v1beta1',
+                                base='/apis', params={'labelSelector': 'app=worker'})
+        if response.status_code == 404:
+            LOG.warning("The metrics API is not available, not right-sizing")
+            self._available = False
+            return
+        response.raise_for_status()
+
+        for item in response.json().get('items') or []:
+            name = item['metadata']['name']
+            usage = {'cpu': 0., 'memory': 0.}
+            for container in item.get('containers') or []:
+                usage['cpu'] += cpu_cores(container['usage'].get('cpu', '0'))
+                usage['memory'] += memory_mib(container['usage'].get('memory', '0'))
+            peak = self._peaks.setdefault(name, {'cpu': 0., 'memory': 0.})
+            peak['cpu'] = max(peak['cpu'], usage['cpu'])
+            peak['memory'] = max(peak['memory'], usage['memory'])
+
+    def _record(self, key, peak):
+        samples = self.samples.setdefault(key, {'cpu': [], 'memory': []})
+        for resource in ('cpu', 'memory'):
+            samples[resource] = (samples[resource] + [peak[resource]])[-HISTORY:]
+
+    def update(self, informer):
+        """Sample the usage of running workers and record the pods that completed.
+
+        Pods that disappeared or failed are dropped, their peaks are not
+        representative of a complete run.
+        """
+        if not self.enabled or not self._available:
+            return
+        try:
+            self._sample()
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            LOG.error("Sampling worker usage failed with %s: %s", e.__class__.__name__, e)
+            return
+
+        recorded = 0
+        for name in list(self._peaks):
+            pod = informer.get(name)
+            if pod is not None and pod.obj.get('status', {}).get('phase') in ('Pending', 'Running'):
+                continue
+            peak = self._peaks.pop(name)
+            if pod is None or pod.obj.get('status', {}).get('phase') != 'Succeeded':
+                continue
+            labels = pod.obj['metadata'].get('labels', {})
+            if 'worker' not in labels:
+                continue
+            self._record(_key(labels['worker']), peak)
+            if 'cs_id' in labels:
+                self._record(_key(labels['worker'], labels['cs_id']), peak)
+            recorded += 1
+
+        if recorded:
+            LOG.debug("Recorded the peak usage of %d completed workers", recorded)
+            self._save()
+
+    def watching(self, name):
+        """Check if the usage of pod name is being sampled and not recorded yet."""
+        return name in self._peaks
+
+    def recommend(self, worker, cs_id=None):
+        """Return the recommended requests for a worker, or None if we do not know yet.
+
+        Requests are a dict with cpu in cores and memory in MiB, overrides
+        win over samples of the CS, which win over samples of the worker type.
+        """
+        if worker in self.overrides:
+            return self.overrides[worker]
+        for key in (_key(worker, cs_id), _key(worker)):
+            samples = self.samples.get(key)
+            if samples is None or len(samples['cpu']) < MIN_SAMPLES:
+                continue
+            requests = {}
+            for resource in ('cpu', 'memory'):
+                value = percentile(samples[resource], PERCENTILE) * (1 + MARGIN)
+                requests[resource] = max(MIN_REQUESTS[resource], value)
+            # Kubernetes takes cpu in millicores, we ask for whole MiB
+            requests['cpu'] = math.ceil(requests['cpu'] * 10) / 10
+            requests['memory'] = int(math.ceil(requests['memory']))
+            return requests
+        return None
+
+    def adjust(self, job):
+        """Log the recommended requests of job and return the job to schedule.
+
+        In apply mode, that is a copy of job with the recommended requests,
+        job itself is the row we keep across cycles and keeps the requests
+        of its creator.
+        """
+        if not self.enabled:
+            return job
+        requests = self.recommend(job.worker, job.cs_id)
+        if requests is None:
+            return job
+
+        current = {'cpu': job.request_cpu, 'memory': job.request_memory}
+        key = (job.worker, job.cs_id)
+        if self._recommended.get(key) != (current, requests):
+            # Only log every recommendation once
+            self._recommended[key] = (current, requests)
+            LOG.info("Recommending %s cores and %s MiB for %s jobs of cs=%s instead of "
+                     "%s cores and %s MiB", requests.get('cpu'), requests.get('memory'),
+                     job.worker, job.cs_id, current['cpu'], current['memory'])
+
+        if self.mode != 'apply':
+            return job
+        adjusted = copy.copy(job)
+        # The field values must not be shared with job
+        adjusted._data = dict(job._data)
+        adjusted._dirty = set(job._dirty)
+        if requests.get('cpu') is not None:
+            adjusted.request_cpu = requests['cpu']
+        if requests.get('memory') is not None:
+            adjusted.request_memory = requests['memory']
+        return adjusted
@@ -0,0 +1,187 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Job selection.
+
+Select the set of jobs with the highest total priority that fits on the
+cluster, a multi-dimensional knapsack over cpu, memory and pods. It is
+solved with a depth-first branch-and-bound that tries to take jobs in
+priority order first, so that the first solution found is the greedy one
+that skips jobs which do not fit instead of stopping at them. The search
+improves on it until it is exhausted or runs out of time. Every job taken
+is placed on a node, a solution only counts if all of its jobs are placed.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import time
+
+import meister.log
+from meister.schedulers import placement
+
+LOG = meister.log.LOG.getChild('schedulers.selection')
+
+# Seconds the branch-and-bound may take before we go with the best
+# selection found so far, 0 only does the greedy selection.
+TIME_LIMIT = float(os.environ.get('MEISTER_SELECTION_TIME_LIMIT', '0.5'))
+
+
+class _Tree(object):
+    """Fenwick tree of the weights and values of items in one resource order.
+
+    Items are removed once the search decided on them and added back when
+    it backtracks, so that the fractional bound only ever sees undecided
+    items without scanning them.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.weights = [0.] * (size + 1)
+        self.values = [0.] * (size + 1)
+        self._step = 1
+        while self._step * 2 <= size:
+            self._step *= 2
+
+    def add(self, position, weight, value):
+        position += 1
+        while position <= self.size:
+            self.weights[position] += weight
+            self.values[position] += value
+            position += position & -position
+
+    def prefix(self, limit):
+        """Return the number of leading positions, their weight and value,
+        for the longest prefix that weighs at most limit."""
+        position, weight, value = 0, 0., 0.
+        step = self._step if self.size else 0
+        while step:
+            following = position + step
+            if following <= self.size and weight + self.weights[following] <= limit:
+                position = following
+                weight += self.weights[following]
+                value += self.values[following]
+            step //= 2
+        return position, weight, value
+
+
+class Selection(object):
+    """Select (key, requests, value) items to place on nodes.
+
+    Items are expected in the order they should be preferred in, usually
+    by descending priority.
+    """
+
+    def __init__(self, capacities, items, time_limit=TIME_LIMIT):
+        self.capacities = capacities
+        self.time_limit = time_limit
+        # Items that do not fit on any empty node are never selected
+        empty = placement.Placement(capacities)
+        self.items = [item for item in items if empty.fits(item[1])]
+        self.best_value = None
+        self.best = {}
+        self.nodes = 0
+        self.complete = False
+        self._orders, self._positions, self._trees = {}, {}, {}
+        for r in placement.RESOURCES:
+            # Items by value per unit of r, for the fractional bound
+            order = sorted(range(len(self.items)),
+                           key=lambda i, r=r: self._density(self.items[i], r),
+                           reverse=True)
+            self._orders[r] = order
+            self._positions[r] = dict((i, position) for position, i in enumerate(order))
+            self._trees[r] = _Tree(len(order))
+        # Items from _undecided on are in the trees
+        self._undecided = len(self.items)
+        self._decide(0)
+
+    @staticmethod
+    def _density(item, resource):
+        _, requests, value = item
+        if requests[resource] <= 0:
+            return float('inf')
+        return value / requests[resource]
+
+    def _decide(self, index):
+        # Keep exactly the items from index on in the trees
+        for i in range(min(index, self._undecided), max(index, self._undecided)):
+            sign = 1 if i >= index else -1
+            _, requests, value = self.items[i]
+            for r in placement.RESOURCES:
+                self._trees[r].add(self._positions[r][i], sign * requests[r], sign * value)
+        self._undecided = index
+
+    def _bound(self, index, value, free):
+        # Best value reachable by taking items from index on: the smallest
+        # fractional knapsack bound over any single resource, node
+        # boundaries are ignored.
+        self._decide(index)
+        bound = None
+        for r in placement.RESOURCES:
+            position, weight, total = self._trees[r].prefix(free[r])
+            total += value
+            order = self._orders[r]
+            if position < len(order):
+                # The next item is undecided, decided items weigh nothing
+                _, requests, item_value = self.items[order[position]]
+                if requests[r] > 0:
+                    total += item_value * max(0., free[r] - weight) / requests[r]
+            bound = total if bound is None else min(bound, total)
+        return bound
+
+    def _record(self, value, path):
+        if self.best_value is None or value > self.best_value:
+            self.best_value = value
+            self.best = dict((self.items[i][0], node) for i, node in path if node is not None)
+
+    def solve(self):
+        """Return a dict of the selected keys to the node they are placed on.
+
+        The greedy solution is always completed, the search for better ones
+        stops once the time limit is reached.
+        """
+        start = time.time()
+        deadline = start + self.time_limit
+        nodes = placement.Placement(self.capacities)
+        value, index, path = 0, 0, []
+        while True:
+            self.nodes += 1
+            if self.best_value is not None and time.time() > deadline:
+                break
+            if index == len(self.items) or (
+                    self.best_value is not None and
+                    self._bound(index, value, nodes.total) <= self.best_value):
+                self._record(value, path)
+                # Undo down to the last item we took and leave it out instead
+                while path:
+                    i, node = path.pop()
+                    if node is not None:
+                        nodes.release(node, self.items[i][1])
+                        value -= self.items[i][2]
+                        path.append((i, None))
+                        index = i + 1
+                        break
+                else:
+                    self.complete = True
+                    break
+                continue
+
+            _, requests, item_value = self.items[index]
+            node = nodes.place(requests)
+            if node is not None:
+                value += item_value
+            path.append((index, node))
+            index += 1
+
+        LOG.debug("Selected %d of %d jobs with a total priority of %s after %d steps in "
+                  "%.3fs%s", len(self.best), len(self.items), self.best_value, self.nodes,
+                  time.time() - start, "" if self.complete else ", stopped early")
+        return self.best
+
+
+def select(capacities, items, time_limit=TIME_LIMIT):
+    """Select (key, requests, value) items with the highest total value that fit.
+
+    Returns a dict of the selected keys to the node they are placed on.
+    """
+    return Selection(capacities, items, time_limit=time_limit).solve()
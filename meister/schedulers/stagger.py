@@ -0,0 +1,115 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Stagger controller.
+
+Decide how many pods to launch and kill per scheduling cycle with additive
+increase, multiplicative decrease: the budget grows while pods start quickly
+and the API server accepts our calls, grows fast while most of the cluster
+is idle, e.g. at the start of a round, and is halved as soon as pods take
+too long to start or API calls fail.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+
+import meister.log
+import meister.metrics as metrics
+from meister.schedulers import kube_timestamp, placement
+
+LOG = meister.log.LOG.getChild('schedulers.stagger')
+
+# Pods launched and killed per cycle at least, and at the start
+STAGGER_MIN = int(os.environ.get('MEISTER_PRIORITY_STAGGERING', '8'))
+STAGGER_MAX = int(os.environ.get('MEISTER_STAGGER_MAX', '1000'))
+# Seconds from creation until pods should be running, the 90th percentile
+# of the pods started since the last cycle is compared against it.
+TARGET_LATENCY = float(os.environ.get('MEISTER_STAGGER_TARGET_LATENCY', '30'))
+# Share of failed and of conflicting pod creations we back off at
+MAX_ERROR_RATE = float(os.environ.get('MEISTER_STAGGER_MAX_ERROR_RATE', '0.05'))
+MAX_CONFLICT_RATE = float(os.environ.get('MEISTER_STAGGER_MAX_CONFLICT_RATE', '0.2'))
+# Share of the cluster that has to be free to ramp up fast
+IDLE_SHARE = 0.5
+BACKOFF = 0.5
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+class StaggerController(object):
+    """Per-cycle budget of pods to launch and kill."""
+
+    def __init__(self, minimum=STAGGER_MIN, maximum=STAGGER_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.budget = minimum
+        self._latencies = []
+        self._since = None
+
+    def observe(self, pods, now):
+        """Record the start-up latency of pods that started since the last cycle.
+
+        Pods that are still pending count with the time they have been
+        waiting once that is longer than the target.
+        """
+        since, self._since = self._since, now
+        for pod in pods:
+            status = pod.obj.get('status', {})
+            created = pod.obj['metadata'].get('creationTimestamp')
+            if created is None:
+                continue
+            created = kube_timestamp(created)
+            if status.get('phase') == 'Pending':
+                if now - created > TARGET_LATENCY:
+                    self._latencies.append(now - created)
+            elif status.get('startTime') is not None:
+                started = kube_timestamp(status['startTime'])
+                # Timestamps have a resolution of one second
+                if since is None or started >= since - 1:
+                    self._latencies.append(started - created)
+
+    def update(self, calls, errors, conflicts, free, free_pods):
+        """Adjust the budget after a cycle.
+
+        :param calls: Pod creations and deletions attempted this cycle.
+        :param errors: Calls that failed.
+        :param conflicts: Pod creations that conflicted with an existing pod.
+        :param free: Smallest share of cpu, memory and pods left free.
+        :param free_pods: Number of pods that could still be started.
+        """
+        latencies, self._latencies = self._latencies, []
+        latency = _percentile(latencies, 0.9) if latencies else None
+        error_rate = errors / calls if calls else 0.
+        conflict_rate = conflicts / calls if calls else 0.
+
+        budget = self.budget
+        if error_rate > MAX_ERROR_RATE or conflict_rate > MAX_CONFLICT_RATE or \
+                (latency is not None and latency > TARGET_LATENCY):
+            budget = int(budget * BACKOFF)
+            reason = "backing off"
+        elif free >= IDLE_SHARE:
+            budget = max(budget * 2, int(free_pods * free))
+            reason = "cluster is idle"
+        else:
+            budget += self.minimum
+            reason = "ramping up"
+        self.budget = max(self.minimum, min(self.maximum, budget))
+
+        LOG.debug("Stagger budget %d, %s (p90 latency %s, %d/%d errors, %d conflicts, "
+                  "%.0f%% free)", self.budget, reason,
+                  "{:.0f}s".format(latency) if latency is not None else "-",
+                  errors, calls, conflicts, free * 100)
+        metrics.gauge('meister_stagger_budget', self.budget)
+        metrics.record('stagger', {'budget': self.budget, 'latency': latency,
+                                   'error_rate': error_rate, 'conflict_rate': conflict_rate,
+                                   'free': free})
+        return self.budget
+
+
+def free_share(free, capacity):
+    """Return the smallest share of any resource that is free."""
+    shares = [free[r] / capacity[r] for r in placement.RESOURCES if capacity[r] > 0]
+    return max(0., min(shares)) if shares else 0.
@@ -0,0 +1,132 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Sharded candidate generation.
+
+With MEISTER_SHARD_COUNT above one, several meisters generate candidates
+together: every replica only runs the creators for the challenge sets of its
+shard, cs.id % MEISTER_SHARD_COUNT == MEISTER_SHARD_INDEX, and publishes its
+best candidates to a shared queue table. A single placer, elected with an
+advisory lock, takes the candidates of all shards from the queue and does
+the selection for the whole cluster.
+
+Every shard replaces its candidates in the queue when it publishes and
+publishes at most MEISTER_SHARD_QUEUE_SIZE of them, so the queue is bounded.
+Candidates of shards that did not publish for a while are ignored.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import socket
+
+import farnsworth.config
+from farnsworth.models.job import Job
+
+import meister.log
+import meister.upsert as upsert
+
+LOG = meister.log.LOG.getChild('shards')
+
+
+def _index():
+    # Replicas of a StatefulSet are named <name>-<ordinal>
+    index = os.environ.get('MEISTER_SHARD_INDEX')
+    if index is None:
+        _, _, ordinal = socket.gethostname().rpartition('-')
+        index = ordinal if ordinal.isdigit() else '0'
+    return int(index)
+
+
+SHARD_COUNT = int(os.environ.get('MEISTER_SHARD_COUNT', '1'))
+# Defaults to the ordinal at the end of the host name
+SHARD_INDEX = _index()
+# Candidates published per shard
+QUEUE_SIZE = int(os.environ.get('MEISTER_SHARD_QUEUE_SIZE', '2000'))
+# Seconds after which the candidates of a shard are ignored
+STALE = int(os.environ.get('MEISTER_SHARD_STALE', '300'))
+# Advisory lock the placer is elected with, see meister.leader
+PLACER_LOCK = int(os.environ.get('MEISTER_SHARD_PLACER_LOCK', '4243'))
+
+TABLE = 'meister_candidates'
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    shard integer NOT NULL,
+    rank integer NOT NULL,
+    job_id integer NOT NULL,
+    priority bigint NOT NULL,
+    published_at timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (shard, job_id)
+)
+""".format(table=TABLE)
+
+
+def is_sharded():
+    """Check if candidate generation is sharded."""
+    return SHARD_COUNT > 1
+
+
+def owns(cs_id, count=SHARD_COUNT, index=SHARD_INDEX):
+    """Check if the challenge set cs_id belongs to shard index."""
+    return cs_id % count == index
+
+
+class CandidateQueue(object):
+    """Shared, bounded queue of the best candidates of every shard."""
+
+    def __init__(self, database=None, shard=SHARD_INDEX, size=QUEUE_SIZE, stale=STALE):
+        self.database = database if database is not None else farnsworth.config.master_db
+        self.shard = shard
+        self.size = size
+        self.stale = stale
+
+    def install(self):
+        """Create the queue table."""
+        self.database.execute_sql(CREATE_TABLE)
+        LOG.info("Publishing candidates of shard %d of %d", self.shard, SHARD_COUNT)
+
+    def publish(self, candidates):
+        """Replace the candidates of our shard with (job, priority) candidates.
+
+        Candidates are expected best first, only the first size of them are
+        published.
+        """
+        candidates = candidates[:self.size]
+        with self.database.atomic():
+            self.database.execute_sql('DELETE FROM {} WHERE shard = %s'.format(TABLE),
+                                      (self.shard,))
+            for chunk in upsert.chunks(list(enumerate(candidates))):
+                values, params = [], []
+                for rank, (job, priority) in chunk:
+                    values.append('(%s, %s, %s, %s)')
+                    params.extend([self.shard, rank, job.id, priority])
+                self.database.execute_sql(
+                    'INSERT INTO {} (shard, rank, job_id, priority) VALUES {}'.format(
+                        TABLE, ', '.join(values)),
+                    params)
+        LOG.debug("Published %d candidates of shard %d", len(candidates), self.shard)
+
+    def take(self):
+        """Yield the (job, priority) candidates of all shards, best first.
+
+        Candidates are ordered by priority and then by their rank within
+        their shard. Jobs are read from the job table in batches as they are
+        consumed, jobs that completed since they were published are skipped.
+        """
+        cursor = self.database.execute_sql(
+            'SELECT job_id, max(priority), min(rank) FROM {} '
+            'WHERE published_at > now() - %s * interval \'1 second\' '
+            'GROUP BY job_id ORDER BY 2 DESC, 3 ASC'.format(TABLE),
+            (self.stale,))
+        rows = cursor.fetchall()
+        LOG.debug("Taking up to %d candidates from the queue", len(rows))
+
+        for chunk in upsert.chunks(rows):
+            jobs = dict((job.id, job) for job in Job.select()
+                                                    .where(Job.id << [r[0] for r in chunk]))
+            for job_id, priority, _ in chunk:
+                job = jobs.get(job_id)
+                if job is None or job.completed_at is not None:
+                    continue
+                yield job, priority
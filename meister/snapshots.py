@@ -0,0 +1,240 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Per-cycle snapshots shared by all creators.
+
+A snapshot is loaded lazily with a few set-based queries the first time a
+creator needs it and is not changed afterwards. The scheduler hands a fresh
+snapshot to all creators every scheduling cycle.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from farnsworth.models import (ChallengeBinaryNode,
+                               ChallengeSet,
+                               ChallengeSetFielding,
+                               Crash,
+                               Exploit,
+                               IDSRule,
+                               IDSRuleFielding,
+                               PovTestResult,
+                               Team,
+                               TracerCache)
+
+import meister.log
+import meister.shards as shards
+
+LOG = meister.log.LOG.getChild('snapshots')
+
+
+class Snapshot(object):
+    """Lazily loaded, immutable view of the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def __getstate__(self):
+        # Snapshots are sent to creator processes, the lock stays here
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        raise NotImplementedError("_load must be implemented by a snapshot")
+
+    def load(self):
+        """Load the snapshot unless it has been loaded already."""
+        # Creators run in parallel, only the first one loads the snapshot
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+        return self
+
+
+def _memoized(name):
+    # Read ChallengeSet.<name> only once per snapshot
+    def getter(self):
+        if name not in self._values:
+            self._values[name] = getattr(self.cs, name)
+        return self._values[name]
+    return property(getter, doc="ChallengeSet.{}, read once.".format(name))
+
+
+class ChallengeSetStatus(object):
+    """Status of a single challenge set.
+
+    The original binaries, crashes and tracer cache are loaded for all
+    challenge sets at once, the remaining flags are read on first use.
+    """
+
+    def __init__(self, cs, cbns, found_crash, has_tracer_cache):
+        self.cs = cs
+        self.cbns = cbns
+        self.is_multi_cbn = len(cbns) > 1
+        self.found_crash = found_crash
+        self.has_tracer_cache = has_tracer_cache
+        self._values = {}
+
+    has_type1 = _memoized('has_type1')
+    has_type2 = _memoized('has_type2')
+    has_circumstantial_type2 = _memoized('has_circumstantial_type2')
+    completed_caching = _memoized('completed_caching')
+    completed_function_identification = _memoized('completed_function_identification')
+    function_identification_started_at = _memoized('function_identification_started_at')
+    fuzzer_stat = _memoized('fuzzer_stat')
+
+
+class ChallengeSetSnapshot(Snapshot):
+    """Fielded challenge sets, their original binaries and their status."""
+
+    def __init__(self, round_=None):
+        super(ChallengeSetSnapshot, self).__init__()
+        self.round_ = round_
+        self._challenge_sets = []
+        self._status = {}
+
+    def _load(self):
+        self._challenge_sets = list(ChallengeSet.fielded_in_round(self.round_))
+        if shards.is_sharded():
+            # Only the challenge sets of our shard, see meister.shards
+            self._challenge_sets = [cs for cs in self._challenge_sets if shards.owns(cs.id)]
+        cs_ids = [cs.id for cs in self._challenge_sets]
+        if not cs_ids:
+            return
+
+        cbns = {}
+        for cbn in ChallengeBinaryNode.select() \
+                                      .where((ChallengeBinaryNode.cs << cs_ids) &
+                                             ChallengeBinaryNode.root.is_null(True)) \
+                                      .order_by(ChallengeBinaryNode.id.asc()):
+            cbns.setdefault(cbn.cs_id, []).append(cbn)
+
+        crashed = set(cs_id for cs_id, in Crash.select(Crash.cs)
+                                               .where(Crash.cs << cs_ids)
+                                               .distinct()
+                                               .tuples())
+        cached = set(cs_id for cs_id, in TracerCache.select(TracerCache.cs)
+                                                    .where(TracerCache.cs << cs_ids)
+                                                    .distinct()
+                                                    .tuples())
+
+        for cs in self._challenge_sets:
+            self._status[cs.id] = ChallengeSetStatus(cs, cbns.get(cs.id, []),
+                                                     cs.id in crashed, cs.id in cached)
+        LOG.debug("Loaded %d fielded challenge sets", len(self._challenge_sets))
+
+    @property
+    def challenge_sets(self):
+        """Return the fielded challenge sets."""
+        return self.load()._challenge_sets
+
+    def status(self, cs):
+        """Return the status of a fielded challenge set."""
+        return self.load()._status[cs.id]
+
+
+def _latest(rows, key):
+    # Rows are recorded as they become known, the latest one has the highest id
+    latest = {}
+    for row in rows:
+        k = key(row)
+        if k not in latest or row.id > latest[k].id:
+            latest[k] = row
+    return latest
+
+
+class FieldingSnapshot(Snapshot):
+    """Latest fieldings of the opponents and the best PoV test results.
+
+    Replaces ChallengeSetFielding.latest(), IDSRuleFielding.latest(),
+    PovTestResult.best() and PovTestResult.best_exploit_test_results() for
+    every (team, challenge set) pair.
+    """
+
+    def __init__(self, challenge_sets=None):
+        super(FieldingSnapshot, self).__init__()
+        self.challenge_sets = challenge_sets if challenge_sets is not None \
+            else ChallengeSetSnapshot()
+        self._opponents = []
+        self._cs_fieldings = {}
+        self._ids_fieldings = {}
+        self._best_results = {}
+        self._tested = {}
+        self._exploit_ids = {}
+
+    def _load(self):
+        self._opponents = list(Team.opponents())
+        cs_ids = [cs.id for cs in self.challenge_sets.challenge_sets]
+        team_ids = [team.id for team in self._opponents]
+        if not cs_ids or not team_ids:
+            return
+
+        self._cs_fieldings = _latest(
+            ChallengeSetFielding.select()
+                                .where((ChallengeSetFielding.cs << cs_ids) &
+                                       (ChallengeSetFielding.team << team_ids)),
+            lambda f: (f.team_id, f.cs_id))
+
+        self._ids_fieldings = _latest(
+            IDSRuleFielding.select(IDSRuleFielding, IDSRule)
+                           .join(IDSRule)
+                           .where((IDSRule.cs << cs_ids) &
+                                  (IDSRuleFielding.team << team_ids)),
+            lambda f: (f.team_id, f.ids_rule.cs_id))
+
+        cs_fielding_ids = [f.id for f in self._cs_fieldings.values()]
+        if cs_fielding_ids:
+            for result in PovTestResult.select() \
+                                       .where(PovTestResult.cs_fielding << cs_fielding_ids):
+                key = (result.cs_fielding_id, result.ids_fielding_id)
+                best = self._best_results.get(key)
+                if best is None or result.num_success > best.num_success:
+                    self._best_results[key] = result
+                self._tested.setdefault(key, set()).add(result.exploit_id)
+
+        for exploit_id, cs_id in Exploit.select(Exploit.id, Exploit.cs) \
+                                        .where(Exploit.cs << cs_ids) \
+                                        .order_by(Exploit.id.asc()) \
+                                        .tuples():
+            self._exploit_ids.setdefault(cs_id, []).append(exploit_id)
+
+        LOG.debug("Loaded %d CS fieldings, %d IDS fieldings and %d PoV test results",
+                  len(self._cs_fieldings), len(self._ids_fieldings),
+                  sum(len(t) for t in self._tested.values()))
+
+    @property
+    def opponents(self):
+        """Return the opponent teams."""
+        return self.load()._opponents
+
+    def latest_cs_fielding(self, team, cs):
+        """Return the latest fielding of cs by team, or None."""
+        return self.load()._cs_fieldings.get((team.id, cs.id))
+
+    def latest_ids_fielding(self, team, cs):
+        """Return the latest IDS rule fielding for cs by team, or None."""
+        return self.load()._ids_fieldings.get((team.id, cs.id))
+
+    @staticmethod
+    def _key(cs_fielding, ids_fielding):
+        return (cs_fielding.id, ids_fielding.id if ids_fielding is not None else None)
+
+    def best_result(self, cs_fielding, ids_fielding):
+        """Return the PoV test result with the most successes, or None."""
+        return self.load()._best_results.get(self._key(cs_fielding, ids_fielding))
+
+    def is_tested(self, exploit_id, cs_fielding, ids_fielding):
+        """Check if the exploit has been tested against the fieldings."""
+        return exploit_id in self.load()._tested.get(self._key(cs_fielding, ids_fielding), ())
+
+    def exploit_ids(self, cs):
+        """Return the ids of all exploits for cs."""
+        return self.load()._exploit_ids.get(cs.id, [])
@@ -0,0 +1,217 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Bulk job upserts.
+
+Resolve many candidate jobs against the job table at once instead of one
+get_or_create() and save() per job. A candidate matches a row if all its
+dirty fields are equal, exactly like get_or_create(**dirty_fields).
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import OrderedDict
+import itertools
+import json
+import operator
+import os
+
+import meister.log
+
+LOG = meister.log.LOG.getChild('upsert')
+
+# Number of candidates resolved with a single lookup and insert
+UPSERT_BATCH_SIZE = int(os.environ.get('MEISTER_UPSERT_BATCH_SIZE', '100'))
+
+
+def _normalize(value):
+    # Payloads are dicts, they are compared the way the database does
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def dirty_names(job):
+    """Return the sorted names of the dirty fields of a job."""
+    return tuple(sorted(f.name for f in job.dirty_fields))
+
+
+def fingerprint(job, names=None):
+    """Return a hashable key of a job's class and its field values.
+
+    :keyword names: The fields to use (default: the job's dirty fields).
+    """
+    if names is None:
+        names = dirty_names(job)
+    # _data holds the ids of related objects, not the objects themselves
+    return (type(job),) + tuple((n, _normalize(job._data.get(n))) for n in names)
+
+
+def chunks(iterable, size=UPSERT_BATCH_SIZE):
+    """Split iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _quote(name):
+    return '"{}"'.format(name)
+
+
+def lookup(model, jobs):
+    """Return a dict of fingerprint to existing row for jobs of model.
+
+    All jobs are looked up with a single query, if there are several rows
+    for a job, the oldest one wins.
+    """
+    name_sets = set(dirty_names(j) for j in jobs)
+    clauses = []
+    for job in jobs:
+        clauses.append(reduce(operator.and_, [getattr(model, n) == job._data.get(n)
+                                             for n in dirty_names(job)]))
+
+    found = {}
+    if not clauses:
+        return found
+    query = model.select().where(reduce(operator.or_, clauses)).order_by(model.id.asc())
+    for row in query:
+        for names in name_sets:
+            found.setdefault(fingerprint(row, names), row)
+    return found
+
+
+def insert(model, missing):
+    """Insert jobs of model with one multi-row INSERT.
+
+    :param missing: A dict of fingerprint to (job, priority).
+
+    Rows conflicting with a unique constraint are skipped. Returns a dict of
+    fingerprint to the inserted row, the jobs themselves are left untouched
+    because creators might yield them again.
+    """
+    pk = model._meta.primary_key
+    jobs = [job for job, _ in missing.values()]
+    names = sorted(set(n for j in jobs for n in j._data) - set([pk.name, 'priority']))
+    fields = [model._meta.fields[n] for n in names] + [model.priority]
+
+    rows, params = [], []
+    for job, priority in missing.values():
+        values = []
+        for field in fields[:-1]:
+            if field.name in job._data:
+                values.append('%s')
+                params.append(field.db_value(job._data[field.name]))
+            else:
+                values.append('DEFAULT')
+        values.append('%s')
+        params.append(priority)
+        rows.append('({})'.format(', '.join(values)))
+
+    columns = ', '.join(_quote(f.db_column) for f in fields)
+    sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING RETURNING {}, {}'.format(
+        _quote(model._meta.db_table), columns, ', '.join(rows), _quote(pk.db_column), columns)
+    cursor = model._meta.database.execute_sql(sql, params)
+
+    name_sets = set(dirty_names(j) for j in jobs)
+
+    created = {}
+    for values in cursor.fetchall():
+        row = model()
+        row._data[pk.name] = pk.python_value(values[0])
+        for field, value in zip(fields, values[1:]):
+            row._data[field.name] = field.python_value(value)
+        for names in name_sets:
+            fp = fingerprint(row, names)
+            if fp in missing and fp not in created:
+                created[fp] = row
+    return created
+
+
+def upsert(candidates):
+    """Resolve (job, priority) candidates against the job table.
+
+    Candidates are grouped by job class, each group takes one lookup for
+    existing rows and one insert for the missing ones, which are created
+    with their candidate priority. Returns (job, priority, created) tuples
+    in the order of candidates, where job is the row in the job table.
+    """
+    resolved = {}
+    groups = OrderedDict()
+    for job, priority in candidates:
+        if not job.dirty_fields:
+            # Without dirty fields everything matches, keep get_or_create() semantics
+            row, created = type(job).get_or_create()
+            resolved[id(job)] = (row, created)
+            continue
+        groups.setdefault(type(job), []).append((job, priority, fingerprint(job)))
+
+    for model, group in groups.items():
+        found = lookup(model, [j for j, _, _ in group])
+
+        missing = OrderedDict()
+        for job, priority, fp in group:
+            if fp not in found and fp not in missing:
+                missing[fp] = (job, priority)
+
+        created = insert(model, missing) if missing else {}
+        conflicting = [j for fp, (j, _) in missing.items() if fp not in created]
+        if conflicting:
+            LOG.debug("%d %s rows were created concurrently, looking them up again",
+                      len(conflicting), model.__name__)
+            found.update(lookup(model, conflicting))
+
+        for job, _, fp in group:
+            if fp in created:
+                resolved[id(job)] = (created[fp], True)
+            elif fp in found:
+                resolved[id(job)] = (found[fp], False)
+            else:
+                # Values that do not come back from the database the way they
+                # went in (datetimes, floats, JSON with non-string keys or
+                # tuples) do not match their row by fingerprint, the database
+                # still matches them.
+                LOG.warning("%s row with %s did not match by fingerprint, using get_or_create",
+                            model.__name__, fp[1:])
+                fields = dict((n, job._data.get(n)) for n in dirty_names(job))
+                resolved[id(job)] = model.get_or_create(**fields)
+
+    return [(resolved[id(job)][0], priority, resolved[id(job)][1])
+            for job, priority in candidates]
+
+
+def _by_table(pairs):
+    # Job types may share a table, group (job, value) pairs by it
+    tables = OrderedDict()
+    for job, value in pairs:
+        tables.setdefault(type(job)._meta.db_table, (type(job), OrderedDict()))[1][job.id] = value
+    return tables.values()
+
+
+def update_priorities(changes):
+    """Set the priority of (job, priority) pairs with one UPDATE per table.
+
+    The priority of the jobs themselves is updated as well.
+    """
+    for job, priority in changes:
+        job.priority = priority
+
+    for model, priorities in _by_table(changes):
+        pk = model._meta.primary_key
+        sql = 'UPDATE {table} SET {priority} = v.priority FROM (VALUES {values}) ' \
+              'AS v(id, priority) WHERE {table}.{pk} = v.id RETURNING {table}.{pk}'.format(
+                  table=_quote(model._meta.db_table),
+                  priority=_quote(model.priority.db_column),
+                  values=', '.join(['(%s, %s)'] * len(priorities)),
+                  pk=_quote(pk.db_column))
+        params = list(itertools.chain.from_iterable(priorities.items()))
+        cursor = model._meta.database.execute_sql(sql, params)
+        LOG.debug("Updated priority of %d %s rows", len(cursor.fetchall()), model.__name__)
+
+
+def reset_completed(jobs):
+    """Mark jobs as not completed with one UPDATE per table."""
+    for model, ids in _by_table((j, None) for j in jobs):
+        model.update(completed_at=None).where(model.id << ids.keys()).execute()
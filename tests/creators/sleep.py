@@ -13,14 +13,17 @@ LOG = meister.creators.LOG.getChild('sleeper')
 
 class SleepCreator(meister.creators.BaseCreator):
 
+    # Seconds to sleep after every job
+    sleep = 10
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
     @property
     def _jobs(self):
         LOG.debug("Collecting jobs")
-        for cs in range(1, 5):
-            job = IDSJob(payload={'cs_id': cs}, request_cpu=1, request_memory=1024)
-            LOG.debug("Yielding for SleepCreator %s", cs)
+        for cs in self.challenge_sets():
+            job = IDSJob(cs=cs, payload={'cs_id': cs.id}, request_cpu=1, request_memory=1024)
+            LOG.debug("Yielding for SleepCreator %s", cs.id)
             yield (job, 15)
-            time.sleep(10)
+            time.sleep(self.sleep)
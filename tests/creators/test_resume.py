@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import unittest
+
+from farnsworth.models import ChallengeSet
+from farnsworth.models.job import IDSJob
+
+import meister.creators
+from tests.creators.exception import ExceptionCreator
+from tests.creators.sleep import SleepCreator
+
+
+class _Snapshot(object):
+
+    def __init__(self, cs_ids):
+        self.challenge_sets = [ChallengeSet(id=cs_id, name="cs{}".format(cs_id))
+                               for cs_id in cs_ids]
+
+
+def _cs_ids(jobs):
+    return sorted(job.cs_id for job, _ in jobs)
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.time_limit = meister.creators.JOBS_TIME_LIMIT
+        meister.creators.JOBS_TIME_LIMIT = 1
+
+    def tearDown(self):
+        meister.creators.JOBS_TIME_LIMIT = self.time_limit
+
+    def test_failing_creator_serves_remembered_jobs(self):
+        creator = ExceptionCreator()
+        creator.snapshot = _Snapshot([1, 2])
+        remembered = dict((cs.id, [(IDSJob(cs=cs, request_cpu=1), 20)])
+                          for cs in creator.snapshot.challenge_sets)
+        creator._remember(remembered)
+
+        self.assertEqual(_cs_ids(creator.jobs), [1, 2])
+        self.assertTrue(creator._failed)
+
+    def test_creator_continues_where_it_stopped(self):
+        creator = SleepCreator()
+        creator.snapshot = _Snapshot([1, 2, 3, 4])
+        creator.sleep = 0
+        self.assertEqual(_cs_ids(creator.jobs), [1, 2, 3, 4])
+        self.assertIsNone(creator._cursor)
+
+        # Three jobs fit into the time limit, the fourth one is remembered
+        creator.sleep = 0.4
+        jobs = list(creator.jobs)
+        self.assertTrue(creator._failed)
+        self.assertEqual(_cs_ids(jobs), [1, 2, 3, 4])
+        self.assertEqual(creator._cursor, 3)
+
+        # Starts at 3, gets to 1 and serves 2 from memory
+        self.assertEqual(_cs_ids(creator.jobs), [1, 2, 3, 4])
+        self.assertEqual(creator._cursor, 1)
+        self.assertEqual([cs.id for cs in creator.challenge_sets()], [1, 2, 3, 4])
+
+    def test_ordered_creator_only_continues(self):
+        creator = SleepCreator()
+        creator.ordered = True
+        creator.snapshot = _Snapshot([1, 2, 3, 4])
+        creator.sleep = 0
+        list(creator.jobs)
+
+        creator.sleep = 0.4
+        self.assertEqual(_cs_ids(creator.jobs), [1, 2, 3])
+        self.assertEqual(creator._cursor, 3)
+        self.assertEqual([cs.id for cs in creator.challenge_sets()], [3, 4, 1, 2])
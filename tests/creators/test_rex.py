@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import itertools
+import unittest
+
+import farnsworth.config
+from farnsworth.models import AFLJob, ChallengeSet, Crash
+import peewee
+
+from meister.creators.rex import FEED_LIMIT, NON_EXPLOITABLE, PRIORITY_MAP, RexCreator
+
+
+def _old_crashes(cs):
+    """Select the crashes of cs like Rex did with one query per kind and pc."""
+    crashes = cs.crashes.where(~(Crash.kind << NON_EXPLOITABLE) & (Crash.triaged != True))
+    encountered = crashes.select(peewee.fn.Distinct(Crash.crash_pc)) \
+                         .where((Crash.explored) | (Crash.exploited))
+
+    selected = {}
+    for kind in PRIORITY_MAP:
+        high = crashes.select(Crash.id).where((Crash.kind == kind) &
+                                              ~(Crash.crash_pc << encountered)) \
+                                       .order_by(Crash.bb_count.asc())
+        low = crashes.select(Crash.id).where((Crash.kind == kind) &
+                                             (Crash.crash_pc << encountered)) \
+                                      .order_by(Crash.bb_count.asc())
+        ids = [c.id for c in itertools.islice(itertools.chain(high, low), FEED_LIMIT)]
+        if ids:
+            selected[kind] = ids
+    return selected
+
+
+class TestRexCrashes(unittest.TestCase):
+    """Compare the ranking query with the old selection on the real schema."""
+
+    def setUp(self):
+        try:
+            farnsworth.config.master_db.get_conn()
+        except peewee.OperationalError, e:
+            raise unittest.SkipTest("No database: {}".format(e))
+        self.transaction = farnsworth.config.master_db.atomic()
+        self.transaction.__enter__()
+
+    def tearDown(self):
+        self.transaction.rollback()
+        self.transaction.__exit__(None, None, None)
+
+    def test_same_crashes_as_old_selection(self):
+        cs = ChallengeSet.create(name="rex_ranking")
+        job = AFLJob.create(cs=cs)
+        kinds = ['ip_overwrite', 'arbitrary_read', 'write_what_where', 'null_dereference']
+        for i in range(60):
+            Crash.create(cs=cs, job=job, blob=str(i), kind=kinds[i % len(kinds)],
+                         # Some pcs were explored or exploited already
+                         crash_pc=0x8048000 + i % 7 if i % 11 else None,
+                         explored=i % 5 == 0, exploited=i % 13 == 0,
+                         triaged=i % 17 == 0,
+                         # Distinct, so that both orders are well defined
+                         bb_count=1000 - i * 7 % 60)
+
+        new = {}
+        for crash_id, kind, rank in RexCreator._crashes([cs.id]).get(cs.id, []):
+            self.assertEqual(rank, len(new.get(kind, [])) + 1)
+            new.setdefault(kind, []).append(crash_id)
+        self.assertEqual(new, _old_crashes(cs))
+        self.assertNotIn('null_dereference', new)
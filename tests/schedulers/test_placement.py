@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from meister.schedulers import placement
+
+GiB = 1024 ** 3
+
+
+def _node(cpu, memory=16, pods=10):
+    return {'cpu': cpu, 'memory': memory * GiB, 'pods': pods}
+
+
+def _requests(cpu, memory=1):
+    return {'cpu': cpu, 'memory': memory * GiB, 'pods': 1}
+
+
+class TestPlacement(unittest.TestCase):
+
+    def test_aggregate_capacity_is_not_enough(self):
+        nodes = placement.Placement({'a': _node(4), 'b': _node(4)})
+        self.assertGreaterEqual(nodes.total['cpu'], 6)
+        self.assertFalse(nodes.fits(_requests(6)))
+        self.assertIsNone(nodes.place(_requests(6)))
+        self.assertTrue(nodes.fits(_requests(4)))
+
+    def test_memory_has_to_fit_on_the_same_node(self):
+        nodes = placement.Placement({'a': _node(8, memory=4), 'b': _node(1, memory=32)})
+        # Enough cpu on a, enough memory on b, not both on either
+        self.assertIsNone(nodes.best_fit(_requests(2, memory=8)))
+
+    def test_best_fit_takes_the_tightest_node(self):
+        nodes = placement.Placement({'a': _node(8), 'b': _node(4), 'c': _node(16)})
+        self.assertEqual(nodes.place(_requests(3)), 'b')
+        self.assertEqual(nodes.place(_requests(3)), 'a')
+        self.assertEqual(nodes.free['b']['cpu'], 1)
+        self.assertEqual(nodes.free['b']['pods'], 9)
+
+    def test_release_frees_the_node(self):
+        nodes = placement.Placement({'a': _node(4)})
+        node = nodes.place(_requests(4))
+        self.assertFalse(nodes.fits(_requests(1)))
+        nodes.release(node, _requests(4))
+        self.assertEqual(nodes.free, {'a': _node(4)})
+
+    def test_pods_are_a_resource(self):
+        nodes = placement.Placement({'a': _node(16, pods=2)})
+        self.assertIsNotNone(nodes.place(_requests(1)))
+        self.assertIsNotNone(nodes.place(_requests(1)))
+        self.assertIsNone(nodes.place(_requests(1)))
+
+    def test_pack_places_large_jobs_first(self):
+        nodes = placement.Placement({'a': _node(4), 'b': _node(4)})
+        # In this order, the small jobs would split up both nodes
+        items = [(1, _requests(1)), (2, _requests(1)), (3, _requests(3)), (4, _requests(3))]
+        placed, unplaced = nodes.pack(items)
+        self.assertEqual(unplaced, [])
+        self.assertEqual(sorted(placed), [1, 2, 3, 4])
+        self.assertNotEqual(placed[3], placed[4])
+
+    def test_pack_keeps_the_order_of_unplaced_jobs(self):
+        nodes = placement.Placement({'a': _node(4)})
+        items = [(1, _requests(5)), (2, _requests(2)), (3, _requests(6)), (4, _requests(2))]
+        placed, unplaced = nodes.pack(items)
+        self.assertEqual(sorted(placed), [2, 4])
+        self.assertEqual(unplaced, [1, 3])
+
+    def test_pack_without_nodes(self):
+        placed, unplaced = placement.Placement({}).pack([(1, _requests(1))])
+        self.assertEqual((placed, unplaced), ({}, [1]))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from meister.schedulers import rightsizing
+
+
+def _field(name):
+    def _get(self):
+        return self._data.get(name)
+
+    def _set(self, value):
+        self._data[name] = value
+        self._dirty.add(name)
+    return property(_get, _set)
+
+
+class _Job(object):
+    """Keeps its fields in _data like a peewee model."""
+
+    request_cpu = _field('request_cpu')
+    request_memory = _field('request_memory')
+
+    def __init__(self, **fields):
+        self._data = {}
+        self._dirty = set()
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.worker = 'afl'
+        self.cs_id = 1
+
+
+class TestRightSizer(unittest.TestCase):
+
+    def setUp(self):
+        self.rightsizer = rightsizing.RightSizer(None, mode='apply', state_file=None)
+        self.rightsizer.samples['afl'] = {'cpu': [1.] * rightsizing.MIN_SAMPLES,
+                                          'memory': [1000.] * rightsizing.MIN_SAMPLES}
+
+    def test_applies_to_a_copy(self):
+        job = _Job(request_cpu=4, request_memory=4096)
+        adjusted = self.rightsizer.adjust(job)
+        self.assertEqual((adjusted.request_cpu, adjusted.request_memory), (1.2, 1200))
+        self.assertEqual((job.request_cpu, job.request_memory), (4, 4096))
+
+    def test_applying_twice_to_the_same_row(self):
+        job = _Job(request_cpu=4, request_memory=4096)
+        first = self.rightsizer.adjust(job)
+        second = self.rightsizer.adjust(job)
+        self.assertEqual((first.request_cpu, first.request_memory),
+                         (second.request_cpu, second.request_memory))
+        self.assertEqual((job.request_cpu, job.request_memory), (4, 4096))
+
+    def test_recommend_mode_schedules_the_row(self):
+        self.rightsizer.mode = 'recommend'
+        job = _Job(request_cpu=4, request_memory=4096)
+        self.assertIs(self.rightsizer.adjust(job), job)
+        self.assertEqual((job.request_cpu, job.request_memory), (4, 4096))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import itertools
+import random
+import time
+import unittest
+
+from meister.schedulers import placement, selection
+
+GiB = 1024 ** 3
+
+
+def _requests(cpu, memory=1):
+    return {'cpu': cpu, 'memory': memory * GiB, 'pods': 1}
+
+
+def _greedy(capacities, items):
+    # Take items in order, skip the ones that do not fit
+    nodes = placement.Placement(capacities)
+    value = 0
+    for _, requests, item_value in items:
+        if nodes.place(requests) is not None:
+            value += item_value
+    return value
+
+
+def _value(items, selected):
+    return sum(value for key, _, value in items if key in selected)
+
+
+class TestSelection(unittest.TestCase):
+
+    def test_skips_jobs_that_do_not_fit(self):
+        capacities = {'a': {'cpu': 4, 'memory': 16 * GiB, 'pods': 10}}
+        items = [(1, _requests(3), 100), (2, _requests(2), 90), (3, _requests(1), 80)]
+        selected = selection.select(capacities, items, time_limit=0)
+        self.assertEqual(sorted(selected), [1, 3])
+
+    def test_first_solution_is_greedy(self):
+        capacities = {'a': {'cpu': 8, 'memory': 32 * GiB, 'pods': 10},
+                      'b': {'cpu': 4, 'memory': 16 * GiB, 'pods': 10}}
+        rnd = random.Random(1)
+        items = [(i, _requests(rnd.randint(1, 4), rnd.randint(1, 8)), rnd.randint(1, 100))
+                 for i in range(30)]
+        selected = selection.select(capacities, items, time_limit=0)
+        self.assertEqual(_value(items, selected), _greedy(capacities, items))
+
+    def test_finds_optimum_of_small_knapsack(self):
+        capacities = {'a': {'cpu': 10, 'memory': 64 * GiB, 'pods': 10}}
+        # Greedy takes the 6 and the 4 cores, both 5 cores are worth more
+        items = [(1, _requests(6), 10), (2, _requests(5), 9), (3, _requests(5), 9),
+                 (4, _requests(4), 1)]
+        best = 0
+        for count in range(len(items) + 1):
+            for subset in itertools.combinations(items, count):
+                if sum(requests['cpu'] for _, requests, _ in subset) <= 10:
+                    best = max(best, sum(value for _, _, value in subset))
+
+        search = selection.Selection(capacities, items, time_limit=10)
+        selected = search.solve()
+        self.assertTrue(search.complete)
+        self.assertEqual(_value(items, selected), best)
+        self.assertGreater(best, _greedy(capacities, items))
+
+    def test_selection_fits_on_nodes(self):
+        capacities = {'a': {'cpu': 4, 'memory': 16 * GiB, 'pods': 10},
+                      'b': {'cpu': 4, 'memory': 16 * GiB, 'pods': 10}}
+        # Aggregated there are 8 cores, but no node holds more than 4
+        items = [(1, _requests(6), 100), (2, _requests(3), 10), (3, _requests(3), 10),
+                 (4, _requests(2), 5)]
+        selected = selection.select(capacities, items, time_limit=1)
+        self.assertNotIn(1, selected)
+        requests = dict((key, item_requests) for key, item_requests, _ in items)
+        nodes = placement.Placement(capacities)
+        for key, node in selected.items():
+            nodes.reserve(node, requests[key])
+        for free in nodes.free.values():
+            self.assertTrue(all(free[r] >= 0 for r in placement.RESOURCES))
+
+    def test_large_selection_stops_at_time_limit(self):
+        capacities = dict(('node{}'.format(n), {'cpu': 32, 'memory': 128 * GiB, 'pods': 110})
+                          for n in range(20))
+        rnd = random.Random(2)
+        items = [(i, _requests(rnd.choice([0.5, 1, 2, 4, 8]), rnd.randint(1, 32)),
+                  rnd.randint(1, 1000))
+                 for i in range(5000)]
+        items.sort(key=lambda item: item[2], reverse=True)
+        greedy = _greedy(capacities, items)
+
+        self.assertEqual(_value(items, selection.select(capacities, items, time_limit=0)),
+                         greedy)
+
+        time_limit = 0.2
+        started = time.time()
+        search = selection.Selection(capacities, items, time_limit=time_limit)
+        selected = search.solve()
+        elapsed = time.time() - started
+        self.assertGreaterEqual(_value(items, selected), greedy)
+        # Setting up and the greedy descent come on top of the time limit
+        self.assertLess(elapsed, time_limit + 1.5)
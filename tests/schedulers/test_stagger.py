@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import calendar
+import time
+import unittest
+
+from meister.schedulers import stagger
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+class _Pod(object):
+
+    def __init__(self, created, started=None):
+        status = {'phase': 'Pending'}
+        if started is not None:
+            status = {'phase': 'Running', 'startTime': _timestamp(started)}
+        self.obj = {'metadata': {'creationTimestamp': _timestamp(created)},
+                    'status': status}
+
+
+class TestStaggerController(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = stagger.StaggerController(minimum=8, maximum=1000)
+        self.controller.budget = 64
+        self.now = calendar.timegm(time.gmtime())
+
+    def test_grows_additively_on_a_busy_cluster(self):
+        self.assertEqual(self.controller.update(100, 0, 0, 0.1, 50), 72)
+        self.assertEqual(self.controller.update(100, 0, 0, 0.1, 50), 80)
+
+    def test_grows_fast_on_an_idle_cluster(self):
+        self.assertEqual(self.controller.update(100, 0, 0, 0.9, 50), 128)
+        # Up to the pods that could still be started
+        self.assertEqual(self.controller.update(100, 0, 0, 0.9, 1000), 900)
+
+    def test_halves_on_errors(self):
+        self.assertEqual(self.controller.update(100, 10, 0, 0.9, 1000), 32)
+        self.assertEqual(self.controller.update(100, 10, 0, 0.9, 1000), 16)
+
+    def test_halves_on_conflicts(self):
+        self.assertEqual(self.controller.update(100, 0, 30, 0.1, 50), 32)
+
+    def test_halves_on_slow_starts(self):
+        slow = stagger.TARGET_LATENCY * 2
+        self.controller.observe([_Pod(self.now - slow - 5, started=self.now - 5)], self.now)
+        self.assertEqual(self.controller.update(10, 0, 0, 0.9, 1000), 32)
+        # Latencies are only counted for the cycle they were observed in
+        self.assertEqual(self.controller.update(10, 0, 0, 0.1, 50), 40)
+
+    def test_halves_on_pods_pending_too_long(self):
+        pending = stagger.TARGET_LATENCY * 2
+        self.controller.observe([_Pod(self.now - pending)], self.now)
+        self.assertEqual(self.controller.update(10, 0, 0, 0.9, 1000), 32)
+
+    def test_stays_within_bounds(self):
+        self.controller.budget = 10
+        self.assertEqual(self.controller.update(100, 50, 0, 0.1, 50), 8)
+        self.controller.budget = 995
+        self.assertEqual(self.controller.update(100, 0, 0, 0.1, 50), 1000)
+
+    def test_free_share_is_the_smallest_share(self):
+        self.assertEqual(stagger.free_share({'cpu': 8, 'memory': 2, 'pods': 5},
+                                            {'cpu': 16, 'memory': 8, 'pods': 10}), 0.25)
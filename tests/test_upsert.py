@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import unittest
+
+import meister.upsert as upsert
+
+
+def _store(value):
+    # Like a timestamp(0) column, the database drops the microseconds
+    if isinstance(value, datetime.datetime):
+        return value.replace(microsecond=0)
+    return value
+
+
+class _Field(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _Job(object):
+    """Just enough of a job model for upsert(), the table is rows."""
+
+    rows = []
+
+    def __init__(self, **fields):
+        self._data = dict(fields)
+        self.dirty_fields = [_Field(n) for n in fields]
+        self.id = None
+
+    @classmethod
+    def create(cls, **fields):
+        row = cls(**dict((n, _store(v)) for n, v in fields.items()))
+        row.id = len(cls.rows) + 1
+        cls.rows.append(row)
+        return row
+
+    @classmethod
+    def get_or_create(cls, **fields):
+        # The database compares stored values
+        for row in cls.rows:
+            if row._data == dict((n, _store(v)) for n, v in fields.items()):
+                return row, False
+        return cls.create(**fields), True
+
+
+def _insert(model, missing):
+    created = [model.create(**job._data) for job, _ in missing.values()]
+    return dict((upsert.fingerprint(row), row) for row in created
+                if upsert.fingerprint(row) in missing)
+
+
+class TestUpsert(unittest.TestCase):
+
+    def setUp(self):
+        _Job.rows = []
+        self._lookup, self._insert = upsert.lookup, upsert.insert
+        upsert.lookup = lambda model, jobs: {}
+        upsert.insert = _insert
+
+    def tearDown(self):
+        upsert.lookup, upsert.insert = self._lookup, self._insert
+
+    def test_values_that_do_not_round_trip(self):
+        job = _Job(payload={'a': [1]},
+                   started_at=datetime.datetime(2016, 8, 5, 12, 0, 0, 123456))
+        [(row, priority, _)] = upsert.upsert([(job, 10)])
+        self.assertEqual(priority, 10)
+        # The inserted row is found by the database, not created twice
+        self.assertEqual([r.id for r in _Job.rows], [row.id])
+
+    def test_values_that_round_trip(self):
+        [(row, priority, created)] = upsert.upsert([(_Job(payload={'a': [1]}), 10)])
+        self.assertTrue(created)
+        self.assertEqual(row._data, {'payload': {'a': [1]}})